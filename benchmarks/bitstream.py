@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import biim.mp4.hevc as hevc
+import biim.mpeg2ts.scte as scte
+import biim.util.bitstream as bitstream
+import biim.variant.codec as codec
+from biim.mpeg2ts.crc import crc32
+
+from tests.test_bitstream import LegacyBitStream
+from tests.test_nal import VPS, SPS, PPS
+
+def splice_info_section(descriptors: int) -> bytes:
+  # time_signal with alternating DTMF and time descriptors
+  header = bytes([0x00]) + bytes(5) + bytes([0x00, 0xFF, 0xF0, 0x05, 0x06]) + bytes([0xFE, 0x72, 0xBD, 0x00, 0x50])
+  dtmf = bytes([0x01, 0x08]) + b'CUEI' + bytes([0x0A, 0x40]) + b'12'
+  time = bytes([0x03, 0x10]) + b'CUEI' + bytes(range(12))
+  loop = (dtmf + time) * (descriptors // 2)
+  body = header + len(loop).to_bytes(2, byteorder='big') + loop
+  section = bytes([0xFC, 0x30 | ((len(body) + 4) >> 8), (len(body) + 4) & 0xFF]) + body
+  return section + crc32(section).to_bytes(4, byteorder='big')
+
+def main():
+  parser = argparse.ArgumentParser(description=('BitStream consumers, deque of bits vs integer cursor over memoryview'))
+  parser.add_argument('-n', '--number', type=int, nargs='?', default=1000)
+  parser.add_argument('-r', '--repeat', type=int, nargs='?', default=7)
+  args = parser.parse_args()
+
+  section = splice_info_section(32)
+  cases = [
+    ('hevcTrack (HEVC VPS/SPS/PPS)', lambda: hevc.hevcTrack(1, 90000, VPS, SPS, PPS)),
+    ('hevc_codec_parameter_string', lambda: codec.hevc_codec_parameter_string(SPS)),
+    ('SCTE-35, 32 DTMF/time descriptors', lambda: scte.SpliceInfoSection(section)),
+  ]
+
+  results: dict[str, list[float]] = { name: [] for name, _ in cases }
+  outputs: dict[str, list[object]] = { name: [] for name, _ in cases }
+  for implementation in (LegacyBitStream, bitstream.BitStream):
+    # consumers import BitStream by name, so swap it there
+    for module in (hevc, codec, scte): setattr(module, 'BitStream', implementation)
+    for name, run in cases:
+      result = run()
+      outputs[name].append(len(result.descriptors) if isinstance(result, scte.SpliceInfoSection) else result)
+      results[name].append(min(timeit.repeat(run, number=args.number, repeat=args.repeat)) / args.number)
+  for module in (hevc, codec, scte): setattr(module, 'BitStream', bitstream.BitStream)
+
+  for name, _ in cases:
+    legacy, current = results[name]
+    assert outputs[name][0] == outputs[name][1], name
+    print(f'{name:<36} {legacy * 1e6:8.1f} us -> {current * 1e6:8.1f} us')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biim.util.bitstream import ebsp2rbsp
+
+# HEVC SPS of test stream (1080p Main), escaped at 00 00 03
+HEVC_SPS = bytes.fromhex('42010101600000030090000003000003005da00280802d16595952930bc05a020000030002000003003c10')
+
+def legacy_ebsp2rbsp(data: bytes | bytearray | memoryview) -> bytes:
+  # per-byte loop formerly copied in variant/codec.py, mp4/avc.py and mp4/hevc.py
+  rbsp = bytearray(data[:2])
+  length = len(data)
+  for index in range(2, length):
+    if index < length - 1 and data[index - 2] == 0x00 and data[index - 1] == 0x00 and data[index + 0] == 0x03 and data[index + 1] in (0x00, 0x01, 0x02, 0x03):
+      continue
+    rbsp.append(data[index])
+  return bytes(rbsp)
+
+def sei(size: int, escapes: int) -> bytes:
+  # payload without zero bytes, escapes placed at even intervals
+  rng = random.Random(0)
+  data = bytearray(rng.randrange(1, 256) for _ in range(size))
+  for index in range(1, escapes + 1):
+    begin = size * index // (escapes + 1)
+    data[begin:begin + 4] = b'\x00\x00\x03' + bytes([index % 4])
+  return bytes(data)
+
+def main():
+  parser = argparse.ArgumentParser(description=('ebsp2rbsp, per-byte loop vs find-based'))
+  parser.add_argument('-n', '--number', type=int, nargs='?', default=200)
+  parser.add_argument('-r', '--repeat', type=int, nargs='?', default=3)
+  args = parser.parse_args()
+
+  for name, data in [(f'HEVC SPS ({len(HEVC_SPS)} B)', HEVC_SPS), ('SEI (4 KB, 2 escapes)', sei(4096, 2)), ('SEI (64 KB, no escape)', sei(65536, 0))]:
+    assert legacy_ebsp2rbsp(data) == ebsp2rbsp(data)
+    legacy = min(timeit.repeat(lambda: legacy_ebsp2rbsp(data), number=args.number, repeat=args.repeat)) / args.number
+    current = min(timeit.repeat(lambda: ebsp2rbsp(data), number=args.number, repeat=args.repeat)) / args.number
+    print(f'{name:<24} {legacy * 1e6:10.2f} us -> {current * 1e6:8.2f} us')
+
+if __name__ == '__main__':
+  main()
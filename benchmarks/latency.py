@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+from typing import cast
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biim.mpeg2ts.pes import PES
+from biim.mpeg2ts.h264 import H264PES
+from biim.mpeg2ts.h265 import H265PES
+from biim.mpeg2ts.parser import PESParser
+from biim.mpeg2ts.demuxer import MpegtsDemuxer
+
+from biim.variant.fmp4 import Fmp4VariantHandler
+
+def measure(data: bytes, predict_video_duration: bool, part_duration: float) -> list[float]:
+  # media time (ms) from newest arrived video access unit to end of part completed at that moment
+  handler = Fmp4VariantHandler(target_duration=1, part_target=part_duration, has_video=True, has_audio=True, predict_video_duration=predict_video_duration)
+  latencies: list[float] = []
+  arrived: int | None = None
+
+  continuousPartial = handler.m3u8.continuousPartial
+  def completed(endPTS: int, isIFrame: bool = False) -> None:
+    if arrived is not None: latencies.append((arrived - endPTS) / 90)
+    continuousPartial(endPTS, isIFrame)
+  handler.m3u8.continuousPartial = completed
+
+  def VIDEO(video: H264PES | H265PES):
+    nonlocal arrived
+    if (dts := video.dts() or video.pts()) is not None: arrived = handler.timestamp(dts)
+    if type(video) is H264PES: handler.h264(video)
+    else: handler.h265(cast(H265PES, video))
+
+  demuxer = MpegtsDemuxer(PCR=handler.pcr)
+  demuxer.register(0x1b, lambda PID: (PESParser[H264PES](H264PES), VIDEO), first_only=True)
+  demuxer.register(0x24, lambda PID: (PESParser[H265PES](H265PES), VIDEO), first_only=True)
+  demuxer.register(0x0F, lambda PID: (PESParser[PES](PES), handler.aac), first_only=True)
+  demuxer.push_chunk(data)
+  return latencies
+
+async def main():
+  parser = argparse.ArgumentParser(description=('fMP4 part completion latency, video held back one access unit vs predicted duration'))
+  parser.add_argument('-i', '--input', type=str, required=True)
+  parser.add_argument('-p', '--part_duration', type=float, nargs='?', default=0.1)
+  args = parser.parse_args()
+
+  with open(args.input, 'rb') as file: data = file.read()
+  for name, predict in [('hold', False), ('predict', True)]:
+    latencies = measure(data, predict, args.part_duration)
+    print(f'{name:<8} {len(latencies)} parts, mean {statistics.mean(latencies):.1f} ms, max {max(latencies):.1f} ms')
+
+if __name__ == '__main__':
+  asyncio.run(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+from typing import cast, Any, Iterator, Type
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biim.mpeg2ts import ts
+from biim.mpeg2ts.pes import PES
+from biim.mpeg2ts.parser import PESParser
+
+class LegacyPESParser:
+  # PESParser before reassembly into payload views, payload is appended to one bytearray per PES
+  def __init__(self, _class: Type[PES] = PES):
+    self.pes: bytearray | None = None
+    self.queue: deque[PES] = deque()
+    self._class: Type[PES] = _class
+
+  def __iter__(self) -> Iterator[PES]:
+    return self
+
+  def __next__(self) -> PES:
+    if not self.queue:
+      raise StopIteration()
+    return self.queue.popleft()
+
+  def push(self, packet: bytes | bytearray | memoryview) -> None:
+    begin = ts.HEADER_SIZE + (1 + ts.adaptation_field_length(packet) if ts.has_adaptation_field(packet) else 0)
+    if not ts.payload_unit_start_indicator(packet) and not self.pes: return
+
+    if ts.payload_unit_start_indicator(packet):
+      if self.pes and ((self.pes[4] << 8) | self.pes[5]) == 0:
+        self.queue.append(self._class(self.pes))
+
+      pes_length = (packet[begin + 4] << 8) | packet[begin + 5]
+      if pes_length == 0:
+        next = ts.PACKET_SIZE
+      else:
+        next = min(begin + (PES.HEADER_SIZE + pes_length), ts.PACKET_SIZE)
+      self.pes = bytearray(packet[begin:next])
+    elif self.pes:
+      pes_length = (self.pes[4] << 8) | self.pes[5]
+      if pes_length == 0:
+        next = ts.PACKET_SIZE
+      else:
+        next = min(begin + (PES.HEADER_SIZE + pes_length) - len(self.pes), ts.PACKET_SIZE)
+      self.pes += packet[begin:next]
+    else:
+      return
+
+    if ((self.pes[4] << 8) | self.pes[5]) > 0:
+      if len(self.pes) == PES.HEADER_SIZE + (self.pes[4] << 8 | self.pes[5]):
+        self.queue.append(self._class(self.pes))
+        self.pes = None
+      elif len(self.pes) > PES.HEADER_SIZE + (self.pes[4] << 8 | self.pes[5]):
+        self.pes = None
+
+class LegacyPES:
+  # PES before header fields were decoded once into slots, header is decoded on every accessor call
+  HEADER_SIZE = 6
+
+  def __init__(self, payload: bytes | bytearray | memoryview | list[memoryview] = b''):
+    if type(payload) is list:
+      self.fragments: list[memoryview] = payload
+      self.materialized: memoryview | None = payload[0] if len(payload) == 1 else None
+    else:
+      self.materialized = memoryview(cast(bytes | bytearray | memoryview, payload))
+      self.fragments = [self.materialized]
+    self.length: int = sum(len(fragment) for fragment in self.fragments)
+    head = self.fragments[0] if self.fragments else memoryview(b'')
+    self.header: memoryview = head if len(head) >= LegacyPES.HEADER_SIZE + 3 and len(head) >= LegacyPES.HEADER_SIZE + 3 + head[LegacyPES.HEADER_SIZE + 2] else self.payload
+
+  @property
+  def payload(self) -> memoryview:
+    if self.materialized is None:
+      self.materialized = memoryview(b''.join(self.fragments))
+      self.fragments = [self.materialized]
+    return self.materialized
+
+  def __getitem__(self, item: Any) -> Any:
+    return self.payload[item]
+
+  def __len__(self) -> int:
+    return self.length
+
+  def stream_id(self) -> int:
+    return self.header[3]
+
+  def has_optional_pes_header(self) -> bool:
+    if self.stream_id() in [0b10111100, 0b10111111, 0b11110000, 0b11110001, 0b11110010, 0b11111000, 0b11111111]:
+      return False
+    elif self.stream_id() in [0b10111110]:
+      return False
+    else:
+      return True
+
+  def has_pts(self) -> bool:
+    if self.has_optional_pes_header():
+      return (self.header[LegacyPES.HEADER_SIZE + 1] & 0x80) != 0
+    else:
+      return False
+
+  def has_dts(self) -> bool:
+    if self.has_optional_pes_header():
+      return (self.header[LegacyPES.HEADER_SIZE + 1] & 0x40) != 0
+    else:
+      return False
+
+  def pts(self) -> int | None:
+    if not self.has_pts(): return None
+
+    pts = 0
+    pts <<= 3; pts |= ((self.header[LegacyPES.HEADER_SIZE + 3 + 0] & 0x0E) >> 1)
+    pts <<= 8; pts |= ((self.header[LegacyPES.HEADER_SIZE + 3 + 1] & 0xFF) >> 0)
+    pts <<= 7; pts |= ((self.header[LegacyPES.HEADER_SIZE + 3 + 2] & 0xFE) >> 1)
+    pts <<= 8; pts |= ((self.header[LegacyPES.HEADER_SIZE + 3 + 3] & 0xFF) >> 0)
+    pts <<= 7; pts |= ((self.header[LegacyPES.HEADER_SIZE + 3 + 4] & 0xFE) >> 1)
+    return pts
+
+  def dts(self) -> int | None:
+    if not self.has_dts(): return None
+
+    offset = 8 if self.has_pts() else 3
+    dts = 0
+    dts <<= 3; dts |= ((self.header[LegacyPES.HEADER_SIZE + offset + 0] & 0x0E) >> 1)
+    dts <<= 8; dts |= ((self.header[LegacyPES.HEADER_SIZE + offset + 1] & 0xFF) >> 0)
+    dts <<= 7; dts |= ((self.header[LegacyPES.HEADER_SIZE + offset + 2] & 0xFE) >> 1)
+    dts <<= 8; dts |= ((self.header[LegacyPES.HEADER_SIZE + offset + 3] & 0xFF) >> 0)
+    dts <<= 7; dts |= ((self.header[LegacyPES.HEADER_SIZE + offset + 4] & 0xFE) >> 1)
+    return dts
+
+  def PES_packet_data(self) -> memoryview:
+    if self.has_optional_pes_header():
+      return self.payload[LegacyPES.HEADER_SIZE + 3 + self.header[LegacyPES.HEADER_SIZE + 2]:]
+    else:
+      return self.payload[LegacyPES.HEADER_SIZE:]
+
+def main():
+  parser = argparse.ArgumentParser(description=('PES reassembly (bytearray concatenation vs list of payload views) and header decode (per call vs slots)'))
+  parser.add_argument('-i', '--input', type=str, required=True)
+  parser.add_argument('--pid', type=lambda value: int(value, 0), nargs='?', default=0x100)
+  parser.add_argument('-r', '--repeat', type=int, nargs='?', default=5)
+  args = parser.parse_args()
+
+  with open(args.input, 'rb') as file: data = file.read()
+  # packets are views into 348 packet chunks, as handed out by PacketAlignedAsyncReader
+  chunks = [data[begin:begin + ts.PACKET_SIZE * 348] for begin in range(0, len(data) - len(data) % ts.PACKET_SIZE, ts.PACKET_SIZE * 348)]
+  packets = [memoryview(chunk)[begin:begin + ts.PACKET_SIZE] for chunk in chunks for begin in range(0, len(chunk), ts.PACKET_SIZE)]
+  packets = [packet for packet in packets if ts.pid(packet) == args.pid]
+
+  for name, _class in [('bytearray', LegacyPESParser), ('payload views', PESParser)]:
+    def reassemble(keep: bool, access: bool) -> list[Any]:
+      parser = cast(Any, _class)(PES)
+      result = []
+      for packet in packets:
+        parser.push(packet)
+        for pes in parser:
+          if access: pes.PES_packet_data()
+          if keep: result.append(pes)
+      return result
+
+    count = len(reassemble(True, False))
+    parse_time = min(timeit.repeat(lambda: reassemble(False, False), number=1, repeat=args.repeat))
+    access_time = min(timeit.repeat(lambda: reassemble(False, True), number=1, repeat=args.repeat))
+    tracemalloc.start()
+    reassemble(False, True)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = reassemble(True, False)
+    retained = (tracemalloc.get_traced_memory()[0] - before) // max(1, count)
+    tracemalloc.stop()
+    del kept
+    print(f'{name:<14} {count} PES  reassemble {parse_time * 1e3:.1f} ms  +PES_packet_data {access_time * 1e3:.1f} ms  peak {peak / 1024:.0f} KiB  retained {retained} B/PES')
+
+  for name, _class in [('LegacyPES', LegacyPES), ('PES', PES)]:
+    def parse() -> list[Any]:
+      parser: PESParser[Any] = PESParser(cast(Any, _class))
+      result = []
+      for packet in packets:
+        parser.push(packet)
+        result.extend(parser)
+      return result
+    pes = parse()
+
+    def access() -> int:
+      # typical use per PES in variant handlers: timestamp for both pts and dts, then payload
+      total = 0
+      for p in pes:
+        total += (p.dts() or p.pts()) + (p.dts() or p.pts()) + p.pts() + len(p.PES_packet_data())
+      return total
+
+    parse_time = min(timeit.repeat(parse, number=1, repeat=args.repeat))
+    access_time = min(timeit.repeat(access, number=1, repeat=args.repeat))
+    tracemalloc.start()
+    instances = [_class(p.header) for p in pes]
+    size = tracemalloc.get_traced_memory()[0] // max(1, len(instances))
+    tracemalloc.stop()
+    del instances
+    print(f'{name:<14} {len(pes)} PES  parse {parse_time * 1e3:.1f} ms  pts/dts/data access {access_time * 1e3:.2f} ms  {size} B/instance')
+
+if __name__ == '__main__':
+  main()
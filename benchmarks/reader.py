@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import asyncio
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biim.mpeg2ts import ts
+from biim.util.reader import BufferingAsyncReader, PacketAlignedAsyncReader
+
+async def sync_loop(reader: asyncio.StreamReader | BufferingAsyncReader) -> int:
+  # ingest loop before PacketAlignedAsyncReader: read(1) for sync byte, then readexactly for rest
+  count = 0
+  while True:
+    isEOF = False
+    while True:
+      sync_byte = await reader.read(1)
+      if sync_byte == ts.SYNC_BYTE:
+        break
+      elif sync_byte == b'':
+        isEOF = True
+        break
+    if isEOF: break
+    try:
+      packet = ts.SYNC_BYTE + await reader.readexactly(ts.PACKET_SIZE - 1)
+    except asyncio.IncompleteReadError:
+      break
+    count += ts.pid(packet) >= 0
+  return count
+
+async def aligned(reader: asyncio.StreamReader | BufferingAsyncReader) -> int:
+  count = 0
+  async for packet in PacketAlignedAsyncReader(reader):
+    count += ts.pid(packet) >= 0
+  return count
+
+async def chunked(reader: asyncio.StreamReader | BufferingAsyncReader) -> int:
+  count = 0
+  async for chunk in PacketAlignedAsyncReader(reader).chunks():
+    for begin in range(0, len(chunk), ts.PACKET_SIZE):
+      count += ts.pid(chunk[begin:begin + ts.PACKET_SIZE]) >= 0
+  return count
+
+async def main():
+  parser = argparse.ArgumentParser(description=('TS ingest throughput, read(1)/readexactly loop vs PacketAlignedAsyncReader'))
+  parser.add_argument('-i', '--input', type=str, required=True)
+  parser.add_argument('-r', '--repeat', type=int, nargs='?', default=3)
+  args = parser.parse_args()
+
+  with open(args.input, 'rb') as file: data = file.read()
+
+  def memory() -> asyncio.StreamReader:
+    reader = asyncio.StreamReader(limit=len(data) + 1)
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+  def buffering() -> BufferingAsyncReader:
+    return BufferingAsyncReader(open(args.input, 'rb'), ts.PACKET_SIZE * 16)
+
+  for source, make in [('StreamReader', memory), ('BufferingAsyncReader', buffering)]:
+    for name, loop in [('read(1)/readexactly', sync_loop), ('PacketAlignedAsyncReader', aligned), ('chunks()', chunked)]:
+      best, count = float('inf'), 0
+      for _ in range(args.repeat):
+        reader = make()
+        begin = time.perf_counter()
+        count = await loop(reader)
+        best = min(best, time.perf_counter() - begin)
+      print(f'{source:<20} {name:<24} {count} packets {best:.3f}s {count / best / 1000:,.0f}k pkt/s')
+
+if __name__ == '__main__':
+  asyncio.run(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from biim.hls.segment import Segment
+
+class LegacyPartialSegment:
+  # every pushed packet was appended to partial's own bytearray
+  def __init__(self):
+    self.buffer: bytearray = bytearray()
+
+  def push(self, packet: bytes | bytearray | memoryview):
+    self.buffer += packet
+
+class LegacySegment(LegacyPartialSegment):
+  # and to segment's bytearray too, so live bytes were held twice
+  def __init__(self):
+    super().__init__()
+    self.partials: list[LegacyPartialSegment] = [LegacyPartialSegment()]
+
+  def push(self, packet: bytes | bytearray | memoryview):
+    self.buffer += packet
+    self.partials[-1].push(packet)
+
+  def newPartial(self, beginPTS: int):
+    self.partials.append(LegacyPartialSegment())
+
+  def completePartial(self, endPTS: int):
+    pass
+
+  def complete(self, endPTS: int):
+    pass
+
+def held(legacy: bool, seconds: int, bitrate: int, fps: int, part_frames: int) -> int:
+  # DVR (nothing evicted), one freshly packetized bytearray per frame as mpegts handler pushes
+  tracemalloc.start()
+  segments: list[Segment | LegacySegment] = []
+  for frame in range(seconds * fps):
+    if frame % fps == 0:
+      if segments: segments[-1].complete(frame * 3000)
+      segments.append(LegacySegment() if legacy else Segment(frame * 3000, True))
+    elif frame % part_frames == 0:
+      segments[-1].completePartial(frame * 3000)
+      segments[-1].newPartial(frame * 3000)
+    segments[-1].push(bytearray(bitrate // 8 // fps))
+  current, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return current
+
+def main():
+  parser = argparse.ArgumentParser(description=('memory held by segments, segment and partial bytearrays vs frozen partial buffers'))
+  parser.add_argument('-s', '--seconds', type=int, nargs='?', default=120)
+  parser.add_argument('-b', '--bitrate', type=int, nargs='?', default=8_000_000)
+  args = parser.parse_args()
+
+  media = args.seconds * args.bitrate // 8
+  for name, legacy in [('segment + partial bytearray', True), ('frozen partial buffers', False)]:
+    current = held(legacy, args.seconds, args.bitrate, 30, 3)
+    print(f'{name:<28} {current / 1e6:6.0f} MB held for {media / 1e6:.0f} MB of media ({current * 3600 / args.seconds / 1e9:.2f} GB/hour)')
+
+if __name__ == '__main__':
+  main()
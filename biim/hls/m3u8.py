@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
 import asyncio
+import bisect
 import math
 from collections import deque
-from datetime import datetime, timedelta
+from itertools import islice
+from datetime import datetime, timedelta, timezone
 
-from typing import Any, cast
+from typing import Any, AsyncIterator, Callable, cast
 
 from biim.hls.segment import Segment
+from biim.hls.storage import SegmentStorage
 
 class Daterange:
   def __init__(self, id: str, start_date: datetime, end_date: datetime | None = None, **kwargs):
@@ -30,34 +33,124 @@ class Daterange:
       (f'#EXT-X-DATERANGE:ID="{self.id}",START-DATE="{self.start_date.isoformat()}",END-DATE="{self.end_date.isoformat()},DURATION={duration}"\n' if self.end_date is not None else '')
     ])
 
+MIN_WINDOW_SEGMENTS = 4 # live tail with parts, kept when trimming by bytes, seconds or memory budget
+
 class M3U8:
-  def __init__(self, *, target_duration: int, part_target: float, window_size: int | None = None, has_init: bool = False):
+  def __init__(self, *, target_duration: int, part_target: float, window_size: int | None = None, window_bytes: int | None = None, window_seconds: float | None = None, has_init: bool = False, storage: SegmentStorage | None = None, init_released: Callable[[str], Any] | None = None):
     self.media_sequence: int = 0
     self.target_duration: int = target_duration
     self.part_target: float = part_target
     self.window_size: int | None = window_size
+    self.window_bytes: int | None = window_bytes
+    self.window_seconds: float | None = window_seconds
+    self.event: bool = window_size is None and window_bytes is None and window_seconds is None # EVENT playlist never slides
     self.has_init: bool = has_init
+    self.init: str = 'init' # URI of initialization section for new segments
+    self.init_references: dict[str, int] = dict() # init URI -> segments and outdated referring it
+    self.init_released = init_released # called with init URI no longer referred nor used for new segments
+    self.discontinuity_sequence: int = 0
     self.renditions: list[str] = []
     self.dateranges: dict[str, Daterange] = dict()
     self.segments: deque[Segment] = deque()
     self.outdated: deque[Segment] = deque()
     self.published: bool = False
-    self.futures: list[asyncio.Future[str]] = []
+    self.futures: list[asyncio.Future[bytes]] = []
     self.bitrate = asyncio.Future[int]()
+    self.storage = storage # completed segments are spilled to disk when given
+    self.segments_bytes: int = 0 # running totals for window checks, including spilled ones
+    self.outdated_bytes: int = 0
+    # rendered manifest is shared by all clients until playlist changes
+    self.version: int = 0
+    self.manifests: dict[bool, bytes] = dict() # skip -> manifest of current version
+    self.segment_target_duration: int = target_duration # running max of completed segments
+    self.body: bytes = b'' # rendered completed segments from beginning of playlist
+    self.body_sequence: int = 0
+    self.body_count: int = 0
+    # timeline of completed segments for bisect, index is msn - timeline_sequence
+    self.timeline_sequence: int = 0
+    self.timeline: list[timedelta] = [timedelta()] # start of each segment from beginning of stream, last is end of last completed segment
+    self.program_date_times: list[datetime] = []
+    self.last_partial: tuple[int, int] | None = None # (msn, part) of last completed partial
+
+  def __invalidate(self) -> None:
+    self.version += 1
+    self.manifests = dict()
+
+  def __render_segment(self, msn: int, segment: Segment, parts: bool, discontinuity: bool) -> str:
+    m3u8 = f'\n'
+    if discontinuity:
+      m3u8 += f'#EXT-X-DISCONTINUITY\n'
+      m3u8 += f'#EXT-X-MAP:URI="{segment.init}"\n'
+    m3u8 += f'#EXT-X-PROGRAM-DATE-TIME:{segment.program_date_time.isoformat()}\n'
+    if parts:
+      for part_index, partial in enumerate(segment):
+        hasIFrame = ',INDEPENDENT=YES' if partial.hasIFrame else ''
+        if not partial.isCompleted():
+          m3u8 += f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part?msn={msn}&part={part_index}"{hasIFrame}\n'
+        else:
+          m3u8 += f'#EXT-X-PART:DURATION={cast(timedelta, partial.extinf()).total_seconds():.06f},URI="part?msn={msn}&part={part_index}"{hasIFrame}\n'
+    if segment.isCompleted():
+      m3u8 += f'#EXTINF:{cast(timedelta, segment.extinf()).total_seconds():.06f}\n'
+      m3u8 += f'segment?msn={msn}\n'
+    return m3u8
+
+  def __body(self, end_index: int) -> bytes:
+    # appended as live tail moves forward, rebuilt when playlist slides
+    if self.body_sequence != self.media_sequence or self.body_count > end_index:
+      self.body, self.body_sequence, self.body_count = b'', self.media_sequence, 0
+    if self.body_count < end_index:
+      rendered = [cast(bytes, segment.rendered) for segment in islice(self.segments, self.body_count, end_index)]
+      if self.body_count == 0 and self.has_init and self.segments[0].discontinuity: # initialization section is in header
+        rendered[0] = self.__render_segment(self.media_sequence, self.segments[0], False, False).encode()
+      self.body += b''.join(rendered)
+      self.body_count = end_index
+    return self.body
+
+  def __completed(self, segment: Segment, msn: int) -> None:
+    self.segment_target_duration = max(self.segment_target_duration, math.ceil(cast(timedelta, segment.extinf()).total_seconds()))
+    self.last_partial = (msn, len(segment.partials) - 1)
+    self.__invalidate()
+    if msn == self.timeline_sequence + len(self.program_date_times):
+      self.timeline.append(self.timeline[-1] + cast(timedelta, segment.extinf()))
+      self.program_date_times.append(segment.program_date_time)
+    # lines of completed segment never change, rendered once
+    segment.rendered = self.__render_segment(msn, segment, False, self.has_init and segment.discontinuity).encode()
+    if self.storage is not None: self.storage.store(msn, segment)
+    self.__trim() # window by duration includes this segment from now
 
   def set_renditions(self, renditions: list[str]):
     self.renditions = renditions
+    self.__invalidate()
+
+  def changeInit(self, init: str) -> None:
+    # applied from next segment, with EXT-X-DISCONTINUITY
+    previous, self.init = self.init, init
+    if previous != init and previous not in self.init_references: self.__release_init(previous)
+
+  def __release_init(self, init: str) -> None:
+    if self.init_released is not None: self.init_released(init)
 
   def report(self) -> str | None:
-    segment_index = len(self.segments) - 1
-    while segment_index >= 0:
-      part_index = len(self.segments[segment_index].partials) - 1
-      while part_index >= 0:
-        if self.segments[segment_index].partials[part_index].isCompleted():
-          return f'LAST-MSN={self.media_sequence + segment_index},LAST-PART={part_index}'
-        part_index -= 1
-      segment_index -= 1
-    return None
+    if self.last_partial is None: return None
+    msn, part = self.last_partial
+    return f'LAST-MSN={msn},LAST-PART={part}'
+
+  def seek(self, offset: timedelta) -> int | None:
+    # msn of completed segment which contains offset from beginning of playlist
+    first, last = self.media_sequence - self.timeline_sequence, len(self.timeline) - 1
+    if first >= last or offset < timedelta(): return None
+    position = self.timeline[first] + offset
+    if position >= self.timeline[last]: return None
+    return self.timeline_sequence + bisect.bisect_right(self.timeline, position, first, last) - 1
+
+  def seek_program_date_time(self, program_date_time: datetime) -> int | None:
+    # msn of completed segment which contains program_date_time
+    first, last = self.media_sequence - self.timeline_sequence, len(self.timeline) - 1
+    if first >= last: return None
+    if program_date_time.tzinfo is None: program_date_time = program_date_time.replace(tzinfo=timezone.utc)
+    if program_date_time < self.program_date_times[first]: return None
+    if program_date_time >= self.program_date_times[last - 1] + (self.timeline[last] - self.timeline[last - 1]): return None
+    return self.timeline_sequence + bisect.bisect_right(self.program_date_times, program_date_time, first, last) - 1
 
   def in_range(self, msn: int) -> bool:
     return self.media_sequence <= msn and msn < self.media_sequence + len(self.segments)
@@ -65,15 +158,15 @@ class M3U8:
   def in_outdated(self, msn: int) -> bool:
     return self.media_sequence > msn and msn >= self.media_sequence - len(self.outdated)
 
-  def plain(self) -> asyncio.Future[str] | None:
-    f: asyncio.Future[str] = asyncio.Future()
+  def plain(self) -> asyncio.Future[bytes] | None:
+    f: asyncio.Future[bytes] = asyncio.Future()
     if self.published:
       f.set_result(self.manifest())
     else:
       self.futures.append(f)
     return f
 
-  def blocking(self, msn: int, part: int | None, skip: bool = False) -> asyncio.Future[str] | None:
+  def blocking(self, msn: int, part: int | None, skip: bool = False) -> asyncio.Future[bytes] | None:
     if not self.in_range(msn): return None
 
     index = msn - self.media_sequence
@@ -82,6 +175,9 @@ class M3U8:
       f = self.segments[index].m3u8(skip)
       if self.segments[index].isCompleted():
         f.set_result(self.manifest(skip))
+    elif not self.segments[index].partials: # collapsed after spilled, all parts are completed
+      f = self.segments[index].m3u8(skip)
+      f.set_result(self.manifest(skip))
     else:
       if part > len(self.segments[index].partials): return None
 
@@ -90,79 +186,180 @@ class M3U8:
         f.set_result(self.manifest(skip))
     return f
 
-  def push(self, packet: bytes | bytearray | memoryview) -> None:
+  def push(self, packet: bytes | bytearray | memoryview | list[bytes | bytearray | memoryview]) -> None:
     if not self.segments: return
-    self.segments[-1].push(packet)
+    segment = self.segments[-1]
+    size = segment.size
+    segment.push(packet)
+    self.segments_bytes += segment.size - size
+
+  def __duration(self, begin: int, end: int) -> timedelta:
+    # duration of completed segments in [begin, end) msn
+    first, last = max(0, begin - self.timeline_sequence), min(end - self.timeline_sequence, len(self.timeline) - 1)
+    if first >= last: return timedelta()
+    return self.timeline[last] - self.timeline[first]
+
+  def __overflow(self) -> bool:
+    if self.window_size is not None and self.window_size < len(self.segments): return True
+    if len(self.segments) <= MIN_WINDOW_SEGMENTS: return False
+    if self.window_bytes is not None and self.segments_bytes > self.window_bytes: return True
+    if self.window_seconds is not None and self.__duration(self.media_sequence, self.media_sequence + len(self.segments)) > timedelta(seconds=self.window_seconds): return True
+    return False
+
+  def __outdated_overflow(self) -> bool:
+    # outdated segments are kept as much as window, for clients still loading them
+    if not self.outdated: return False
+    if self.window_size is not None and self.window_size < len(self.outdated): return True
+    if self.window_bytes is not None and self.outdated_bytes > self.window_bytes: return True
+    if self.window_seconds is not None and self.__duration(self.media_sequence - len(self.outdated), self.media_sequence) > timedelta(seconds=self.window_seconds): return True
+    return False
+
+  def __slide(self) -> None:
+    self.outdated.appendleft(self.segments.popleft())
+    self.segments_bytes -= self.outdated[0].size
+    self.outdated_bytes += self.outdated[0].size
+    self.media_sequence += 1
+    if self.outdated[0].init != self.segments[0].init: self.discontinuity_sequence += 1
+
+  def __drop(self) -> int:
+    # returns released bytes in memory
+    evicted = self.outdated.pop()
+    self.outdated_bytes -= evicted.size
+    if (references := self.init_references[evicted.init] - 1) > 0:
+      self.init_references[evicted.init] = references
+    else:
+      del self.init_references[evicted.init]
+      if evicted.init != self.init: self.__release_init(evicted.init)
+    released = evicted.size if evicted.spill is None else 0
+    if self.storage is not None: self.storage.remove(evicted)
+    return released
+
+  def __compact(self) -> None:
+    # drop timeline of evicted segments, amortized O(1)
+    dropped = (self.media_sequence - len(self.outdated)) - self.timeline_sequence
+    if dropped > 0 and dropped * 2 >= len(self.program_date_times):
+      dropped = min(dropped, len(self.program_date_times))
+      del self.timeline[:dropped]
+      del self.program_date_times[:dropped]
+      self.timeline_sequence += dropped
+
+  def __trim(self) -> None:
+    if self.event: return
+    while self.__overflow(): self.__slide()
+    while self.__outdated_overflow(): self.__drop()
+    self.__compact()
+    self.__invalidate()
+
+  def buffered(self) -> int:
+    # bytes held in memory
+    return self.segments_bytes + self.outdated_bytes - (self.storage.released_bytes if self.storage is not None else 0)
+
+  def eviction_order(self) -> tuple[bool, datetime] | None:
+    # for memory budget, oldest segment in memory goes first: outdated ones, then oldest of sliding window
+    # with storage it is released to disk instead of dropped, spilled ones hold no memory and are skipped
+    if self.storage is not None:
+      if (oldest := self.storage.oldest()) is None: return None
+      msn, segment = oldest
+      return (msn >= self.media_sequence, segment.program_date_time)
+    if self.outdated: return (False, self.outdated[-1].program_date_time)
+    if not self.event and len(self.segments) > MIN_WINDOW_SEGMENTS: return (True, self.segments[0].program_date_time)
+    return None
+
+  def evict(self) -> int:
+    # evicts one segment in eviction_order, returns released bytes in memory
+    if self.storage is not None:
+      if (oldest := self.storage.oldest()) is None: return 0
+      return self.storage.release(oldest[1])
+    if self.eviction_order() is None: return 0
+    if not self.outdated: self.__slide()
+    released = self.__drop()
+    self.__compact()
+    self.__invalidate()
+    return released
 
   def newSegment(self, beginPTS: int, isIFrame: bool = False, programDateTime: datetime | None = None) -> None:
-    self.segments.append(Segment(beginPTS, isIFrame, programDateTime))
-    while self.window_size is not None and self.window_size < len(self.segments):
-      self.outdated.appendleft(self.segments.popleft())
-      self.media_sequence += 1
-    while self.window_size is not None and self.window_size < len(self.outdated):
-      self.outdated.pop()
+    discontinuity = bool(self.segments) and self.segments[-1].init != self.init
+    self.segments.append(Segment(beginPTS, isIFrame, programDateTime, self.init, discontinuity))
+    self.init_references[self.init] = self.init_references.get(self.init, 0) + 1
+    self.__trim()
+    self.__invalidate()
 
   def newPartial(self, beginPTS: int, isIFrame: bool = False) -> None:
     if not self.segments: return
     self.segments[-1].newPartial(beginPTS, isIFrame)
+    self.__invalidate()
 
   def completeSegment(self, endPTS: int) -> None:
     self.published = True
 
     if not self.segments: return
     self.segments[-1].complete(endPTS)
+    self.__completed(self.segments[-1], self.media_sequence + len(self.segments) - 1)
     self.segments[-1].notify(self.manifest(True), self.manifest(False))
     for f in self.futures:
       if not f.done(): f.set_result(self.manifest())
     self.futures = []
     if self.bitrate.done(): return
-    self.bitrate.set_result(int(len(self.segments[-1].buffer) * 8 / cast(timedelta, self.segments[-1].extinf()).total_seconds()))
+    self.bitrate.set_result(int(self.segments[-1].size * 8 / cast(timedelta, self.segments[-1].extinf()).total_seconds()))
 
   def completePartial(self, endPTS: int) -> None:
     if not self.segments: return
     self.segments[-1].completePartial(endPTS)
+    self.last_partial = (self.media_sequence + len(self.segments) - 1, len(self.segments[-1].partials) - 1)
+    self.__invalidate()
     self.segments[-1].notify(self.manifest(True), self.manifest(False))
 
   def continuousSegment(self, endPTS: int, isIFrame: bool = False, programDateTime: datetime | None = None) -> None:
     lastSegment = self.segments[-1] if self.segments else None
+    lastSequence = self.media_sequence + len(self.segments) - 1
     self.newSegment(endPTS, isIFrame, programDateTime)
 
     if not lastSegment: return
     self.published = True
     lastSegment.complete(endPTS)
+    self.__completed(lastSegment, lastSequence)
     lastSegment.notify(self.manifest(True), self.manifest(False))
     for f in self.futures:
       if not f.done(): f.set_result(self.manifest())
     self.futures = []
     if self.bitrate.done(): return
-    self.bitrate.set_result(int(len(lastSegment.buffer) * 8 / cast(timedelta, lastSegment.extinf()).total_seconds()))
+    self.bitrate.set_result(int(lastSegment.size * 8 / cast(timedelta, lastSegment.extinf()).total_seconds()))
 
   def continuousPartial(self, endPTS: int, isIFrame: bool = False) -> None:
     lastSegment = self.segments[-1] if self.segments else None
     lastPartial = lastSegment.partials[-1] if lastSegment else None
+    lastIndex = (self.media_sequence + len(self.segments) - 1, len(lastSegment.partials) - 1) if lastSegment else None
     self.newPartial(endPTS, isIFrame)
 
     if not lastPartial: return
     lastPartial.complete(endPTS)
+    self.last_partial = lastIndex
+    self.__invalidate()
     lastPartial.notify(self.manifest(True), self.manifest(False))
 
-  async def segment(self, msn: int) -> asyncio.Queue[bytes | bytearray | memoryview | None] | None:
-    if not self.in_range(msn):
-      if not self.in_outdated(msn): return None
-      index = (self.media_sequence - msn) - 1
-      return await self.outdated[index].response()
-    index = msn - self.media_sequence
-    return await self.segments[index].response()
-
-  async def partial(self, msn: int, part: int) -> asyncio.Queue[bytes | bytearray | memoryview | None] | None:
-    if not self.in_range(msn):
-      if not self.in_outdated(msn): return None
-      index = (self.media_sequence - msn) - 1
-      if part > len(self.outdated[index].partials): return None
-      return await self.outdated[index].partials[part].response()
-    index = msn - self.media_sequence
-    if part > len(self.segments[index].partials): return None
-    return await self.segments[index].partials[part].response()
+  def find(self, msn: int) -> Segment | None:
+    if self.in_range(msn): return self.segments[msn - self.media_sequence]
+    if self.in_outdated(msn): return self.outdated[(self.media_sequence - msn) - 1]
+    return None
+
+  def spilled(self, msn: int) -> str | None:
+    # path of segment file, when its bytes are no longer in memory
+    segment = self.find(msn)
+    if segment is None or segment.spill is None: return None
+    return segment.spill[0]
+
+  async def segment(self, msn: int, window: float = 0) -> AsyncIterator[list[bytes | bytearray | memoryview]] | None:
+    segment = self.find(msn)
+    if segment is None: return None
+    if self.storage is not None and segment.isCompleted(): self.storage.touch(segment)
+    return segment.stream(window)
+
+  async def partial(self, msn: int, part: int, window: float = 0) -> AsyncIterator[list[bytes | bytearray | memoryview]] | None:
+    segment = self.find(msn)
+    if segment is None: return None
+    if part >= len(segment.partials): return None
+    if self.storage is not None and segment.isCompleted(): self.storage.touch(segment)
+    return segment.partials[part].stream(window)
 
   async def bandwidth(self) -> int:
     return await self.bitrate
@@ -170,34 +367,37 @@ class M3U8:
   def open(self, id: str, start_date: datetime, end_date: datetime | None = None,  **kwargs):
     if id in self.dateranges: return
     self.dateranges[id] = Daterange(id, start_date, end_date, **kwargs)
+    self.__invalidate()
 
   def close(self, id: str, end_date: datetime):
     if id not in self.dateranges: return
     self.dateranges[id].close(end_date)
+    self.__invalidate()
 
   def estimated_tartget_duration(self) -> int:
-    target_duration = self.target_duration
-    for segment in self.segments:
-      if not segment.isCompleted(): continue
-      target_duration = max(target_duration, math.ceil(cast(timedelta, segment.extinf()).total_seconds()))
-    return target_duration
+    return self.segment_target_duration
+
+  def manifest(self, skip: bool = False) -> bytes:
+    if skip in self.manifests: return self.manifests[skip]
+    target_duration = self.estimated_tartget_duration()
 
-  def manifest(self, skip: bool = False) -> str:
     m3u8 = ''
     m3u8 += f'#EXTM3U\n'
-    m3u8 += f'#EXT-X-VERSION:{9 if self.window_size is None else 6}\n'
-    m3u8 += f'#EXT-X-TARGETDURATION:{self.estimated_tartget_duration()}\n'
+    m3u8 += f'#EXT-X-VERSION:{9 if self.event else 6}\n'
+    m3u8 += f'#EXT-X-TARGETDURATION:{target_duration}\n'
     m3u8 += f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.06f}\n'
-    if self.window_size is None:
-      m3u8 += f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={(self.part_target * 3.001):.06f},CAN-SKIP-UNTIL={self.estimated_tartget_duration() * 6}\n'
+    if self.event:
+      m3u8 += f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={(self.part_target * 3.001):.06f},CAN-SKIP-UNTIL={target_duration * 6}\n'
       m3u8 += f'#EXT-X-PLAYLIST-TYPE:EVENT\n'
     else:
       m3u8 += f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={(self.part_target * 3.001):.06f}\n'
     m3u8 += f'#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}\n'
+    if self.discontinuity_sequence > 0:
+      m3u8 += f'#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}\n'
 
     if self.has_init:
       m3u8 += f'\n'
-      m3u8 += f'#EXT-X-MAP:URI="init"\n'
+      m3u8 += f'#EXT-X-MAP:URI="{self.segments[0].init if self.segments else self.init}"\n'
 
     if len(self.segments) > 0:
       for id in list(self.dateranges.keys()):
@@ -207,15 +407,11 @@ class M3U8:
         del self.dateranges[id]
 
     skip_end_index = 0
-    if skip:
-      elapsed = 0
-      for seg_index, segment in enumerate(reversed(self.segments)):
-        seg_index = (len(self.segments) - 1) - seg_index
-        if not segment.isCompleted(): continue
-        elapsed += cast(timedelta, segment.extinf()).total_seconds()
-        if elapsed >= self.estimated_tartget_duration() * 6:
-          skip_end_index = seg_index
-          break
+    first, last = self.media_sequence - self.timeline_sequence, len(self.timeline) - 1
+    if skip and first < last:
+      # latest segment from which completed segments lasts CAN-SKIP-UNTIL
+      index = bisect.bisect_right(self.timeline, self.timeline[last] - timedelta(seconds=target_duration * 6), first, last) - 1
+      if index >= first: skip_end_index = index - first
     if skip_end_index > 0:
       m3u8 += f'\n'
       m3u8 += f'#EXT-X-SKIP:SKIPPED-SEGMENTS={skip_end_index}\n'
@@ -224,27 +420,38 @@ class M3U8:
       m3u8 += f'\n'
       m3u8 += f'{daterange}'
 
-    for seg_index, segment in enumerate(self.segments):
-      if seg_index < skip_end_index: continue # SKIP
-      msn = self.media_sequence + seg_index
-      m3u8 += f'\n'
-      m3u8 += f'#EXT-X-PROGRAM-DATE-TIME:{segment.program_date_time.isoformat()}\n'
-      if seg_index >= len(self.segments) - 4:
-        for part_index, partial in enumerate(segment):
-          hasIFrame = ',INDEPENDENT=YES' if partial.hasIFrame else ''
-          if not partial.isCompleted():
-            m3u8 += f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part?msn={msn}&part={part_index}"{hasIFrame}\n'
-          else:
-            m3u8 += f'#EXT-X-PART:DURATION={cast(timedelta, partial.extinf()).total_seconds():.06f},URI="part?msn={msn}&part={part_index}"{hasIFrame}\n'
-
-      if segment.isCompleted():
-        m3u8 += f'#EXTINF:{cast(timedelta, segment.extinf()).total_seconds():.06f}\n'
-        m3u8 += f'segment?msn={msn}\n'
-
-    if not self.renditions: return m3u8
-    if (redintion_report := self.report()) is None: return m3u8
-    m3u8 += f'\n'
-    for path in self.renditions:
-      m3u8 += f'#EXT-X-RENDITION-REPORT:URI="{path}",{redintion_report}\n'
+    # completed segments before live tail are already rendered, only tail (with parts) is rendered here
+    tail_index = max(skip_end_index, len(self.segments) - 4)
+    rendered: list[bytes] = [m3u8.encode()]
+    if skip_end_index == 0:
+      rendered.append(self.__body(tail_index))
+    else:
+      rendered.extend(cast(bytes, segment.rendered) for segment in islice(self.segments, skip_end_index, tail_index))
 
-    return m3u8
+    m3u8 = ''
+    for seg_index in range(tail_index, len(self.segments)):
+      segment = self.segments[seg_index]
+      m3u8 += self.__render_segment(self.media_sequence + seg_index, segment, True, self.has_init and seg_index > 0 and segment.discontinuity)
+
+    if self.renditions and (redintion_report := self.report()) is not None:
+      m3u8 += f'\n'
+      for path in self.renditions:
+        m3u8 += f'#EXT-X-RENDITION-REPORT:URI="{path}",{redintion_report}\n'
+    rendered.append(m3u8.encode())
+
+    manifest = b''.join(rendered)
+    self.manifests[skip] = manifest
+    return manifest
+
+def enforce_memory_budget(playlists: list[M3U8], budget: int) -> int:
+  # evicts segments across playlists (oldest outdated first) until buffered bytes fit in budget, returns number of evicted
+  # EVENT playlist without storage never drops segments, budget does nothing for it
+  buffered = sum(playlist.buffered() for playlist in playlists)
+  evicted = 0
+  while buffered > budget:
+    candidates = [(order, index) for index, playlist in enumerate(playlists) if (order := playlist.eviction_order()) is not None]
+    if not candidates: break
+    _, index = min(candidates)
+    buffered -= playlists[index].evict()
+    evicted += 1
+  return evicted
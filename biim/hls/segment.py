@@ -1,37 +1,86 @@
 #!/usr/bin/env python3
 
-from typing import Iterator
+from typing import AsyncIterator, Iterator, cast
 import asyncio
 from datetime import datetime, timedelta, timezone
 
 from biim.mpeg2ts import ts
 
+def read_file(path: str, offset: int, size: int) -> bytes:
+  with open(path, 'rb') as file:
+    file.seek(offset)
+    return file.read(size)
+
 class PartialSegment:
+  __slots__ = ('beginPTS', 'endPTS', 'hasIFrame', 'chunks', 'size', 'generation', 'waiter', 'spill', 'm3u8s_with_skip', 'm3u8s_without_skip')
+
   def __init__(self, beginPTS: int, isIFrame: bool = False):
     self.beginPTS: int = beginPTS
     self.endPTS: int | None = None
     self.hasIFrame: bool = isIFrame
-    self.buffer: bytearray = bytearray()
-    self.queues: list[asyncio.Queue[bytes | bytearray | memoryview | None]] = []
-    self.m3u8s_with_skip: list[asyncio.Future[str]]= []
-    self.m3u8s_without_skip: list[asyncio.Future[str]] = []
-
-  def push(self, packet: bytes | bytearray | memoryview):
-    self.buffer += packet
-    for q in self.queues: q.put_nowait(packet)
-
-  async def response(self) -> asyncio.Queue[bytes | bytearray | memoryview | None]:
-    queue: asyncio.Queue[bytes | bytearray | memoryview | None] = asyncio.Queue()
-
-    queue.put_nowait(self.buffer)
-    if (self.isCompleted()):
-      queue.put_nowait(None)
-    else:
-      self.queues.append(queue)
-    return queue
+    self.chunks: list[bytes | bytearray | memoryview] = [] # append-only chunk log, frozen into single bytes when completed
+    self.size: int = 0
+    self.generation: int = 0 # incremented when chunks are frozen, readers' index becomes invalid
+    self.waiter: asyncio.Future[None] | None = None # shared by all readers
+    self.spill: tuple[str, int] | None = None # (path, offset) when chunks are released to disk
+    self.m3u8s_with_skip: list[asyncio.Future[bytes]]= []
+    self.m3u8s_without_skip: list[asyncio.Future[bytes]] = []
+
+  def push(self, packet: bytes | bytearray | memoryview | list[bytes | bytearray | memoryview]):
+    if type(packet) is list: # scatter list
+      for chunk in packet: PartialSegment.push(self, chunk)
+      return
+    if type(packet) is memoryview and not packet.readonly: packet = bytes(packet) # referenced until completed
+    self.chunks.append(cast(bytes | bytearray | memoryview, packet))
+    self.size += len(packet)
+    self.wake()
+
+  def wait(self) -> asyncio.Future[None]:
+    if self.waiter is None: self.waiter = asyncio.get_running_loop().create_future()
+    return self.waiter
+
+  def wake(self) -> None:
+    # O(1) regardless of number of readers
+    if self.waiter is None: return
+    if not self.waiter.done(): self.waiter.set_result(None)
+    self.waiter = None
+
+  async def stream(self, window: float = 0) -> AsyncIterator[list[bytes | bytearray | memoryview]]:
+    # reader holds only its cursor into chunk log, everything available at wake-up is yielded at once
+    index, position, generation = 0, 0, self.generation
+    while True:
+      if generation != self.generation: # frozen or spilled while reading, continue from byte position
+        generation = self.generation
+        index = len(self.chunks)
+        if self.chunks and position < self.size:
+          remains = memoryview(self.chunks[0])[position:]
+          position = self.size
+          yield [remains]
+      elif index < len(self.chunks):
+        chunks = self.chunks[index:]
+        index += len(chunks)
+        position += sum(map(len, chunks))
+        yield chunks
+      elif self.spill is not None and position < self.size:
+        if (data := await self.read_spill(position)) is None: return
+        position = self.size
+        yield [data]
+      elif self.isCompleted():
+        return
+      else:
+        await asyncio.shield(self.wait()) # cancellation of reader must not cancel shared waiter
+        if window > 0 and not self.isCompleted(): await asyncio.sleep(window) # batch following pushes too
+
+  async def read_spill(self, position: int) -> bytes | None:
+    # rest of bytes from position, None when removed from disk
+    path, offset = cast(tuple[str, int], self.spill)
+    try:
+      return await asyncio.get_running_loop().run_in_executor(None, read_file, path, offset + position, self.size - position)
+    except OSError:
+      return None
 
-  def m3u8(self, skip: bool = False) -> asyncio.Future[str]:
-    f: asyncio.Future[str] = asyncio.Future()
+  def m3u8(self, skip: bool = False) -> asyncio.Future[bytes]:
+    f: asyncio.Future[bytes] = asyncio.Future()
     if not self.isCompleted():
       if skip: self.m3u8s_with_skip.append(f)
       else: self.m3u8s_without_skip.append(f)
@@ -39,10 +88,13 @@ class PartialSegment:
 
   def complete(self, endPTS: int) -> None:
     self.endPTS = endPTS
-    for q in self.queues: q.put_nowait(None)
-    self.queues = []
+    # freeze as immutable bytes, segment refers it instead of holding its own copy
+    if self.chunks and (len(self.chunks) > 1 or type(self.chunks[0]) is not bytes):
+      self.chunks = [b''.join(self.chunks)]
+      self.generation += 1
+    self.wake()
 
-  def notify(self, skipped_manifest: str, all_manifest: str) -> None:
+  def notify(self, skipped_manifest: bytes, all_manifest: bytes) -> None:
     for f in self.m3u8s_with_skip:
       if not f.done(): f.set_result(skipped_manifest)
     self.m3u8s_with_skip = []
@@ -63,10 +115,15 @@ class PartialSegment:
     return timedelta(seconds = (((endPTS - self.beginPTS + ts.PCR_CYCLE) % ts.PCR_CYCLE) / ts.HZ))
 
 class Segment(PartialSegment):
-  def __init__(self, beginPTS, isIFrame = False, programDateTime = None):
+  __slots__ = ('partials', 'program_date_time', 'init', 'discontinuity', 'rendered')
+
+  def __init__(self, beginPTS, isIFrame = False, programDateTime = None, init = 'init', discontinuity = False):
     super().__init__(beginPTS, isIFrame = False)
     self.partials: list[PartialSegment] = [PartialSegment(beginPTS, isIFrame)]
     self.program_date_time: datetime = programDateTime or datetime.now(timezone.utc)
+    self.init: str = init # URI of initialization section
+    self.discontinuity: bool = discontinuity # initialization section differs from previous segment
+    self.rendered: bytes | None = None # playlist lines, rendered when completed
 
   def __iter__(self) -> Iterator[PartialSegment]:
     return iter(self.partials)
@@ -74,27 +131,58 @@ class Segment(PartialSegment):
   def __len__(self) -> int:
     return len(self.partials)
 
-  def push(self, packet: bytes | bytearray | memoryview) -> None:
-    super().push(packet)
+  def push(self, packet: bytes | bytearray | memoryview | list[bytes | bytearray | memoryview]) -> None:
+    # segment holds no bytes itself, it is composed from its partials
     if not self.partials: return
-    self.partials[-1].push(packet)
+    partial = self.partials[-1]
+    begin_size = partial.size
+    partial.push(packet)
+    self.size += partial.size - begin_size
+
+  def buffers(self) -> list[bytes | bytearray | memoryview]:
+    return [chunk for partial in self.partials for chunk in partial.chunks]
+
+  async def stream(self, window: float = 0) -> AsyncIterator[list[bytes | bytearray | memoryview]]:
+    index, position = 0, 0
+    while True:
+      if self.spill is not None and not self.partials: # collapsed while reading, continue from file
+        if position < self.size and (data := await self.read_spill(position)) is not None: yield [data]
+        return
+      # completed partials are yielded together
+      chunks: list[bytes | bytearray | memoryview] = []
+      while index < len(self.partials) and self.partials[index].isCompleted() and self.partials[index].spill is None:
+        chunks.extend(self.partials[index].chunks)
+        index += 1
+      if chunks:
+        position += sum(map(len, chunks))
+        yield chunks
+      elif index < len(self.partials):
+        async for chunks in self.partials[index].stream(window):
+          position += sum(map(len, chunks))
+          yield chunks
+        index += 1
+      elif self.isCompleted():
+        return
+      else:
+        await asyncio.shield(self.wait())
 
   def completePartial(self, endPTS: int) -> None:
     if not self.partials: return
     self.partials[-1].complete(endPTS)
 
-  def notifyPartial(self, skipped_manifest: str, all_manifest: str) -> None:
+  def notifyPartial(self, skipped_manifest: bytes, all_manifest: bytes) -> None:
     if not self.partials: return
     self.partials[-1].notify(skipped_manifest, all_manifest)
 
   def newPartial(self, beginPTS: int, isIFrame: bool = False) -> None:
     self.partials.append(PartialSegment(beginPTS, isIFrame))
+    self.wake()
 
   def complete(self, endPTS: int) -> None:
     super().complete(endPTS)
     self.completePartial(endPTS)
 
-  def notify(self, skipped_manifest: str, all_manifest: str) -> None:
+  def notify(self, skipped_manifest: bytes, all_manifest: bytes) -> None:
     super().notify(skipped_manifest, all_manifest)
     self.notifyPartial(skipped_manifest, all_manifest)
 
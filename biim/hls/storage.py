@@ -0,0 +1,110 @@
+import asyncio
+import os
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from biim.hls.segment import Segment
+
+PINNED_SEGMENTS = 4 # latest stored segments, rendered with parts in playlist tail, are never released
+
+def write_file(path: str, buffers: list[bytes | bytearray | memoryview]) -> None:
+  with open(path, 'wb') as file:
+    file.writelines(buffers)
+
+def remove_file(path: str) -> None:
+  try:
+    os.remove(path)
+  except FileNotFoundError:
+    pass
+
+class SegmentStorage:
+  # completed segments are written to disk by background thread, only recently completed or requested ones stay in memory
+  def __init__(self, directory: str | None = None, memory_segments: int = 8):
+    self.spool = tempfile.TemporaryDirectory(prefix='biim-', dir=directory) # removed with storage or at exit
+    self.directory: str = self.spool.name
+    self.memory_segments: int = memory_segments
+    self.executor = ThreadPoolExecutor(max_workers=1) # writes and removes are ordered
+    self.resident: OrderedDict[Segment, None] = OrderedDict() # LRU of completed segments in memory
+    self.pinned: deque[Segment] = deque() # latest stored ones
+    self.paths: dict[Segment, str] = dict()
+    self.memory: OrderedDict[Segment, int] = OrderedDict() # stored and not released yet, in msn order -> msn
+    self.written: set[Segment] = set()
+    # stats
+    self.written_bytes: int = 0
+    self.spilled_segments: int = 0
+    self.released_bytes: int = 0 # bytes only on disk, of segments not removed yet
+    self.errors: int = 0
+
+  def store(self, msn: int, segment: Segment) -> None:
+    if segment in self.paths: return
+    path = os.path.join(self.directory, f'{msn}')
+    self.paths[segment] = path
+    self.memory[segment] = msn
+    # chunks of completed partials are frozen bytes, safe to read from another thread
+    future = asyncio.get_running_loop().run_in_executor(self.executor, write_file, path, segment.buffers())
+    future.add_done_callback(lambda f: self.__written(segment, f))
+    self.pinned.append(segment)
+    if len(self.pinned) > PINNED_SEGMENTS and self.__releasable(unpinned := self.pinned.popleft()): self.__release(unpinned)
+    self.touch(segment)
+
+  def __written(self, segment: Segment, future: asyncio.Future[None]) -> None:
+    if segment not in self.paths: return # removed while writing
+    if future.cancelled() or future.exception() is not None:
+      self.errors += 1 # keep in memory
+      return
+    self.written.add(segment)
+    self.written_bytes += segment.size
+    if self.__releasable(segment): self.__release(segment)
+
+  def __releasable(self, segment: Segment) -> bool:
+    return segment.spill is None and segment in self.written and segment not in self.resident and segment not in self.pinned
+
+  def __release(self, segment: Segment) -> None:
+    # readers in flight switch to the file by generation
+    path, offset = self.paths[segment], 0
+    segment.spill = (path, 0)
+    self.memory.pop(segment, None)
+    for partial in segment.partials:
+      partial.spill = (path, offset)
+      partial.chunks = []
+      partial.generation += 1
+      offset += partial.size
+    # collapsed to path, size and rendered lines, parts are no longer served
+    segment.partials = []
+    self.spilled_segments += 1
+    self.released_bytes += segment.size
+
+  def oldest(self) -> tuple[int, Segment] | None:
+    # oldest segment in memory that can be released now, for memory budget
+    for segment, msn in self.memory.items():
+      if segment in self.written and segment not in self.pinned: return msn, segment
+    return None
+
+  def release(self, segment: Segment) -> int:
+    # released even if recently used, returns released bytes in memory
+    if segment.spill is not None or segment not in self.written or segment in self.pinned: return 0
+    self.resident.pop(segment, None)
+    self.__release(segment)
+    return segment.size
+
+  def touch(self, segment: Segment) -> None:
+    if segment.spill is not None: return # served from file, page cache keeps hot one
+    self.resident[segment] = None
+    self.resident.move_to_end(segment)
+    while len(self.resident) > self.memory_segments:
+      evicted, _ = self.resident.popitem(last=False)
+      if self.__releasable(evicted): self.__release(evicted) # otherwise released when written or unpinned
+
+  def remove(self, segment: Segment) -> None:
+    if segment.spill is not None: self.released_bytes -= segment.size
+    self.resident.pop(segment, None)
+    self.memory.pop(segment, None)
+    if segment in self.pinned: self.pinned.remove(segment)
+    self.written.discard(segment)
+    if (path := self.paths.pop(segment, None)) is None: return
+    self.executor.submit(remove_file, path)
+
+  def close(self) -> None:
+    self.executor.shutdown(wait=True)
+    self.spool.cleanup()
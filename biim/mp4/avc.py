@@ -1,20 +1,13 @@
 from typing import cast
 
 from biim.mp4.box import trak, tkhd, mdia, mdhd, hdlr, minf, vmhd, dinf, stbl, stsd, avc1
-from biim.util.bitstream import BitStream
-
-escapes = set([0x00, 0x01, 0x02, 0x03])
-
-def ebsp2rbsp(data: bytes | bytearray | memoryview) -> bytes:
-  rbsp = bytearray(data[:2])
-  length = len(data)
-  for index in range(2, length):
-    if index < length - 1 and data[index - 2] == 0x00 and data[index - 1] == 0x00 and data[index + 0] == 0x03 and data[index + 1] in escapes:
-      continue
-    rbsp.append(data[index])
-  return bytes(rbsp)
+from biim.util.bitstream import BitStream, ebsp2rbsp
 
 def avcTrack(trackId: int, timescale: int, sps: bytes | bytearray | memoryview, pps: bytes | bytearray | memoryview) -> bytes:
+  return avcConfiguration(trackId, timescale, sps, pps)[0]
+
+def avcConfiguration(trackId: int, timescale: int, sps: bytes | bytearray | memoryview, pps: bytes | bytearray | memoryview) -> tuple[bytes, int, int, int, int, bool]:
+  # returns (trak, presentation_width, presentation_height, fps_num, fps_den, fps_fixed), fps_num and fps_den are 0 without VUI timing
   need_extra_fields = sps[3] not in [66, 77, 88]
   chroma_format_idc: int | None = None
   bit_depth_luma_minus8: int | None = None
@@ -24,6 +17,7 @@ def avcTrack(trackId: int, timescale: int, sps: bytes | bytearray | memoryview,
   codec_height: int | None = None
   presentation_width: int | None = None
   presentation_height: int | None = None
+  fps_num, fps_den, fps_fixed = 0, 0, True
 
   def parseSPS():
     nonlocal chroma_format_idc
@@ -34,6 +28,9 @@ def avcTrack(trackId: int, timescale: int, sps: bytes | bytearray | memoryview,
     nonlocal codec_height
     nonlocal presentation_width
     nonlocal presentation_height
+    nonlocal fps_num
+    nonlocal fps_den
+    nonlocal fps_fixed
 
     stream = BitStream(ebsp2rbsp(sps))
     stream.readByte() # remove header
@@ -101,7 +98,7 @@ def avcTrack(trackId: int, timescale: int, sps: bytes | bytearray | memoryview,
       frame_crop_bottom_offset = stream.readUEG()
 
     sar_width, sar_height = 1, 1
-    fps, fps_fixed, fps_num, fps_den = 0, True, 0, 0
+    fps = 0
 
     vui_parameters_present_flag = stream.readBool()
     if vui_parameters_present_flag:
@@ -183,7 +180,7 @@ def avcTrack(trackId: int, timescale: int, sps: bytes | bytearray | memoryview,
     ])
   ])
 
-  return trak(
+  track = trak(
     tkhd(trackId, cast(int, presentation_width), cast(int, presentation_height)),
     mdia(
       mdhd(timescale),
@@ -199,3 +196,4 @@ def avcTrack(trackId: int, timescale: int, sps: bytes | bytearray | memoryview,
       )
     )
   )
+  return track, cast(int, presentation_width), cast(int, presentation_height), fps_num, fps_den, fps_fixed
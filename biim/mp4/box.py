@@ -1,3 +1,4 @@
+import struct
 from typing import cast
 
 composition_matrix = bytes([
@@ -210,17 +211,48 @@ def trex(trackId: int) -> bytes:
     b'\x00\x01\x00\x01' # default_sample_flags
   ])
 
+BOX_HEADER = struct.Struct('>I4s')
+MFHD = struct.Struct('>I4sII')
+TFHD = struct.Struct('>I4sIII')
+TFDT = struct.Struct('>I4sIQ')
+TRUN = struct.Struct('>I4sIII')
+TRUN_SAMPLE = struct.Struct('>IIBBHI')
+
+def moof_size(fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]]) -> int:
+  return BOX_HEADER.size + MFHD.size + sum(BOX_HEADER.size + TFHD.size + TFDT.size + TRUN.size + TRUN_SAMPLE.size * len(samples) for _, _, _, _, samples in fragments)
+
+def moof_into(buffer: bytearray, position: int, sequence_number: int, fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]]) -> int:
+  # single pass, sizes are computed arithmetically. offset of each fragment is relative to mdat payload, returns moof size
+  size = moof_size(fragments)
+  BOX_HEADER.pack_into(buffer, position, size, b'moof')
+  MFHD.pack_into(buffer, position + BOX_HEADER.size, MFHD.size, b'mfhd', 0, sequence_number)
+  begin = position + BOX_HEADER.size + MFHD.size
+  for trackId, duration, baseMediaDecodeTime, offset, samples in fragments:
+    trun_size = TRUN.size + TRUN_SAMPLE.size * len(samples)
+    BOX_HEADER.pack_into(buffer, begin, BOX_HEADER.size + TFHD.size + TFDT.size + trun_size, b'traf')
+    begin += BOX_HEADER.size
+    TFHD.pack_into(buffer, begin, TFHD.size, b'tfhd', 0x020008, trackId, duration) # default-base-is-moof, default-sample-duration-present
+    begin += TFHD.size
+    TFDT.pack_into(buffer, begin, TFDT.size, b'tfdt', 0x01000000, baseMediaDecodeTime) # version 1
+    begin += TFDT.size
+    TRUN.pack_into(buffer, begin, trun_size, b'trun', 0x000F01, len(samples), size + BOX_HEADER.size + offset)
+    begin += TRUN.size
+    for sample_size, sample_duration, isKeyframe, compositionTimeOffset in samples:
+      TRUN_SAMPLE.pack_into(buffer, begin, sample_duration, sample_size, 2 if isKeyframe else 1, 0x40 if isKeyframe else 0x01, 0, compositionTimeOffset)
+      begin += TRUN_SAMPLE.size
+  return size
+
 def moof(sequence_number: int, fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]]) -> bytes:
-  moofSize = len(
-    box('moof', [
-      mfhd(sequence_number),
-      b''.join([traf(trackId, duration, baseMediaDecodeTime, offset, samples) for trackId, duration, baseMediaDecodeTime, offset, samples in fragments])
-    ])
-  )
-  return box('moof', [
-    mfhd(sequence_number),
-    b''.join([traf(trackId, duration, baseMediaDecodeTime, moofSize + 8 + offset, samples) for trackId, duration, baseMediaDecodeTime, offset, samples in fragments])
-  ])
+  buffer = bytearray(moof_size(fragments))
+  moof_into(buffer, 0, sequence_number, fragments)
+  return bytes(buffer)
+
+def fragment(sequence_number: int, fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]], data: list[bytes | bytearray | memoryview]) -> list[bytes | bytearray | memoryview]:
+  # returns [moof + mdat header, sample data...], sample data is not copied
+  buffer = bytearray(moof_size(fragments) + BOX_HEADER.size)
+  size = moof_into(buffer, 0, sequence_number, fragments)
+  BOX_HEADER.pack_into(buffer, size, BOX_HEADER.size + sum(map(len, data)), b'mdat')
+  return [buffer, *data]
 
 def mfhd(sequence_number: int) -> bytes:
   return fullbox('mfhd', 0, 0, [
@@ -235,7 +267,7 @@ def traf(trackId: int, duration: int, baseMediaDecodeTime: int, offset: int, sam
   ])
 
 def tfhd(trackId: int, duraiton: int) -> bytes:
-  return fullbox('tfhd', 0, 8, [
+  return fullbox('tfhd', 0, 0x020008, [ # default-base-is-moof, default-sample-duration-present
     (trackId).to_bytes(4, byteorder='big'),
     (duraiton).to_bytes(4, byteorder='big')
   ])
@@ -0,0 +1,62 @@
+from typing import Callable, Sequence, cast
+
+from biim.mp4.box import fragment
+
+class TrackRun:
+  __slots__ = ('baseMediaDecodeTime', 'nextDecodeTime', 'samples', 'data', 'size')
+
+  def __init__(self, baseMediaDecodeTime: int):
+    self.baseMediaDecodeTime: int = baseMediaDecodeTime
+    self.nextDecodeTime: int = baseMediaDecodeTime
+    self.samples: list[tuple[int, int, bool, int]] = [] # size, duration, isKeyframe, compositionTimeOffset
+    self.data: list[bytes | bytearray | memoryview] = []
+    self.size: int = 0
+
+class FragmentBuilder:
+  # accumulates samples of each track, emitted as single moof (one traf per track, multi-sample trun) + mdat
+  def __init__(self, output: Callable[[list[bytes | bytearray | memoryview]], None]):
+    self.output = output
+    self.sequence_number: int = 0
+    self.runs: dict[int, TrackRun] = dict()
+
+  def __bool__(self) -> bool:
+    return bool(self.runs)
+
+  def duration(self) -> int:
+    return max((run.nextDecodeTime - run.baseMediaDecodeTime for run in self.runs.values()), default=0)
+
+  def add(self, trackId: int, decodeTime: int, duration: int, data: bytes | bytearray | memoryview | Sequence[bytes | bytearray | memoryview], isKeyframe: bool = False, compositionTimeOffset: int = 0) -> None:
+    # data can be given as fragments of sample, which are not copied until written
+    run = self.runs.get(trackId)
+    if run is not None and run.nextDecodeTime != decodeTime:
+      gap = decodeTime - run.nextDecodeTime
+      last_size, last_duration, last_keyframe, last_offset = run.samples[-1]
+      if -last_duration < gap < last_duration:
+        # small jitter (e.g. rounded audio frame duration), absorbed into previous sample duration
+        run.samples[-1] = (last_size, last_duration + gap, last_keyframe, last_offset)
+        run.nextDecodeTime = decodeTime
+      else:
+        # timestamp jump needs new tfdt
+        self.flush()
+        run = None
+    if run is None:
+      run = self.runs[trackId] = TrackRun(decodeTime)
+    size = sum(map(len, data)) if type(data) is list else len(data)
+    run.samples.append((size, duration, isKeyframe, compositionTimeOffset))
+    if type(data) is list: run.data.extend(data)
+    else: run.data.append(cast(bytes | bytearray | memoryview, data))
+    run.size += size
+    run.nextDecodeTime = decodeTime + duration
+
+  def flush(self) -> None:
+    if not self.runs: return
+    fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]] = []
+    data: list[bytes | bytearray | memoryview] = []
+    offset = 0
+    for trackId, run in self.runs.items():
+      fragments.append((trackId, run.samples[0][1], run.baseMediaDecodeTime, offset, run.samples))
+      data.extend(run.data)
+      offset += run.size
+    self.runs = dict()
+    self.sequence_number += 1
+    self.output(fragment(self.sequence_number, fragments, data))
@@ -1,20 +1,13 @@
 from typing import cast
 
 from biim.mp4.box import trak, tkhd, mdia, mdhd, hdlr, minf, vmhd, dinf, stbl, stsd, hvc1
-from biim.util.bitstream import BitStream
-
-escapes = set([0x00, 0x01, 0x02, 0x03])
-
-def ebsp2rbsp(data: bytes | bytearray | memoryview) -> bytes:
-  rbsp = bytearray(data[:2])
-  length = len(data)
-  for index in range(2, length):
-    if index < length - 1 and data[index - 2] == 0x00 and data[index - 1] == 0x00 and data[index + 0] == 0x03 and data[index + 1] in escapes:
-      continue
-    rbsp.append(data[index])
-  return bytes(rbsp)
+from biim.util.bitstream import BitStream, ebsp2rbsp
 
 def hevcTrack(trackId: int, timescale: int, vps: bytes | bytearray | memoryview, sps: bytes | bytearray | memoryview, pps: bytes | bytearray | memoryview) -> bytes:
+  return hevcConfiguration(trackId, timescale, vps, sps, pps)[0]
+
+def hevcConfiguration(trackId: int, timescale: int, vps: bytes | bytearray | memoryview, sps: bytes | bytearray | memoryview, pps: bytes | bytearray | memoryview) -> tuple[bytes, int, int, int, int, bool]:
+  # returns (trak, presentation_width, presentation_height, fps_num, fps_den, fps_fixed), fps_num and fps_den are 0 without VUI timing
   general_profile_space: int | None = None
   general_tier_flag: bool | None = None
   general_profile_idc: int | None = None
@@ -33,6 +26,7 @@ def hevcTrack(trackId: int, timescale: int, vps: bytes | bytearray | memoryview,
   pic_height_in_luma_samples: int | None  = None
   codec_width: int | None = None
   codec_height: int | None = None
+  fps_num, fps_den, fps_fixed = 0, 0, False
 
   def parseSPS():
     nonlocal general_profile_space
@@ -50,6 +44,9 @@ def hevcTrack(trackId: int, timescale: int, vps: bytes | bytearray | memoryview,
     nonlocal pic_height_in_luma_samples
     nonlocal codec_width
     nonlocal codec_height
+    nonlocal fps_num
+    nonlocal fps_den
+    nonlocal fps_fixed
 
     left_offset = 0
     right_offset = 0
@@ -168,9 +165,6 @@ def hevcTrack(trackId: int, timescale: int, vps: bytes | bytearray | memoryview,
     min_spatial_segmentation_idc = 0
     nonlocal sar_width
     nonlocal sar_height
-    fps_fixed = False
-    fps_den = 1
-    fps_num = 1
 
     sps_temporal_mvp_enabled_flag = stream.readBool()
     strong_intra_smoothing_enabled_flag = stream.readBool()
@@ -386,7 +380,7 @@ def hevcTrack(trackId: int, timescale: int, vps: bytes | bytearray | memoryview,
   presentation_width = (cast(int, codec_width) * sar_width + (sar_height - 1)) // sar_height
   presentation_height = cast(int, codec_height)
 
-  return trak(
+  track = trak(
     tkhd(trackId, presentation_width, presentation_height),
     mdia(
       mdhd(timescale),
@@ -402,3 +396,4 @@ def hevcTrack(trackId: int, timescale: int, vps: bytes | bytearray | memoryview,
       )
     )
   )
+  return track, presentation_width, presentation_height, fps_num, fps_den, fps_fixed
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+from typing import Iterator
+
+try:
+  import numpy as np
+except ImportError: # optional, fallback to per packet decoding
+  np = None
+
+from biim.mpeg2ts import ts
+
+VECTORIZED = np is not None
+
+class PacketBatch:
+  def __init__(self, data: bytes | bytearray | memoryview):
+    self.data = memoryview(data)
+    self.count: int = len(self.data) // ts.PACKET_SIZE
+
+    self.pid: list[int]
+    self.payload_unit_start_indicator: list[bool]
+    self.continuity_counter: list[int]
+    self.has_adaptation_field: list[bool]
+    self.payload_offset: list[int]
+    self.pcr: list[int | None]
+    self.groups: dict[int, list[int]] # PID -> row indices (in stream order)
+    if np is not None:
+      self.__decode_vectorized()
+    else:
+      self.__decode()
+
+  def __len__(self) -> int:
+    return self.count
+
+  def __getitem__(self, row: int) -> memoryview:
+    return self.data[row * ts.PACKET_SIZE:(row + 1) * ts.PACKET_SIZE]
+
+  def __iter__(self) -> Iterator[memoryview]:
+    for row in range(self.count): yield self[row]
+
+  def has_pcr(self, row: int) -> bool:
+    return self.pcr[row] is not None
+
+  def __decode_vectorized(self) -> None:
+    assert np is not None # only called when numpy is available
+    packets = np.frombuffer(self.data, dtype=np.uint8, count=self.count * ts.PACKET_SIZE).reshape(self.count, ts.PACKET_SIZE)
+    header = packets[:, 1:4].astype(np.int64)
+    pid = ((header[:, 0] & 0x1F) << 8) | header[:, 1]
+    payload_unit_start_indicator = (header[:, 0] & 0x40) != 0
+    continuity_counter = header[:, 2] & 0x0F
+    has_adaptation_field = (header[:, 2] & 0x20) != 0
+    adaptation_field_length = np.where(has_adaptation_field, packets[:, 4], 0).astype(np.int64)
+    payload_offset = np.minimum(ts.HEADER_SIZE + np.where(has_adaptation_field, 1 + adaptation_field_length, 0), ts.PACKET_SIZE)
+    has_pcr = has_adaptation_field & (adaptation_field_length > 0) & ((packets[:, ts.HEADER_SIZE + 1] & 0x10) != 0)
+    base = packets[:, ts.HEADER_SIZE + 2:ts.HEADER_SIZE + 7].astype(np.int64)
+    pcr = (base[:, 0] << 25) | (base[:, 1] << 17) | (base[:, 2] << 9) | (base[:, 3] << 1) | (base[:, 4] >> 7)
+
+    self.pid = pid.tolist()
+    self.payload_unit_start_indicator = payload_unit_start_indicator.tolist()
+    self.continuity_counter = continuity_counter.tolist()
+    self.has_adaptation_field = has_adaptation_field.tolist()
+    self.payload_offset = payload_offset.tolist()
+    self.pcr = [value if flag else None for value, flag in zip(pcr.tolist(), has_pcr.tolist())]
+
+    order = np.argsort(pid, kind='stable')
+    pids, begins = np.unique(pid[order], return_index=True)
+    self.groups = { key: rows.tolist() for key, rows in zip(pids.tolist(), np.split(order, begins[1:])) }
+
+  def __decode(self) -> None:
+    self.pid = []
+    self.payload_unit_start_indicator = []
+    self.continuity_counter = []
+    self.has_adaptation_field = []
+    self.payload_offset = []
+    self.pcr = []
+    self.groups = dict()
+    for row, packet in enumerate(self):
+      pid = ts.pid(packet)
+      self.pid.append(pid)
+      self.payload_unit_start_indicator.append(ts.payload_unit_start_indicator(packet))
+      self.continuity_counter.append(ts.continuity_counter(packet))
+      self.has_adaptation_field.append(ts.has_adaptation_field(packet))
+      self.payload_offset.append(min(ts.HEADER_SIZE + (1 + ts.adaptation_field_length(packet) if ts.has_adaptation_field(packet) else 0), ts.PACKET_SIZE))
+      self.pcr.append(ts.pcr(packet))
+      self.groups.setdefault(pid, []).append(row)
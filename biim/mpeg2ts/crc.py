@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+import binascii
+
+# CRC-32/MPEG-2 is the bit reversed form of zlib CRC-32, so reverse bits per byte and delegate to binascii
+REVERSED = bytes(int(f'{byte:08b}'[::-1], 2) for byte in range(256))
+INITIAL = 0xFFFFFFFF
+
+def reverse32(value: int) -> int:
+  return int.from_bytes(value.to_bytes(4, byteorder='little').translate(REVERSED), byteorder='big')
+
+def crc32(data: bytes | bytearray | memoryview, crc: int = INITIAL) -> int:
+  # incremental, pass previous result as crc to continue
+  return reverse32(binascii.crc32(bytes(data).translate(REVERSED), reverse32(crc) ^ 0xFFFFFFFF) ^ 0xFFFFFFFF)
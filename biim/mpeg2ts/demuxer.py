@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import time
+from typing import cast, Any, Callable
+
+from biim.mpeg2ts import ts
+from biim.mpeg2ts.batch import PacketBatch, VECTORIZED
+from biim.mpeg2ts.pat import PATSection
+from biim.mpeg2ts.pmt import PMTSection
+from biim.mpeg2ts.parser import SectionParser, PESParser
+
+Entry = tuple[SectionParser | PESParser | None, Callable[[Any], Any]] # (parser, callback), parser None means raw packet callback
+Factory = Callable[[int], Entry | None] # elementary_PID -> Entry
+
+class MpegtsDemuxer:
+  def __init__(self, SID: int | None = None, PAT: Callable[[PATSection], Any] | None = None, PMT: Callable[[int, PMTSection], Any] | None = None, PCR: Callable[[int], Any] | None = None, profile: bool = False, repeat: bool = False):
+    self.SID = SID
+    self.PMT_PID: int | None = None
+    self.PCR_PID: int | None = None
+    # Callbacks (PAT/PMT are called only when changed, or also for repeated sections with repeat)
+    self.PAT_callback = PAT
+    self.PMT_callback = PMT
+    self.PCR_callback = PCR
+    self.repeat = repeat
+    # Dispatch Table
+    self.factories: dict[int | None, tuple[Factory, bool]] = dict() # stream_type (None for others) -> (factory, first_only)
+    self.table: dict[int, Entry] = { 0x00: (SectionParser[PATSection](PATSection, repeat=self.repeat), self.__PAT) }
+    self.streams: dict[int, tuple[int, int | None]] = dict() # elementary_PID -> (stream_type, factory key) of entry in table
+    # parser yields same object for repeated section, so these identify repeats
+    self.last_pat: PATSection | None = None
+    self.last_pmt: PMTSection | None = None
+    # Statistics
+    self.profile = profile
+    self.packets: dict[int, int] = dict()
+    self.cpu_time_ns: dict[int, int] = dict()
+
+  def register(self, stream_type: int | None, factory: Factory, first_only: bool = False) -> None:
+    self.factories[stream_type] = (factory, first_only)
+
+  def statistics(self) -> dict[int, tuple[int, float]]:
+    return { PID: (packets, self.cpu_time_ns.get(PID, 0) / 1e9) for PID, packets in self.packets.items() }
+
+  def __PAT(self, PAT: PATSection) -> None:
+    if PAT.CRC32() != 0: return
+    if self.PAT_callback is not None: self.PAT_callback(PAT)
+    if PAT is self.last_pat: return
+    self.last_pat = PAT
+
+    PMT_PID = None
+    for program_number, program_map_PID in PAT:
+      if program_number == 0: continue
+
+      if program_number == self.SID:
+        PMT_PID = program_map_PID
+      elif not PMT_PID and not self.SID:
+        PMT_PID = program_map_PID
+    if PMT_PID is None or PMT_PID == self.PMT_PID: return
+
+    if self.PMT_PID is not None: self.table.pop(self.PMT_PID, None)
+    self.PMT_PID = PMT_PID
+    self.table[PMT_PID] = (SectionParser[PMTSection](PMTSection, repeat=self.repeat), self.__PMT)
+
+  def __PMT(self, PMT: PMTSection) -> None:
+    if PMT.CRC32() != 0: return
+    PMT_PID = cast(int, self.PMT_PID)
+    if PMT is self.last_pmt:
+      if self.PMT_callback is not None: self.PMT_callback(PMT_PID, PMT)
+      return
+    self.last_pmt = PMT
+
+    table: dict[int, Entry] = { 0x00: self.table[0x00], PMT_PID: self.table[PMT_PID] }
+    streams: dict[int, tuple[int, int | None]] = dict()
+    used: set[int | None] = set()
+    for stream_type, elementary_PID, _ in PMT:
+      if elementary_PID in table: continue
+      key = stream_type if stream_type in self.factories and stream_type not in used else None
+      if key not in self.factories: continue
+      factory, first_only = self.factories[key]
+      # unchanged stream keeps its parser, so PES being assembled survives PMT update
+      if self.streams.get(elementary_PID) == (stream_type, key) and elementary_PID in self.table:
+        entry = self.table[elementary_PID]
+      elif (entry := factory(elementary_PID)) is None:
+        continue
+      if first_only: used.add(key)
+      table[elementary_PID] = entry
+      streams[elementary_PID] = (stream_type, key)
+    self.table = table
+    self.streams = streams
+    self.PCR_PID = PMT.PCR_PID
+
+    if self.PMT_callback is not None: self.PMT_callback(PMT_PID, PMT)
+
+  def push(self, packet: bytes | bytearray | memoryview) -> None:
+    PID = ((packet[1] & 0x1F) << 8) | packet[2]
+    begin = time.thread_time_ns() if self.profile else 0
+
+    if (entry := self.table.get(PID)) is not None:
+      parser, callback = entry
+      if parser is None:
+        callback(packet)
+      else:
+        parser.push(packet)
+        for data in parser: callback(data)
+    if PID == self.PCR_PID and self.PCR_callback is not None and ts.has_pcr(packet):
+      self.PCR_callback(cast(int, ts.pcr(packet)))
+
+    if self.profile: self.__account(PID, 1, time.thread_time_ns() - begin)
+
+  def push_chunk(self, chunk: bytes | bytearray | memoryview) -> None:
+    if VECTORIZED:
+      self.push_batch(PacketBatch(chunk))
+    else:
+      for begin in range(0, len(chunk) - (len(chunk) % ts.PACKET_SIZE), ts.PACKET_SIZE):
+        self.push(chunk[begin:begin + ts.PACKET_SIZE])
+
+  def push_batch(self, batch: PacketBatch) -> None:
+    pids, pcrs, count = batch.pid, batch.pcr, len(batch)
+    begin = 0
+    while begin < count:
+      PID = pids[begin]
+      clock = time.thread_time_ns() if self.profile else 0
+
+      # consecutive packets of same PID (split after PCR, so the PCR callback keeps packet order)
+      is_pcr_pid = PID == self.PCR_PID
+      end = begin + 1
+      if not (is_pcr_pid and pcrs[begin] is not None):
+        while end < count and pids[end] == PID:
+          end += 1
+          if is_pcr_pid and pcrs[end - 1] is not None: break
+
+      if (entry := self.table.get(PID)) is not None:
+        parser, callback = entry
+        if parser is None:
+          for row in range(begin, end): callback(batch[row])
+        else:
+          parser.push_batch(batch, range(begin, end))
+          for data in parser: callback(data)
+      if PID == self.PCR_PID and self.PCR_callback is not None and (pcr := pcrs[end - 1]) is not None:
+        self.PCR_callback(pcr)
+
+      if self.profile: self.__account(PID, end - begin, time.thread_time_ns() - clock)
+      begin = end
+
+  def __account(self, PID: int, packets: int, elapsed: int) -> None:
+    self.packets[PID] = self.packets.get(PID, 0) + packets
+    self.cpu_time_ns[PID] = self.cpu_time_ns.get(PID, 0) + elapsed
@@ -1,17 +1,41 @@
 #!/usr/bin/env python3
 
-import re
 from typing import Iterator
 
+from biim.mpeg2ts import nal
 from biim.mpeg2ts.pes import PES
 
-SPLIT = re.compile('\0\0\0?\1'.encode('ascii'))
-
 class H264PES(PES):
-  def __init__(self, payload: bytes | bytearray | memoryview = b''):
+  __slots__ = ('nals',)
+
+  def __init__(self, payload: bytes | bytearray | memoryview | list[memoryview] = b''):
     super().__init__(payload)
+    self.nals: list[tuple[int, int, int]] | None = None # (offset, length, nal_unit_type), indexed lazily
+
+  def nal_index(self) -> list[tuple[int, int, int]]:
+    if self.nals is None:
+      PES_packet_data = self.PES_packet_data()
+      self.nals = [(offset, length, PES_packet_data[offset] & 0x1f) for offset, length in nal.index(PES_packet_data)]
+    return self.nals
+
+  def __iter__(self) -> Iterator[memoryview]:
     PES_packet_data = self.PES_packet_data()
-    self.ebsps: list[bytes] = [x for x in re.split(SPLIT, PES_packet_data) if len(x) > 0]
+    for offset, length, _ in self.nal_index():
+      yield PES_packet_data[offset:offset + length]
 
-  def __iter__(self) -> Iterator[bytes]:
-    return iter(self.ebsps)
+  def nal_types(self) -> list[int]:
+    return [nal_unit_type for _, _, nal_unit_type in self.nal_index()]
+
+  def has_idr(self) -> bool:
+    return any(nal_unit_type == 0x05 for _, _, nal_unit_type in self.nal_index())
+
+  def parameter_sets(self) -> tuple[memoryview | None, memoryview | None]:
+    # (SPS, PPS), latest one in this PES
+    PES_packet_data = self.PES_packet_data()
+    sps, pps = None, None
+    for offset, length, nal_unit_type in self.nal_index():
+      if nal_unit_type == 0x07: # SPS
+        sps = PES_packet_data[offset:offset + length]
+      elif nal_unit_type == 0x08: # PPS
+        pps = PES_packet_data[offset:offset + length]
+    return sps, pps
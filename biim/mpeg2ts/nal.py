@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+import re
+
+SPLIT = re.compile('\0\0\0?\1'.encode('ascii'))
+
+def index(data: bytes | bytearray | memoryview) -> list[tuple[int, int]]:
+  # (offset, length) of NAL units separated by start code, scanned in place (no copy)
+  result: list[tuple[int, int]] = []
+  begin = None
+  for start_code in SPLIT.finditer(data):
+    if begin is not None and start_code.start() > begin: result.append((begin, start_code.start() - begin))
+    begin = start_code.end()
+  if begin is None: begin = 0
+  if len(data) > begin: result.append((begin, len(data) - begin))
+  return result
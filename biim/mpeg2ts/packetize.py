@@ -1,49 +1,74 @@
-from typing import Type
+import struct
 
 from biim.mpeg2ts import ts
 from biim.mpeg2ts.section import Section
 from biim.mpeg2ts.pes import PES
 
-def packetize_section(section: Section, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> list[bytes]:
-  result: list[bytes] = []
+PAYLOAD_SIZE = ts.PACKET_SIZE - ts.HEADER_SIZE
+HEADER = struct.Struct('>BBBB')
+
+def packetize_section_buffer(section: Section, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> tuple[bytearray, int]:
+  # returns (concatenated packets, next continuity_counter)
+  length = len(section)
+  count = (length + 1 + (PAYLOAD_SIZE - 1)) // PAYLOAD_SIZE if length > 0 else 0 # +1 for pointer_field
+  buffer = bytearray(ts.STUFFING_BYTE * (count * ts.PACKET_SIZE))
+  flags = ((1 if transport_error_indicator else 0) << 7) | ((1 if transport_priority else 0) << 5) | ((pid & 0x1F00) >> 8)
+  data = section.payload
+
   begin = 0
-  while (begin < len(section)):
-    next = min(len(section), begin + (ts.PACKET_SIZE - ts.HEADER_SIZE) - (1 if begin == 0 else 0))
-    result.append(bytes(
-      ([
-        ts.SYNC_BYTE[0],
-        ((1 if transport_error_indicator else 0) << 7) | ((1 if begin == 0 else 0) << 6) | ((1 if transport_priority else 0) << 5) | ((pid & 0x1F00) >> 8),
-        (pid & 0x00FF),
-        (transport_scrambling_control << 6) | (1 << 4) | (continuity_counter & 0x0F),
-      ]) +
-      ([0] if begin == 0 else []) +
-      list(section[begin:next]) +
-      ([ts.STUFFING_BYTE[0]] * ((ts.PACKET_SIZE - ts.HEADER_SIZE) - ((next - begin) + (1 if begin == 0 else 0))))
-    ))
-    continuity_counter = (continuity_counter + 1) & 0x0F
+  for index in range(count):
+    offset = index * ts.PACKET_SIZE
+    HEADER.pack_into(buffer, offset, ts.SYNC_BYTE[0], flags | ((1 if index == 0 else 0) << 6), pid & 0x00FF, (transport_scrambling_control << 6) | (1 << 4) | ((continuity_counter + index) & 0x0F))
+    offset += ts.HEADER_SIZE
+    if index == 0:
+      buffer[offset] = 0 # pointer_field
+      offset += 1
+    next = min(length, begin + (ts.PACKET_SIZE - offset % ts.PACKET_SIZE))
+    buffer[offset:offset + (next - begin)] = data[begin:next]
     begin = next
-  return result
+  return buffer, (continuity_counter + count) & 0x0F
+
+def packetize_pes_buffer(pes: PES, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> tuple[bytearray, int]:
+  # returns (concatenated packets, next continuity_counter)
+  length = len(pes)
+  count = (length + (PAYLOAD_SIZE - 1)) // PAYLOAD_SIZE
+  buffer = bytearray(count * ts.PACKET_SIZE)
+  flags = ((1 if transport_error_indicator else 0) << 7) | ((1 if transport_priority else 0) << 5) | ((pid & 0x1F00) >> 8)
+  data = pes.payload if count > 0 else memoryview(b'')
+
+  for index in range(count):
+    offset = index * ts.PACKET_SIZE
+    begin = index * PAYLOAD_SIZE
+    size = min(PAYLOAD_SIZE, length - begin)
+    HEADER.pack_into(buffer, offset, ts.SYNC_BYTE[0], flags | ((1 if index == 0 else 0) << 6), pid & 0x00FF, (transport_scrambling_control << 6) | (0x30 if PAYLOAD_SIZE > size else 0x10) | ((continuity_counter + index) & 0x0F))
+    offset += ts.HEADER_SIZE
+    if PAYLOAD_SIZE > size: # last packet, fill with adaptation field stuffing
+      buffer[offset] = PAYLOAD_SIZE - size - 1
+      if PAYLOAD_SIZE > size + 1: buffer[offset + 1] = 0x00
+      if PAYLOAD_SIZE > size + 2: buffer[offset + 2:offset + (PAYLOAD_SIZE - size)] = ts.STUFFING_BYTE * (PAYLOAD_SIZE - size - 2)
+      offset += PAYLOAD_SIZE - size
+    buffer[offset:offset + size] = data[begin:begin + size]
+  return buffer, (continuity_counter + count) & 0x0F
+
+def packetize_section(section: Section, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> list[bytes]:
+  buffer, _ = packetize_section_buffer(section, transport_error_indicator, transport_priority, pid, transport_scrambling_control, continuity_counter)
+  return [bytes(buffer[begin:begin + ts.PACKET_SIZE]) for begin in range(0, len(buffer), ts.PACKET_SIZE)]
 
 def packetize_pes(pes: PES, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> list[bytes]:
-  result: list[bytes] = []
-  begin = 0
-  while (begin < len(pes)):
-    next = min(len(pes), begin + (ts.PACKET_SIZE - ts.HEADER_SIZE))
-    packet = bytearray()
-    packet += bytes([
-      ts.SYNC_BYTE[0],
-      ((1 if transport_error_indicator else 0) << 7) | ((1 if begin == 0 else 0) << 6) | ((1 if transport_priority else 0) << 5) | ((pid & 0x1F00) >> 8),
-      (pid & 0x00FF),
-      (transport_scrambling_control << 6) | (0x30 if (ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin) else 0x10) | (continuity_counter & 0x0F),
-    ])
-    if (((ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin))):
-      packet += bytes([((ts.PACKET_SIZE - ts.HEADER_SIZE) - (next - begin)) - 1])
-    if (((ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin + 1))):
-      packet += b'\x00'
-    if (((ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin + 2))):
-      packet += bytes([0xFF] * (((ts.PACKET_SIZE - ts.HEADER_SIZE) - (next - begin)) - 2))
-    packet += bytes(pes[begin:next])
-    result.append(bytes(packet))
-    continuity_counter = (continuity_counter + 1) & 0x0F
-    begin = next
-  return result
+  buffer, _ = packetize_pes_buffer(pes, transport_error_indicator, transport_priority, pid, transport_scrambling_control, continuity_counter)
+  return [bytes(buffer[begin:begin + ts.PACKET_SIZE]) for begin in range(0, len(buffer), ts.PACKET_SIZE)]
+
+class PacketizedSection:
+  # packets of section cached as template, only continuity_counter is patched per emission
+  def __init__(self, section: Section, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int):
+    self.section = section
+    self.pid = pid
+    self.template, _ = packetize_section_buffer(section, transport_error_indicator, transport_priority, pid, transport_scrambling_control, 0)
+    self.count = len(self.template) // ts.PACKET_SIZE
+    for index in range(self.count): self.template[index * ts.PACKET_SIZE + 3] &= 0xF0
+
+  def packetize(self, continuity_counter: int) -> tuple[bytearray, int]:
+    buffer = bytearray(self.template)
+    for index in range(self.count):
+      buffer[index * ts.PACKET_SIZE + 3] |= (continuity_counter + index) & 0x0F
+    return buffer, (continuity_counter + self.count) & 0x0F
@@ -1,20 +1,25 @@
 #!/usr/bin/env python3
 
 from collections import deque
-from typing import cast, Generic, Type, TypeVar, Iterator
+from typing import cast, Any, Callable, Generic, Type, TypeVar, Iterable, Iterator
 
 from biim.mpeg2ts import ts
 from biim.mpeg2ts.section import Section
 from biim.mpeg2ts.pes import PES
+from biim.mpeg2ts.batch import PacketBatch
 
 SectionType = TypeVar('SectionType', bound=Section)
 PESType = TypeVar('PESType', bound=PES)
 
 class SectionParser(Generic[SectionType]):
-  def __init__(self, _class: Type[Section] = Section):
+  def __init__(self, _class: Type[Section] = Section, repeat: bool = True, on_change: Callable[[SectionType], Any] | None = None):
     self.section: bytearray | None = None
     self.queue: deque[Section] = deque()
     self._class: Type[Section] = _class
+    # Change Detection (byte identical section is not parsed again)
+    self.repeat = repeat # True: yield previous object for repeated section, False: suppress it
+    self.on_change = on_change # called only when (CRC valid) section differs from previous one
+    self.latest: dict[tuple[int, ...], tuple[bytes, Section]] = dict()
 
   def __iter__(self) -> Iterator[SectionType]:
     return self
@@ -26,15 +31,23 @@ class SectionParser(Generic[SectionType]):
 
   def push(self, packet: bytes | bytearray | memoryview) -> None:
     begin = ts.HEADER_SIZE + (1 + ts.adaptation_field_length(packet) if ts.has_adaptation_field(packet) else 0)
-    if ts.payload_unit_start_indicator(packet): begin += 1
+    self.__push(packet, begin, ts.payload_unit_start_indicator(packet))
+
+  def push_batch(self, batch: PacketBatch, rows: Iterable[int]) -> None:
+    payload_offset, payload_unit_start_indicator = batch.payload_offset, batch.payload_unit_start_indicator
+    for row in rows: self.__push(batch[row], payload_offset[row], payload_unit_start_indicator[row])
+
+  def __push(self, packet: bytes | bytearray | memoryview, begin: int, payload_unit_start_indicator: bool) -> None:
+    if begin >= ts.PACKET_SIZE: return
+    if payload_unit_start_indicator: begin += 1
 
     if not self.section:
-      if ts.payload_unit_start_indicator(packet):
-        begin += ts.pointer_field(packet)
+      if payload_unit_start_indicator:
+        begin += packet[begin - 1]
       else:
         return
 
-    if ts.payload_unit_start_indicator(packet):
+    if payload_unit_start_indicator:
       while begin < ts.PACKET_SIZE:
         if packet[begin] == ts.STUFFING_BYTE[0]: break
         if self.section:
@@ -47,7 +60,7 @@ class SectionParser(Generic[SectionType]):
 
         section_length = ((self.section[1] & 0x0F) << 8) | self.section[2]
         if len(self.section) == section_length + 3:
-          self.queue.append(self._class(self.section))
+          self.__emit(self.section)
           self.section = None
         elif len(self.section) > section_length + 3:
           self.section = None
@@ -61,14 +74,33 @@ class SectionParser(Generic[SectionType]):
       self.section += packet[begin:next]
 
       if len(self.section) == section_length + 3:
-        self.queue.append(self._class(self.section))
+        self.__emit(self.section)
         self.section = None
       elif len(self.section) > section_length + 3:
         self.section = None
 
+  def __emit(self, raw: bytearray) -> None:
+    # long form is identified by table_id, table_id_extension and section_number, short form by table_id only
+    key = (raw[0], (raw[3] << 8) | raw[4], raw[6]) if raw[1] & 0x80 and len(raw) >= Section.EXTENDED_HEADER_SIZE else (raw[0],)
+    if (latest := self.latest.get(key)) is not None and raw == latest[0]:
+      if self.repeat: self.queue.append(latest[1])
+      return
+
+    section = self._class(raw)
+    if section.CRC32() == 0:
+      self.latest[key] = (bytes(raw), section)
+      if self.on_change is not None: self.on_change(cast(SectionType, section))
+    self.queue.append(section)
+
 class PESParser(Generic[PESType]):
-  def __init__(self, _class: Type[PES] = PES):
-    self.pes = None
+  def __init__(self, _class: Type[PES] = PES, keep_packets: bool = False):
+    # PES is reassembled as list of payload views (scatter-gather), not copied per packet
+    self.fragments: list[memoryview] = [] # empty while no PES is in progress
+    self.length: int = 0
+    self.expected: int | None = None # None for unbounded (PES_packet_length == 0)
+    # Original TS packets of each PES (for pass-through), attached to PES.packets
+    self.keep_packets = keep_packets
+    self.packets: list[bytes | bytearray | memoryview] = []
     self.queue: deque[PES] = deque()
     self._class: Type[PES] = _class
 
@@ -82,31 +114,45 @@ class PESParser(Generic[PESType]):
 
   def push(self, packet: bytes | bytearray | memoryview) -> None:
     begin = ts.HEADER_SIZE + (1 + ts.adaptation_field_length(packet) if ts.has_adaptation_field(packet) else 0)
-    if not ts.payload_unit_start_indicator(packet) and not self.pes: return
+    self.__push(packet, begin, ts.payload_unit_start_indicator(packet))
+
+  def push_batch(self, batch: PacketBatch, rows: Iterable[int]) -> None:
+    payload_offset, payload_unit_start_indicator = batch.payload_offset, batch.payload_unit_start_indicator
+    for row in rows: self.__push(batch[row], payload_offset[row], payload_unit_start_indicator[row])
 
-    if ts.payload_unit_start_indicator(packet):
-      if self.pes and ((self.pes[4] << 8) | self.pes[5]) == 0:
-        self.queue.append(self._class(self.pes))
+  def __push(self, packet: bytes | bytearray | memoryview, begin: int, payload_unit_start_indicator: bool) -> None:
+    if not payload_unit_start_indicator and not self.fragments: return
+
+    if payload_unit_start_indicator:
+      if self.fragments and self.expected is None:
+        self.__emit()
 
       pes_length = (packet[begin + 4] << 8) | packet[begin + 5]
-      if pes_length == 0:
-        next = ts.PACKET_SIZE
-      else:
-        next = min(begin + (PES.HEADER_SIZE + pes_length), ts.PACKET_SIZE)
-      self.pes = bytearray(packet[begin:next])
-    elif self.pes:
-      pes_length = (self.pes[4] << 8) | self.pes[5]
-      if pes_length == 0:
-        next = ts.PACKET_SIZE
-      else:
-        next = min(begin + (PES.HEADER_SIZE + pes_length) - len(self.pes), ts.PACKET_SIZE)
-      self.pes += packet[begin:next]
-    else:
-      return
+      self.expected = PES.HEADER_SIZE + pes_length if pes_length > 0 else None
+      self.fragments, self.length = [], 0
+      self.packets = []
 
-    if ((self.pes[4] << 8) | self.pes[5]) > 0:
-      if len(self.pes) == PES.HEADER_SIZE + (self.pes[4] << 8 | self.pes[5]):
-        self.queue.append(self._class(self.pes))
-        self.pes = None
-      elif len(self.pes) > PES.HEADER_SIZE + (self.pes[4] << 8 | self.pes[5]):
-        self.pes = None
+    if self.expected is None:
+      next = ts.PACKET_SIZE
+    else:
+      next = min(begin + (self.expected - self.length), ts.PACKET_SIZE)
+    view = packet[begin:next] if type(packet) is memoryview else memoryview(packet)[begin:next]
+    # views over immutable buffer can be retained, mutable one (e.g. ring buffer) must be copied
+    if not view.readonly:
+      packet = bytes(packet)
+      view = memoryview(packet)[begin:next]
+    self.fragments.append(view)
+    self.length += next - begin
+    if self.keep_packets: self.packets.append(packet)
+
+    if self.expected is not None:
+      if self.length == self.expected:
+        self.__emit()
+        self.fragments = []
+      elif self.length > self.expected:
+        self.fragments = []
+
+  def __emit(self) -> None:
+    pes = self._class(self.fragments)
+    if self.keep_packets: pes.packets = self.packets
+    self.queue.append(pes)
@@ -5,6 +5,8 @@ from typing import Iterator
 from biim.mpeg2ts.section import Section
 
 class PATSection(Section):
+  __slots__ = ('entry',)
+
   def __init__(self, payload: bytes | bytearray | memoryview = b''):
     super().__init__(payload)
     self.entry: list[tuple[int, int]] = [
@@ -1,86 +1,83 @@
 #!/usr/bin/env python3
 
-from typing import Any
+from typing import cast, Any
+
+NO_OPTIONAL_HEADER_STREAM_IDS = frozenset([0b10111100, 0b10111110, 0b10111111, 0b11110000, 0b11110001, 0b11110010, 0b11111000, 0b11111111])
+
+def timestamp(header: memoryview, offset: int) -> int | None:
+  if len(header) < offset + 5: return None # truncated header
+  return ((header[offset + 0] & 0x0E) << 29) | (header[offset + 1] << 22) | ((header[offset + 2] & 0xFE) << 14) | (header[offset + 3] << 7) | ((header[offset + 4] & 0xFE) >> 1)
 
 class PES:
   HEADER_SIZE = 6
 
-  def __init__(self, payload: bytes | bytearray | memoryview = b''):
-    self.payload = memoryview(payload)
+  __slots__ = ('fragments', 'materialized', 'length', 'header', 'sid', 'optional', 'flags', 'header_length', 'presentation_timestamp', 'decoding_timestamp', 'data_offset', 'data', 'packets')
+
+  def __init__(self, payload: bytes | bytearray | memoryview | list[memoryview] = b''):
+    # payload can be given as fragments (scatter-gather), joined into one buffer only when accessed
+    if type(payload) is list:
+      self.fragments: list[memoryview] = payload
+      self.materialized: memoryview | None = payload[0] if len(payload) == 1 else None
+    else:
+      self.materialized = memoryview(cast(bytes | bytearray | memoryview, payload))
+      self.fragments = [self.materialized]
+    self.length: int = sum(len(fragment) for fragment in self.fragments)
+    # PES header is contained in first fragment almost always, so header access does not materialize payload
+    head = self.fragments[0] if self.fragments else memoryview(b'')
+    self.header: memoryview = head if len(head) >= PES.HEADER_SIZE + 3 and len(head) >= PES.HEADER_SIZE + 3 + head[PES.HEADER_SIZE + 2] else self.payload
+    self.data: memoryview | None = None
+    self.packets: list[bytes | bytearray | memoryview] | None = None # original TS packets, when kept by parser
+
+    # parse header once
+    header = self.header
+    self.sid: int = header[3] if len(header) > 3 else 0
+    self.optional: bool = self.sid not in NO_OPTIONAL_HEADER_STREAM_IDS and len(header) >= PES.HEADER_SIZE + 3
+    self.flags: int = header[PES.HEADER_SIZE + 1] if self.optional else 0
+    self.header_length: int | None = header[PES.HEADER_SIZE + 2] if self.optional else None
+    self.presentation_timestamp: int | None = timestamp(header, PES.HEADER_SIZE + 3) if self.flags & 0x80 else None
+    self.decoding_timestamp: int | None = timestamp(header, PES.HEADER_SIZE + (8 if self.flags & 0x80 else 3)) if self.flags & 0x40 else None
+    self.data_offset: int = PES.HEADER_SIZE + 3 + cast(int, self.header_length) if self.optional else PES.HEADER_SIZE
+
+  @property
+  def payload(self) -> memoryview:
+    if self.materialized is None:
+      self.materialized = memoryview(b''.join(self.fragments))
+      self.fragments = [self.materialized]
+    return self.materialized
 
   def __getitem__(self, item: Any) -> Any:
     return self.payload[item]
 
   def __len__(self) -> int:
-    return len(self.payload)
+    return self.length
 
   def packet_start_code_prefix(self) -> int:
-    return (self.payload[0] << 16) | (self.payload[1] << 8) | self.payload[2]
+    return (self.header[0] << 16) | (self.header[1] << 8) | self.header[2]
 
   def stream_id(self) -> int:
-    return self.payload[3]
+    return self.sid
 
   def PES_packet_length(self) -> int:
-    return (self.payload[4] << 8) | self.payload[5]
+    return (self.header[4] << 8) | self.header[5]
 
   def has_optional_pes_header(self) -> bool:
-    if self.stream_id() in [0b10111100, 0b10111111, 0b11110000, 0b11110001, 0b11110010, 0b11111000, 0b11111111]:
-      return False
-    elif self.stream_id() in [0b10111110]:
-      return False
-    else:
-      return True
+    return self.optional
 
   def has_pts(self) -> bool:
-    if self.has_optional_pes_header():
-      return (self.payload[PES.HEADER_SIZE + 1] & 0x80) != 0
-    else:
-      return False
+    return (self.flags & 0x80) != 0
 
   def has_dts(self) -> bool:
-    if self.has_optional_pes_header():
-      return (self.payload[PES.HEADER_SIZE + 1] & 0x40) != 0
-    else:
-      return False
+    return (self.flags & 0x40) != 0
 
   def pes_header_length(self) -> int | None:
-    if self.has_optional_pes_header():
-      return (self.payload[PES.HEADER_SIZE + 2])
-    else:
-      return None
+    return self.header_length
 
   def pts(self) -> int | None:
-    if not self.has_pts(): return None
-
-    pts = 0
-    pts <<= 3; pts |= ((self.payload[PES.HEADER_SIZE + 3 + 0] & 0x0E) >> 1)
-    pts <<= 8; pts |= ((self.payload[PES.HEADER_SIZE + 3 + 1] & 0xFF) >> 0)
-    pts <<= 7; pts |= ((self.payload[PES.HEADER_SIZE + 3 + 2] & 0xFE) >> 1)
-    pts <<= 8; pts |= ((self.payload[PES.HEADER_SIZE + 3 + 3] & 0xFF) >> 0)
-    pts <<= 7; pts |= ((self.payload[PES.HEADER_SIZE + 3 + 4] & 0xFE) >> 1)
-    return pts
+    return self.presentation_timestamp
 
   def dts(self) -> int | None:
-    if not self.has_dts(): return None
-
-    dts = 0
-    if self.has_pts():
-      dts <<= 3; dts |= ((self.payload[PES.HEADER_SIZE + 8 + 0] & 0x0E) >> 1)
-      dts <<= 8; dts |= ((self.payload[PES.HEADER_SIZE + 8 + 1] & 0xFF) >> 0)
-      dts <<= 7; dts |= ((self.payload[PES.HEADER_SIZE + 8 + 2] & 0xFE) >> 1)
-      dts <<= 8; dts |= ((self.payload[PES.HEADER_SIZE + 8 + 3] & 0xFF) >> 0)
-      dts <<= 7; dts |= ((self.payload[PES.HEADER_SIZE + 8 + 4] & 0xFE) >> 1)
-    else:
-      dts <<= 3; dts |= ((self.payload[PES.HEADER_SIZE + 3 + 0] & 0x0E) >> 1)
-      dts <<= 8; dts |= ((self.payload[PES.HEADER_SIZE + 3 + 1] & 0xFF) >> 0)
-      dts <<= 7; dts |= ((self.payload[PES.HEADER_SIZE + 3 + 2] & 0xFE) >> 1)
-      dts <<= 8; dts |= ((self.payload[PES.HEADER_SIZE + 3 + 3] & 0xFF) >> 0)
-      dts <<= 7; dts |= ((self.payload[PES.HEADER_SIZE + 3 + 4] & 0xFE) >> 1)
-
-    return dts
+    return self.decoding_timestamp
 
   def PES_packet_data(self) -> memoryview:
-    if self.has_optional_pes_header():
-      return self.payload[PES.HEADER_SIZE + 3 + self.payload[PES.HEADER_SIZE + 2]:]
-    else:
-      return self.payload[PES.HEADER_SIZE:]
+    if self.data is None: self.data = self.payload[self.data_offset:]
+    return self.data
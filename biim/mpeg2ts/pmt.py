@@ -5,6 +5,8 @@ from typing import Iterator
 from biim.mpeg2ts.section import Section
 
 class PMTSection(Section):
+  __slots__ = ('PCR_PID', 'entry')
+
   def __init__(self, payload: bytes | bytearray | memoryview = b''):
     super().__init__(payload)
     self.PCR_PID: int = ((self.payload[Section.EXTENDED_HEADER_SIZE + 0] & 0x1F) << 8) | self.payload[Section.EXTENDED_HEADER_SIZE + 1]
@@ -2,13 +2,18 @@
 
 from typing import Any
 
+from biim.mpeg2ts.crc import crc32
+
 class Section:
   BASIC_HEADER_SIZE = 3
   EXTENDED_HEADER_SIZE = 8
   CRC_SIZE = 4
 
+  __slots__ = ('payload', 'crc')
+
   def __init__(self, payload: bytes | bytearray | memoryview = b''):
     self.payload = memoryview(payload)
+    self.crc: int | None = None
 
   def __getitem__(self, item: Any) -> Any:
     return self.payload[item]
@@ -38,12 +43,5 @@ class Section:
     return self.payload[7]
 
   def CRC32(self) -> int:
-    crc = 0xFFFFFFFF
-    for byte in self.payload:
-      for index in range(7, -1, -1):
-        bit = (byte & (1 << index)) >> index
-        c = 1 if crc & 0x80000000 else 0
-        crc <<= 1
-        if c ^ bit: crc ^= 0x04c11db7
-        crc &= 0xFFFFFFFF
-    return crc
+    if self.crc is None: self.crc = crc32(self.payload)
+    return self.crc
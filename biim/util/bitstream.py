@@ -1,73 +1,95 @@
-from collections import deque
+EMULATION_PREVENTION = b'\x00\x00\x03'
+
+def ebsp2rbsp(data: bytes | bytearray | memoryview) -> bytes:
+  # remove emulation_prevention_three_byte (00 00 03 followed by 00-03)
+  data = bytes(data)
+  length = len(data)
+  rbsp: list[bytes] = []
+  begin = 0
+  index = data.find(EMULATION_PREVENTION)
+  while index >= 0:
+    escape = index + 2
+    if escape < length - 1 and data[escape + 1] <= 0x03:
+      rbsp.append(data[begin:escape])
+      begin = escape + 1
+    index = data.find(EMULATION_PREVENTION, escape + 1)
+  if begin == 0: return data
+  rbsp.append(data[begin:])
+  return b''.join(rbsp)
 
 class BitStream:
 
   def __init__(self, data):
-    self.bits: deque[int] = deque()
-    self.data: deque[int] = deque(data)
+    # integer bit cursor over memoryview (no copy for bytes-like input)
+    self.data: memoryview = memoryview(data if isinstance(data, (bytes, bytearray, memoryview)) else bytes(data)).cast('B')
+    self.position: int = 0
+    self.end: int = len(self.data) * 8
 
   def __bool__(self) -> bool:
-    return bool(self.bits or self.data)
+    return self.position < self.end
 
   def __len__(self) -> int:
-    return len(self.data) * 8 + len(self.bits)
+    return self.end - self.position
 
-  def __fill_bits(self) -> None:
-    if not self.data:
-      return
-    byte = self.data.popleft()
-    for index in range(8):
-      bit_index = (8 - 1) - index
-      self.bits.append(1 if (byte & (1 << bit_index)) != 0 else 0)
-
-  def __peekBit(self) -> int:
-    if not self.bits:
-      self.__fill_bits()
-    return self.bits[0]
+  def __peekBits(self, size: int) -> int:
+    end = min(self.position + size, self.end)
+    if end <= self.position: return 0
+    begin_byte, end_byte = self.position >> 3, (end + 7) >> 3
+    value = int.from_bytes(self.data[begin_byte:end_byte], byteorder='big')
+    return (value >> ((end_byte << 3) - end)) & ((1 << (end - self.position)) - 1)
 
   def __count_trailing_zeros(self) -> int:
     result = 0
-    while self.__peekBit() == 0:
-      self.readBits(1)
-      result += 1
-    return result
+    while True:
+      if self.position >= self.end: raise IndexError('bitstream exhausted')
+      size = min(64, self.end - self.position)
+      value = self.__peekBits(size)
+      if value != 0:
+        zeros = size - value.bit_length()
+        self.position += zeros
+        return result + zeros
+      self.position += size
+      result += size
 
   def readBits(self, size: int) -> int:
-    result = 0
-    remain_bits_len = min(len(self.bits), size)
-    for _ in range(remain_bits_len):
-      result *= 2
-      result += self.bits.popleft()
-      size -= 1
-
-    while size >= 8 and self.data:
-      byte = self.data.popleft()
-      result *= 256
-      result += byte
-      size -= 8
-    if size == 0:
-      return result
-
-    self.__fill_bits()
-    remain_bits_len = min(len(self.bits), size)
-    for _ in range(remain_bits_len):
-      result *= 2
-      result += self.bits.popleft()
-      size -= 1
-    return result
+    # returns available bits only, when exceeds end of stream
+    position = self.position
+    end = position + size
+    if end > self.end: end = self.end
+    if end <= position: return 0
+    end_byte = (end + 7) >> 3
+    value = int.from_bytes(self.data[position >> 3:end_byte], byteorder='big')
+    self.position = end
+    return (value >> ((end_byte << 3) - end)) & ((1 << (end - position)) - 1)
 
   def readBool(self) -> bool:
-    return self.readBits(1) == 1
+    position = self.position
+    if position >= self.end: return False
+    self.position = position + 1
+    return (self.data[position >> 3] >> (7 - (position & 7))) & 1 == 1
 
   def readByte(self, size: int = 1) -> int:
     return self.readBits(size * 8)
 
   def readBitStreamFromBytes(self, size: int) -> 'BitStream':
+    if self.position % 8 == 0:
+      begin = self.position >> 3
+      end = min(begin + size, self.end >> 3)
+      self.position = end << 3
+      return BitStream(self.data[begin:end])
     return BitStream(bytes([
       self.readByte(1) for _ in range(size)
     ]))
 
   def readUEG(self) -> int:
+    # fast path: whole Exp-Golomb code fits in one 64 bit window
+    size = min(64, self.end - self.position)
+    value = self.__peekBits(size)
+    if value != 0:
+      length = 2 * (size - value.bit_length()) + 1
+      if length <= size:
+        self.position += length
+        return (value >> (size - length)) - 1
     count = self.__count_trailing_zeros()
     return self.readBits(count + 1) - 1
 
@@ -79,5 +101,15 @@ class BitStream:
       return -1 * (ueg >> 1)
 
   def retainByte(self, byte: int) -> None:
-    for i in range(8):
-      self.bits.appendleft(1 if byte & (1 << i) != 0 else 0)
+    if self.position >= 8:
+      self.position -= 8
+      if self.__peekBits(8) == byte: return
+      self.position += 8
+    # push back arbitrary byte, rebuild buffer as (byte + remaining bits) aligned to the end
+    remains = self.end - self.position
+    total = remains + 8
+    padding = (-total) % 8
+    value = (byte << remains) | self.__peekBits(remains)
+    self.data = memoryview(value.to_bytes((total + padding) // 8, byteorder='big'))
+    self.position = padding
+    self.end = padding + total
@@ -1,27 +1,201 @@
 import asyncio
+import threading
+from typing import cast, AsyncIterator
+
+from biim.mpeg2ts import ts
 
 class BufferingAsyncReader:
-  def __init__(self, reader, size: int):
+  def __init__(self, reader, size: int, capacity: int | None = None, high_water: int | None = None, low_water: int | None = None):
     self.reader = reader
-    self.buffer: bytearray = bytearray()
-    self.size: int = size
+    self.size: int = size # maximum bytes per read from the reader thread
+    self.capacity: int = max(size, capacity if capacity is not None else size * 64)
+    self.high_water: int = min(self.capacity, high_water if high_water is not None else self.capacity)
+    self.low_water: int = min(self.high_water, low_water if low_water is not None else self.high_water // 2)
+    # Ring Buffer (head/tail are total written/consumed bytes)
+    self.buffer: bytearray = bytearray(self.capacity)
+    self.view: memoryview = memoryview(self.buffer)
+    self.head: int = 0
+    self.tail: int = 0
+    self.lent: int = 0 # bytes handed out by read_packets, released on next read
+    self.wanted: int = 0 # bytes awaited by readexactly, the thread reads past high_water for them
+    self.eof: bool = False
+    self.error: BaseException | None = None
+    # Reader Thread
+    self.condition = threading.Condition()
+    self.readable: asyncio.Event | None = None
+    self.loop: asyncio.AbstractEventLoop | None = None
+    self.thread: threading.Thread | None = None
 
-  async def __fill(self) -> bool:
-    data = await asyncio.to_thread(lambda: self.reader.read(self.size))
-    if data == b'': return False
-    self.buffer += data
-    return True
+  def __start(self) -> None:
+    if self.thread is not None: return
+    self.loop = asyncio.get_running_loop()
+    self.readable = asyncio.Event()
+    self.thread = threading.Thread(target=self.__run, daemon=True)
+    self.thread.start()
 
-  async def read(self, n: int) -> memoryview:
-    while len(self.buffer) < n:
-      if not (await self.__fill()): break
-    result = self.buffer[:n]
-    self.buffer = self.buffer[n:]
+  def __notify(self) -> None:
+    try:
+      cast(asyncio.AbstractEventLoop, self.loop).call_soon_threadsafe(cast(asyncio.Event, self.readable).set)
+    except RuntimeError: # event loop already closed
+      pass
+
+  def __run(self) -> None:
+    readinto = getattr(self.reader, 'readinto1', None) or getattr(self.reader, 'readinto', None)
+    try:
+      while True:
+        with self.condition:
+          if self.head - self.tail >= max(self.high_water, self.wanted):
+            self.condition.wait_for(lambda: self.head - self.tail <= self.low_water or self.head - self.tail < self.wanted)
+          offset = self.head % self.capacity
+          free = min(self.size, self.capacity - (self.head - self.tail), self.capacity - offset)
+
+        if readinto is not None:
+          length = readinto(self.view[offset:offset + free])
+        else:
+          data = self.reader.read(free)
+          length = len(data)
+          self.view[offset:offset + length] = data
+        if not length: break
+
+        with self.condition:
+          self.head += length
+        self.__notify()
+    except BaseException as e:
+      self.error = e
+    finally:
+      self.eof = True
+      self.__notify()
+
+  async def __wait(self, n: int) -> int:
+    self.__start()
+    readable = cast(asyncio.Event, self.readable)
+    if self.head - self.tail < n:
+      with self.condition:
+        self.wanted = n
+        self.condition.notify()
+    while self.head - self.tail < n and not self.eof:
+      readable.clear()
+      if self.head - self.tail >= n or self.eof: break
+      await readable.wait()
+    self.wanted = 0
+    if self.error is not None: raise self.error
+    return self.head - self.tail
+
+  def __release(self, n: int) -> None:
+    if n == 0: return
+    with self.condition:
+      self.tail += n
+      if self.head - self.tail <= self.low_water: self.condition.notify()
+
+  def __take(self, n: int) -> memoryview:
+    offset = self.tail % self.capacity
+    if offset + n <= self.capacity:
+      result = bytes(self.view[offset:offset + n])
+    else:
+      result = bytes(self.view[offset:]) + bytes(self.view[:n - (self.capacity - offset)])
+    self.__release(n)
     return memoryview(result)
 
+  async def read(self, n: int) -> memoryview:
+    # same as asyncio.StreamReader, returns available bytes (up to n) without waiting to fill n
+    self.__release(self.lent)
+    self.lent = 0
+    available = await self.__wait(1)
+    return self.__take(min(n, available))
+
   async def readexactly(self, n: int) -> memoryview:
-    while len(self.buffer) < n:
-      if not (await self.__fill()): raise asyncio.IncompleteReadError(self.buffer, None)
-    result = self.buffer[:n]
-    self.buffer = self.buffer[n:]
-    return memoryview(result)
+    if n > self.capacity: raise ValueError(f'readexactly({n}) exceeds capacity ({self.capacity})')
+    self.__release(self.lent)
+    self.lent = 0
+    available = await self.__wait(n)
+    if available < n: raise asyncio.IncompleteReadError(bytes(self.__take(available)), n)
+    return self.__take(n)
+
+  async def read_packets(self, count: int | None = None) -> memoryview:
+    # returns view into the ring buffer, it is valid until next read/readexactly/read_packets
+    self.__release(self.lent)
+    self.lent = 0
+    available = await self.__wait(ts.PACKET_SIZE)
+    if available < ts.PACKET_SIZE: return memoryview(b'')
+
+    offset = self.tail % self.capacity
+    contiguous = min(available, self.capacity - offset)
+    if contiguous < ts.PACKET_SIZE: # packet wraps around the ring, so copy only this packet
+      return self.__take(ts.PACKET_SIZE)
+    length = contiguous - (contiguous % ts.PACKET_SIZE)
+    if count is not None: length = min(length, count * ts.PACKET_SIZE)
+    self.lent = length
+    return self.view[offset:offset + length]
+
+class PacketAlignedAsyncReader:
+  def __init__(self, reader, size: int = ts.PACKET_SIZE * 348, strides: int = 3):
+    self.reader = reader # asyncio.StreamReader or BufferingAsyncReader
+    self.size: int = size
+    self.strides: int = strides # number of following sync bytes to confirm when (re)synchronizing
+    self.buffer: bytes = b''
+    self.synced: bool = False
+    self.eof: bool = False
+
+  def __aiter__(self) -> AsyncIterator[memoryview]:
+    return self.packets()
+
+  async def packets(self) -> AsyncIterator[memoryview]:
+    while (chunk := await self.read()) is not None:
+      for begin in range(0, len(chunk), ts.PACKET_SIZE):
+        yield chunk[begin:begin + ts.PACKET_SIZE]
+
+  async def chunks(self) -> AsyncIterator[memoryview]:
+    while (chunk := await self.read()) is not None:
+      yield chunk
+
+  async def __fill(self) -> None:
+    read_packets = getattr(self.reader, 'read_packets', None)
+    if read_packets is not None and self.synced and len(self.buffer) < ts.PACKET_SIZE:
+      # once the leftover packet is completed the ring tail is packet aligned, so whole packets are copied out once
+      if self.buffer:
+        data = await self.reader.read(ts.PACKET_SIZE - len(self.buffer))
+      else:
+        data = await read_packets(max(1, self.size // ts.PACKET_SIZE))
+    else:
+      data = await self.reader.read(self.size)
+    if not data:
+      self.eof = True
+      return
+    data = data if type(data) is bytes else bytes(data)
+    self.buffer = self.buffer + data if self.buffer else data
+
+  def __resync(self) -> bool:
+    begin = 0
+    while (index := self.buffer.find(ts.SYNC_BYTE, begin)) >= 0:
+      end = index + self.strides * ts.PACKET_SIZE + 1
+      if len(self.buffer) < end and not self.eof:
+        self.buffer = self.buffer[index:] # wait for more data to confirm this candidate
+        return False
+      heads = self.buffer[index:end:ts.PACKET_SIZE]
+      if heads == ts.SYNC_BYTE * len(heads):
+        self.buffer = self.buffer[index:]
+        return True
+      begin = index + 1
+    self.buffer = b''
+    return False
+
+  async def read(self) -> memoryview | None:
+    # returns contiguous packet aligned view (multiple of PACKET_SIZE), None for EOF
+    while True:
+      if not self.synced: self.synced = self.__resync()
+      if self.synced:
+        count = len(self.buffer) // ts.PACKET_SIZE
+        heads = self.buffer[0:count * ts.PACKET_SIZE:ts.PACKET_SIZE]
+        aligned = count - len(heads.lstrip(ts.SYNC_BYTE))
+        if aligned > 0:
+          end = aligned * ts.PACKET_SIZE
+          chunk = memoryview(self.buffer)[:end]
+          self.buffer = self.buffer[end:]
+          return chunk
+        elif count > 0: # lost synchronization
+          self.synced = False
+          self.buffer = self.buffer[1:]
+          continue
+
+      if self.eof: return None
+      await self.__fill()
@@ -1,16 +1,9 @@
 import re
+from collections import OrderedDict
 
-from biim.util.bitstream import BitStream
-
-escapes = set([0x00, 0x01, 0x02, 0x03])
-def ebsp2rbsp(data: bytes | bytearray | memoryview) -> bytes:
-  rbsp = bytearray(data[:2])
-  length = len(data)
-  for index in range(2, length):
-    if index < length - 1 and data[index - 2] == 0x00 and data[index - 1] == 0x00 and data[index + 0] == 0x03 and data[index + 1] in escapes:
-      continue
-    rbsp.append(data[index])
-  return bytes(rbsp)
+from biim.util.bitstream import BitStream, ebsp2rbsp
+from biim.mp4.avc import avcConfiguration
+from biim.mp4.hevc import hevcConfiguration
 
 def aac_codec_parameter_string(audioObjectType: int):
   return f'mp4a.40.{audioObjectType}'
@@ -44,3 +37,70 @@ def hevc_codec_parameter_string(sps: bytes | bytearray | memoryview):
   if general_constraint_indicator_flags[0] != 0: codec_parameter_string += f'.{general_constraint_indicator_flags[0]:X}'
 
   return codec_parameter_string
+
+class VideoConfiguration:
+  __slots__ = ('parameter_sets', 'track', 'codec', 'width', 'height', 'fps_num', 'fps_den', 'fps_fixed')
+
+  def __init__(self, parameter_sets: tuple[bytes, ...], track: bytes, codec: str, width: int, height: int, fps_num: int, fps_den: int, fps_fixed: bool):
+    self.parameter_sets = parameter_sets
+    self.track = track
+    self.codec = codec
+    self.width = width
+    self.height = height
+    self.fps_num = fps_num
+    self.fps_den = fps_den
+    self.fps_fixed = fps_fixed
+
+  def frame_duration(self, timescale: int) -> int | None:
+    if self.fps_num <= 0 or self.fps_den <= 0: return None
+    return timescale * self.fps_den // self.fps_num
+
+class VideoConfigurationCache:
+  # parsed parameter sets keyed by their raw bytes, parse only when bytes changed
+  def __init__(self, trackId: int, timescale: int, capacity: int = 8):
+    self.trackId = trackId
+    self.timescale = timescale
+    self.capacity = capacity
+    self.entries: OrderedDict[tuple[bytes, ...], VideoConfiguration] = OrderedDict()
+    self.current: VideoConfiguration | None = None
+    self.version: int = 0 # incremented every time current configuration changed
+    self.hits: int = 0
+    self.misses: int = 0
+
+  def __lookup(self, parameter_sets: tuple[bytes, ...]) -> VideoConfiguration | None:
+    if (configuration := self.entries.get(parameter_sets)) is None: return None
+    self.hits += 1
+    self.entries.move_to_end(parameter_sets)
+    return configuration
+
+  def __store(self, configuration: VideoConfiguration) -> VideoConfiguration:
+    self.misses += 1
+    self.entries[configuration.parameter_sets] = configuration
+    while len(self.entries) > self.capacity: self.entries.popitem(last=False)
+    return configuration
+
+  def avc(self, sps: bytes | bytearray | memoryview, pps: bytes | bytearray | memoryview) -> bool:
+    # returns True when configuration changed (including first configuration)
+    parameter_sets = (bytes(sps), bytes(pps))
+    if self.current is not None and self.current.parameter_sets == parameter_sets:
+      self.hits += 1
+      return False
+    if (configuration := self.__lookup(parameter_sets)) is None:
+      track, width, height, fps_num, fps_den, fps_fixed = avcConfiguration(self.trackId, self.timescale, sps, pps)
+      configuration = self.__store(VideoConfiguration(parameter_sets, track, avc_codec_parameter_string(sps), width, height, fps_num, fps_den, fps_fixed))
+    self.current = configuration
+    self.version += 1
+    return True
+
+  def hevc(self, vps: bytes | bytearray | memoryview, sps: bytes | bytearray | memoryview, pps: bytes | bytearray | memoryview) -> bool:
+    # returns True when configuration changed (including first configuration)
+    parameter_sets = (bytes(vps), bytes(sps), bytes(pps))
+    if self.current is not None and self.current.parameter_sets == parameter_sets:
+      self.hits += 1
+      return False
+    if (configuration := self.__lookup(parameter_sets)) is None:
+      track, width, height, fps_num, fps_den, fps_fixed = hevcConfiguration(self.trackId, self.timescale, vps, sps, pps)
+      configuration = self.__store(VideoConfiguration(parameter_sets, track, hevc_codec_parameter_string(sps), width, height, fps_num, fps_den, fps_fixed))
+    self.current = configuration
+    self.version += 1
+    return True
@@ -1,19 +1,21 @@
+from collections import deque
 from datetime import datetime, timedelta
+from typing import cast
 
 from biim.variant.handler import VariantHandler
 from biim.variant.codec import aac_codec_parameter_string
-from biim.variant.codec import avc_codec_parameter_string
-from biim.variant.codec import hevc_codec_parameter_string
+from biim.variant.codec import VideoConfiguration, VideoConfigurationCache
 
 from biim.mpeg2ts import ts
 from biim.mpeg2ts.pes import PES
 from biim.mpeg2ts.h264 import H264PES
 from biim.mpeg2ts.h265 import H265PES
-from biim.mp4.box import ftyp, moov, mvhd, mvex, trex, moof, mdat, emsg
-from biim.mp4.avc import avcTrack
-from biim.mp4.hevc import hevcTrack
+from biim.mp4.box import ftyp, moov, mvhd, mvex, trex, emsg
+from biim.mp4.fragment import FragmentBuilder
 from biim.mp4.mp4a import mp4aTrack
 
+PREDICTION_WINDOW = 15
+
 AAC_SAMPLING_FREQUENCY = {
   0x00: 96000,
   0x01: 88200,
@@ -32,19 +34,88 @@ AAC_SAMPLING_FREQUENCY = {
 
 class Fmp4VariantHandler(VariantHandler):
 
-  def __init__(self, target_duration: int, part_target: float, window_size: int | None = None, has_video: bool = True, has_audio: bool = True):
-    super().__init__(target_duration, part_target, 'video/mp4', window_size, True, has_video, has_audio)
+  def __init__(self, target_duration: int, part_target: float, window_size: int | None = None, has_video: bool = True, has_audio: bool = True, max_chunk_duration: float | None = None, predict_video_duration: bool = False, write_window: float = 0, gzip_level: int = 6, spool_directory: str | None = None, memory_segments: int = 8, window_bytes: int | None = None, window_seconds: float | None = None):
+    super().__init__(target_duration, part_target, 'video/mp4', window_size, True, has_video, has_audio, write_window, gzip_level, spool_directory, memory_segments, window_bytes, window_seconds)
+    # Fragment (samples are coalesced until partial boundary or max_chunk_duration)
+    self.fragment = FragmentBuilder(self.m3u8.push)
+    self.max_chunk_duration = max_chunk_duration
     # M3U8 Tracks
     self.audio_track: bytes | None = None
     self.video_track: bytes | None = None
     # Video Codec Specific
+    self.video_configuration = VideoConfigurationCache(1, ts.HZ)
+    self.video_configuration_applied: VideoConfiguration | None = None
     self.h264_idr_detected = False
     self.h265_idr_detected = False
-    self.curr_h264: tuple[bool, bytearray, int, int, datetime] | None = None # hasIDR, mdat, timestamp, cts, program_date_time
-    self.curr_h265: tuple[bool, bytearray, int, int, datetime] | None = None # hasIDR, mdat, timestamp, cts, program_date_time
+    self.curr_h264: tuple[bool, list[bytes | memoryview], int, int, datetime, VideoConfiguration | None] | None = None # hasIDR, mdat, timestamp, cts, program_date_time, configuration
+    self.curr_h265: tuple[bool, list[bytes | memoryview], int, int, datetime, VideoConfiguration | None] | None = None # hasIDR, mdat, timestamp, cts, program_date_time, configuration
+    # Emit access unit without waiting next one, sample duration is predicted from VUI or running median
+    self.predict_video_duration = predict_video_duration
+    self.last_video_timestamp: int | None = None
+    self.video_deltas: deque[int] = deque(maxlen=PREDICTION_WINDOW)
     # Audio Codec Specific
     self.last_aac_timestamp = None
 
+  def flush(self) -> None:
+    self.fragment.flush()
+
+  def __chunk(self) -> None:
+    if self.max_chunk_duration is None: return
+    if self.fragment.duration() < self.max_chunk_duration * ts.HZ: return
+    self.fragment.flush()
+
+  def __initialization_section(self, video_track: bytes | None) -> bytes | None:
+    if self.has_video and video_track is None: return None
+    if self.has_audio and self.audio_track is None: return None
+    return b''.join([
+      ftyp(),
+      moov(
+        mvhd(ts.HZ),
+        mvex(
+          ([trex(1)] if self.has_video else []) +
+          ([trex(2)] if self.has_audio else [])
+        ),
+        b''.join(
+          ([cast(bytes, video_track)] if self.has_video else []) +
+          ([cast(bytes, self.audio_track)] if self.has_audio else [])
+        )
+      )
+    ])
+
+  def __video_changed(self):
+    # parameter sets changed (or first detected) on latest access unit
+    configuration = cast(VideoConfiguration, self.video_configuration.current)
+    self.video_track = configuration.track
+    if not self.video_codec.done():
+      self.video_codec.set_result(configuration.codec)
+
+  def __predicted_video_duration(self, timestamp: int) -> int | None:
+    if self.last_video_timestamp is not None and timestamp > self.last_video_timestamp:
+      self.video_deltas.append(timestamp - self.last_video_timestamp)
+    self.last_video_timestamp = timestamp
+    median = sorted(self.video_deltas)[len(self.video_deltas) // 2] if self.video_deltas else None
+    configuration = self.video_configuration.current
+    vui = configuration.frame_duration(ts.HZ) if configuration is not None else None
+    # VUI timing is trusted while it agrees with observed deltas (e.g. field coded stream does not)
+    if vui is not None and (median is None or abs(vui - median) * 2 < median): return vui
+    return median
+
+  def __video_emit(self, access_unit: tuple[bool, list[bytes | memoryview], int, int, datetime, VideoConfiguration | None], duration: int) -> None:
+    hasIDR, content, timestamp, cto, program_date_time, configuration = access_unit
+    self.__video_apply(configuration)
+    self.update(hasIDR, timestamp, program_date_time)
+    self.fragment.add(1, timestamp, duration, content, hasIDR, cto)
+    self.__chunk()
+
+  def __video_apply(self, configuration: VideoConfiguration | None):
+    # called with configuration of access unit being emitted, new initialization section from its segment
+    if configuration is None or configuration is self.video_configuration_applied: return
+    changed = self.video_configuration_applied is not None
+    self.video_configuration_applied = configuration
+    if not changed: return
+    if (init := self.__initialization_section(configuration.track)) is None: return
+    self.reinitialize(init)
+
   def h265(self, h265: H265PES):
     if (dts := h265.dts() or h265.pts()) is None: return
     if (pts := h265.pts()) is None: return
@@ -53,7 +124,7 @@ class Fmp4VariantHandler(VariantHandler):
     if (program_date_time := self.program_date_time(dts)) is None: return
 
     hasIDR = False
-    content = bytearray()
+    content: list[bytes | memoryview] = [] # length prefixed NAL units, not copied until written
     vps, sps, pps = None, None, None
     for ebsp in h265:
       nal_unit_type = (ebsp[0] >> 1) & 0x3f
@@ -68,69 +139,30 @@ class Fmp4VariantHandler(VariantHandler):
         pass
       elif nal_unit_type == 19 or nal_unit_type == 20 or nal_unit_type == 21: # IDR_W_RADL, IDR_W_LP, CRA_NUT
         hasIDR = True
-        content += len(ebsp).to_bytes(4, byteorder='big') + ebsp
+        content += (len(ebsp).to_bytes(4, byteorder='big'), ebsp)
       else:
-        content += len(ebsp).to_bytes(4, byteorder='big') + ebsp
-    if sps and not self.video_codec.done():
-      self.video_codec.set_result(hevc_codec_parameter_string(sps))
-    if vps and sps and pps:
-      self.video_track = hevcTrack(1, ts.HZ, vps, sps, pps)
-
-    if self.init and not self.init.done() and self.video_track:
-      if not self.has_audio:
-        self.init.set_result(b''.join([
-          ftyp(),
-          moov(
-            mvhd(ts.HZ),
-            mvex([
-              trex(1),
-            ]),
-            b''.join([
-              self.video_track
-            ])
-          )
-        ]))
-      elif self.audio_track:
-        self.init.set_result(b''.join([
-          ftyp(),
-          moov(
-            mvhd(ts.HZ),
-            mvex([
-              trex(1),
-              trex(2),
-            ]),
-            b''.join([
-              self.video_track,
-              self.audio_track
-            ])
-          )
-        ]))
-
-    next_h265 = (hasIDR, content, timestamp, cto, program_date_time)
-
-    if not self.curr_h265:
-      self.curr_h265 = next_h265
-      return
+        content += (len(ebsp).to_bytes(4, byteorder='big'), ebsp)
+    if vps and sps and pps and self.video_configuration.hevc(vps, sps, pps):
+      self.__video_changed()
 
-    next_timestamp = timestamp
-    hasIDR, content, timestamp, cto, program_date_time = self.curr_h265
-    duration = next_timestamp - timestamp
-    self.curr_h265 = next_h265
+    if self.init and not self.init.done() and (init := self.__initialization_section(self.video_track)) is not None:
+      self.init.set_result(init)
 
-    self.h265_idr_detected|= hasIDR
-    if not self.h265_idr_detected: return
+    next_h265 = (hasIDR, content, timestamp, cto, program_date_time, self.video_configuration.current)
+    predicted = self.__predicted_video_duration(timestamp) if self.predict_video_duration else None
 
-    self.update(hasIDR, timestamp, program_date_time)
-    self.m3u8.push(
-      b''.join([
-        moof(0,
-          [
-            (1, duration, timestamp, 0, [(len(content), duration, hasIDR, cto)])
-          ]
-        ),
-        mdat(content)
-      ])
-    )
+    if self.curr_h265:
+      curr_h265, self.curr_h265 = self.curr_h265, None
+      self.h265_idr_detected|= curr_h265[0]
+      if self.h265_idr_detected: self.__video_emit(curr_h265, timestamp - curr_h265[2])
+
+    if predicted is None:
+      self.curr_h265 = next_h265 # held back until next access unit to know its duration
+      return
+
+    # emit immediately with predicted duration, next fragment's tfdt corrects drift
+    self.h265_idr_detected|= hasIDR
+    if self.h265_idr_detected: self.__video_emit(next_h265, predicted)
 
   def h264(self, h264: H264PES):
     if (dts := h264.dts() or h264.pts()) is None: return
@@ -140,7 +172,7 @@ class Fmp4VariantHandler(VariantHandler):
     if (program_date_time := self.program_date_time(dts)) is None: return
 
     hasIDR = False
-    content = bytearray()
+    content: list[bytes | memoryview] = [] # length prefixed NAL units, not copied until written
     sps, pps = None, None
     for ebsp in h264:
       nal_unit_type = ebsp[0] & 0x1f
@@ -153,70 +185,31 @@ class Fmp4VariantHandler(VariantHandler):
         pass
       elif nal_unit_type == 0x05:
         hasIDR = True
-        content += len(ebsp).to_bytes(4, byteorder='big') + ebsp
+        content += (len(ebsp).to_bytes(4, byteorder='big'), ebsp)
       else:
-        content += len(ebsp).to_bytes(4, byteorder='big') + ebsp
-
-    if sps and not self.video_codec.done():
-      self.video_codec.set_result(avc_codec_parameter_string(sps))
-    if sps and pps:
-      self.video_track = avcTrack(1, ts.HZ, sps, pps)
-
-    if self.init and not self.init.done() and self.video_track:
-      if not self.has_audio:
-        self.init.set_result(b''.join([
-          ftyp(),
-          moov(
-            mvhd(ts.HZ),
-            mvex([
-              trex(1),
-            ]),
-            b''.join([
-              self.video_track
-            ])
-          )
-        ]))
-      elif self.audio_track:
-        self.init.set_result(b''.join([
-          ftyp(),
-          moov(
-            mvhd(ts.HZ),
-            mvex([
-              trex(1),
-              trex(2),
-            ]),
-            b''.join([
-              self.video_track,
-              self.audio_track
-            ])
-          )
-        ]))
-
-    next_h264 = (hasIDR, content, timestamp, cto, program_date_time)
-
-    if not self.curr_h264:
-      self.curr_h264 = next_h264
-      return
+        content += (len(ebsp).to_bytes(4, byteorder='big'), ebsp)
 
-    next_timestamp = timestamp
-    hasIDR, content, timestamp, cto, program_date_time = self.curr_h264
-    duration = next_timestamp - timestamp
-    self.curr_h264 = next_h264
+    if sps and pps and self.video_configuration.avc(sps, pps):
+      self.__video_changed()
 
-    self.h264_idr_detected|= hasIDR
-    if not self.h264_idr_detected: return
+    if self.init and not self.init.done() and (init := self.__initialization_section(self.video_track)) is not None:
+      self.init.set_result(init)
 
-    self.update(hasIDR, timestamp, program_date_time)
-    self.m3u8.push(
-      b''.join([
-        moof(0,
-          [
-            (1, duration, timestamp, 0, [(len(content), duration, hasIDR, cto)])
-          ]
-        ),
-        mdat(content)
-      ])
-    )
+    next_h264 = (hasIDR, content, timestamp, cto, program_date_time, self.video_configuration.current)
+    predicted = self.__predicted_video_duration(timestamp) if self.predict_video_duration else None
+
+    if self.curr_h264:
+      curr_h264, self.curr_h264 = self.curr_h264, None
+      self.h264_idr_detected|= curr_h264[0]
+      if self.h264_idr_detected: self.__video_emit(curr_h264, timestamp - curr_h264[2])
+
+    if predicted is None:
+      self.curr_h264 = next_h264 # held back until next access unit to know its duration
+      return
+
+    # emit immediately with predicted duration, next fragment's tfdt corrects drift
+    self.h264_idr_detected|= hasIDR
+    if self.h264_idr_detected: self.__video_emit(next_h264, predicted)
 
   def aac(self, aac: PES):
     if (timestamp := self.timestamp(aac.pts())) is None: return
@@ -242,34 +235,14 @@ class Fmp4VariantHandler(VariantHandler):
         ])
         self.audio_track = mp4aTrack(2, ts.HZ, config, channelConfiguration, AAC_SAMPLING_FREQUENCY[samplingFrequencyIndex])
 
-      if self.init and not self.init.done() and self.audio_track:
-        if not self.has_video:
-          self.init.set_result(b''.join([
-            ftyp(),
-            moov(
-              mvhd(ts.HZ),
-              mvex([
-                trex(2)
-              ]),
-              b''.join([
-                self.audio_track
-              ])
-            )
-          ]))
+      if self.init and not self.init.done() and not self.has_video and (init := self.__initialization_section(None)) is not None:
+        self.init.set_result(init)
 
       if not self.has_video:
         self.update(None, timestamp, program_date_time)
 
-      self.m3u8.push(
-        b''.join([
-          moof(0,
-            [
-              (2, duration, timestamp, 0, [(frameLength - (9 if protection else 7), duration, False, 0)])
-            ]
-          ),
-          mdat(bytes(ADTS_AAC[begin + (9 if protection else 7): begin + frameLength]))
-        ])
-      )
+      self.fragment.add(2, timestamp, duration, ADTS_AAC[begin + (9 if protection else 7): begin + frameLength])
+      self.__chunk()
 
       timestamp += duration
       program_date_time += timedelta(seconds=duration/ts.HZ)
@@ -1,26 +1,53 @@
 import asyncio
+import gzip
+import time
 from aiohttp import web
 
 from abc import ABC
-from typing import cast
-from collections import deque
+from typing import AsyncIterator, cast
+from collections import deque, OrderedDict
 from datetime import datetime, timezone, timedelta
 
 from biim.hls.m3u8 import M3U8
+from biim.hls.storage import SegmentStorage
 from biim.mpeg2ts import ts
 from biim.mpeg2ts.scte import SpliceInfoSection, SpliceInsert, TimeSignal, SegmentationDescriptor
 
+MAX_GZIP_MANIFESTS = 4 # latest versions with and without skip
+GZIP_MIN_SIZE = 1024
+
+def accepts_gzip(request: web.Request) -> bool:
+  # explicit gzip overrides *, q=0 means not acceptable
+  accepted: dict[str, bool] = dict()
+  for coding in request.headers.get('Accept-Encoding', '').split(','):
+    name, *params = coding.split(';')
+    name = name.strip().lower()
+    if name not in ('gzip', '*'): continue
+    quality = 1.0
+    for param in params:
+      key, _, value = param.partition('=')
+      if key.strip().lower() != 'q': continue
+      try:
+        quality = float(value)
+      except ValueError:
+        quality = 0
+    accepted[name] = quality > 0
+  return accepted.get('gzip', accepted.get('*', False))
+
 class VariantHandler(ABC):
 
-  def __init__(self, target_duration: int, part_target: float, content_type: str, window_size: int | None = None, has_init: bool = False, has_video: bool = True, has_audio: bool = True):
+  def __init__(self, target_duration: int, part_target: float, content_type: str, window_size: int | None = None, has_init: bool = False, has_video: bool = True, has_audio: bool = True, write_window: float = 0, gzip_level: int = 6, spool_directory: str | None = None, memory_segments: int = 8, window_bytes: int | None = None, window_seconds: float | None = None):
     self.target_duration = target_duration
     self.part_target = part_target
     self.segment_timestamp: int | None = None
     self.part_timestamp: int | None = None
 
-    # M3U8
-    self.m3u8 = M3U8(target_duration=target_duration, part_target=part_target, window_size=window_size, has_init=has_init)
+    # M3U8 (completed segments are spilled to spool_directory, memory_segments of them are kept in memory)
+    self.storage = SegmentStorage(spool_directory, memory_segments) if spool_directory is not None else None
+    self.m3u8 = M3U8(target_duration=target_duration, part_target=part_target, window_size=window_size, window_bytes=window_bytes, window_seconds=window_seconds, has_init=has_init, storage=self.storage, init_released=self.__release_init)
     self.init = asyncio.Future[bytes | bytearray | memoryview]() if has_init else None
+    self.init_version: int = 0
+    self.inits: dict[str, bytes | bytearray | memoryview] = dict() # URI -> initialization section after configuration changed, kept while segments refer it
     self.content_type = content_type
     self.has_video = has_video
     self.has_audio = has_audio
@@ -35,6 +62,52 @@ class VariantHandler(ABC):
     self.scte35_in_queue: deque[tuple[str, datetime]] = deque()
     # Bitrate
     self.bitrate = asyncio.Future[int]()
+    # Response (chunks pushed within write_window seconds are coalesced into one write)
+    self.write_window = write_window
+    self.response_writes: int = 0
+    self.response_bytes: int = 0
+    # Playlist compression (each manifest is compressed once and shared, 0 disables)
+    self.gzip_level = gzip_level
+    self.gzip_manifests: OrderedDict[bytes, bytes] = OrderedDict()
+    self.gzip_input_bytes: int = 0
+    self.gzip_output_bytes: int = 0
+    self.gzip_seconds: float = 0
+    self.gzip_hits: int = 0
+
+  def gzip_ratio(self) -> float:
+    return self.gzip_output_bytes / self.gzip_input_bytes if self.gzip_input_bytes > 0 else 0
+
+  def __gzip(self, manifest: bytes) -> bytes:
+    # manifest of same version is same bytes object, so lookup is by identity in practice
+    if (compressed := self.gzip_manifests.get(manifest)) is not None:
+      self.gzip_hits += 1
+      return compressed
+    begin = time.process_time()
+    compressed = gzip.compress(manifest, compresslevel=self.gzip_level, mtime=0)
+    self.gzip_seconds += time.process_time() - begin
+    self.gzip_input_bytes += len(manifest)
+    self.gzip_output_bytes += len(compressed)
+    self.gzip_manifests[manifest] = compressed
+    while len(self.gzip_manifests) > MAX_GZIP_MANIFESTS: self.gzip_manifests.popitem(last=False)
+    return compressed
+
+  def __manifest(self, request: web.Request, manifest: bytes, cache_control: str) -> web.Response:
+    if self.gzip_level <= 0:
+      return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': cache_control}, body=manifest, content_type="application/x-mpegURL", charset='utf-8')
+    if len(manifest) < GZIP_MIN_SIZE or not accepts_gzip(request):
+      return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}, body=manifest, content_type="application/x-mpegURL", charset='utf-8')
+    return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding', 'Content-Encoding': 'gzip'}, body=self.__gzip(manifest), content_type="application/x-mpegURL", charset='utf-8')
+
+  def bytes_per_write(self) -> float:
+    return self.response_bytes / self.response_writes if self.response_writes > 0 else 0
+
+  async def __write(self, response: web.StreamResponse, stream: AsyncIterator[list[bytes | bytearray | memoryview]]) -> None:
+    async for chunks in stream:
+      # aiohttp has no public writelines, so single write of joined buffer
+      data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+      self.response_writes += 1
+      self.response_bytes += len(data)
+      await response.write(data)
 
   async def playlist(self, request: web.Request) -> web.Response:
     msn = request.query['_HLS_msn'] if '_HLS_msn' in request.query else None
@@ -47,7 +120,7 @@ class VariantHandler(ABC):
         return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type="application/x-mpegURL")
 
       result = await future
-      return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, text=result, content_type="application/x-mpegURL")
+      return self.__manifest(request, result, 'max-age=0')
     else:
       if msn is None:
         return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type="application/x-mpegURL")
@@ -59,7 +132,7 @@ class VariantHandler(ABC):
         return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type="application/x-mpegURL")
 
       result = await future
-      return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=36000'}, text=result, content_type="application/x-mpegURL")
+      return self.__manifest(request, result, 'max-age=36000')
 
   async def segment(self, request: web.Request) -> web.Response | web.StreamResponse:
     msn = request.query['msn'] if 'msn' in request.query else None
@@ -67,17 +140,16 @@ class VariantHandler(ABC):
     if msn is None:
       return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
     msn = int(msn)
-    queue = await self.m3u8.segment(msn)
-    if queue is None:
+    if (path := self.m3u8.spilled(msn)) is not None:
+      return web.FileResponse(path, headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=36000', 'Content-Type': self.content_type})
+    stream = await self.m3u8.segment(msn, self.write_window)
+    if stream is None:
       return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
 
     response = web.StreamResponse(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=36000', 'Content-Type': self.content_type}, status=200)
     await response.prepare(request)
 
-    while True:
-      stream = await queue.get()
-      if stream == None : break
-      await response.write(stream)
+    await self.__write(response, stream)
 
     await response.write_eof()
     return response
@@ -92,31 +164,52 @@ class VariantHandler(ABC):
     if part is None:
       return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
     part = int(part)
-    queue = await self.m3u8.partial(msn, part)
-    if queue is None:
+    stream = await self.m3u8.partial(msn, part, self.write_window)
+    if stream is None:
       return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
 
     response = web.StreamResponse(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=36000', 'Content-Type': self.content_type}, status=200)
     await response.prepare(request)
 
-    while True:
-      stream = await queue.get()
-      if stream == None : break
-      await response.write(stream)
+    await self.__write(response, stream)
 
     await response.write_eof()
     return response
 
-  async def initialization(self, _: web.Request) -> web.Response:
+  async def initialization(self, request: web.Request) -> web.Response:
     if self.init is None:
       return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
 
+    version = request.query['v'] if 'v' in request.query else None
+    if version is not None:
+      if not version.isdigit() or (init := self.inits.get(f'init?v={int(version)}')) is None:
+        return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
+      return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=36000'}, body=init, content_type=self.content_type)
+
     body = await asyncio.shield(self.init)
     return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=36000'}, body=body, content_type=self.content_type)
 
+  async def seek(self, request: web.Request) -> web.Response:
+    # for time-shift clients, redirects to segment which contains pdt (ISO 8601) or offset (seconds from beginning of playlist)
+    try:
+      if 'pdt' in request.query:
+        msn = self.m3u8.seek_program_date_time(datetime.fromisoformat(request.query['pdt']))
+      elif 'offset' in request.query:
+        msn = self.m3u8.seek(timedelta(seconds=float(request.query['offset'])))
+      else:
+        msn = None
+    except (ValueError, OverflowError):
+      msn = None
+    if msn is None:
+      return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0'}, status=400, content_type=self.content_type)
+    return web.Response(headers={'Access-Control-Allow-Origin': '*', 'Cache-Control': 'max-age=0', 'Location': f'segment?msn={msn}'}, status=302)
+
   async def bandwidth(self) -> int:
     return await self.m3u8.bandwidth()
 
+  def buffered_bytes(self) -> int:
+    return self.m3u8.buffered()
+
   async def codec(self) -> str:
     if self.has_video and self.has_audio:
       return f'{await self.video_codec},{await self.audio_codec}'
@@ -130,6 +223,17 @@ class VariantHandler(ABC):
   def set_renditions(self, renditions: list[str]):
     self.m3u8.set_renditions(renditions)
 
+  def reinitialize(self, init: bytes | bytearray | memoryview) -> None:
+    # configuration changed, serve new initialization section from next segment
+    self.init_version += 1
+    uri = f'init?v={self.init_version}'
+    self.inits[uri] = init
+    self.m3u8.changeInit(uri)
+
+  def __release_init(self, uri: str) -> None:
+    # last segment referring it is dropped from playlist
+    self.inits.pop(uri, None)
+
   def program_date_time(self, pts: int | None) -> datetime | None:
     if self.latest_pcr_value is None or self.latest_pcr_datetime is None or pts is None: return None
     return self.latest_pcr_datetime + timedelta(seconds=(((pts - self.latest_pcr_value + ts.PCR_CYCLE) % ts.PCR_CYCLE) / ts.HZ))
@@ -157,18 +261,25 @@ class VariantHandler(ABC):
         part_diff = timestamp - self.part_timestamp
         if self.part_target * ts.HZ < part_diff:
           self.part_timestamp = int(timestamp - max(0, part_diff - self.part_target * ts.HZ))
+          self.flush()
           self.m3u8.continuousPartial(self.part_timestamp, False)
       self.part_timestamp = timestamp
       self.segment_timestamp = timestamp
+      self.flush()
       self.m3u8.continuousSegment(self.part_timestamp, True, program_date_time)
       return True
     elif self.part_timestamp is not None:
       part_diff = timestamp - self.part_timestamp
       if self.part_target * ts.HZ <= part_diff:
         self.part_timestamp = int(timestamp - max(0, part_diff - self.part_target * ts.HZ))
+        self.flush()
         self.m3u8.continuousPartial(self.part_timestamp)
     return False
 
+  def flush(self) -> None:
+    # called before partial/segment boundary, push media pending in handler
+    pass
+
   def pcr(self, pcr: int):
     pcr = (pcr - ts.HZ + ts.PCR_CYCLE) % ts.PCR_CYCLE
     diff = ((pcr - self.latest_pcr_value + ts.PCR_CYCLE) % ts.PCR_CYCLE) if self.latest_pcr_value is not None else 0
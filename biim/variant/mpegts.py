@@ -6,7 +6,7 @@ from biim.variant.codec import avc_codec_parameter_string
 from biim.variant.codec import hevc_codec_parameter_string
 
 from biim.mpeg2ts import ts
-from biim.mpeg2ts.packetize import packetize_section, packetize_pes
+from biim.mpeg2ts.packetize import packetize_pes_buffer, PacketizedSection
 from biim.mpeg2ts.section import Section
 from biim.mpeg2ts.pes import PES
 from biim.mpeg2ts.h264 import H264PES
@@ -30,14 +30,19 @@ AAC_SAMPLING_FREQUENCY = {
 
 class MpegtsVariantHandler(VariantHandler):
 
-  def __init__(self, target_duration: int, part_target: float, window_size: int | None = None, has_video: bool = True, has_audio: bool = True):
-    super().__init__(target_duration, part_target, 'video/mp2t', window_size, False, has_video, has_audio)
+  def __init__(self, target_duration: int, part_target: float, window_size: int | None = None, has_video: bool = True, has_audio: bool = True, passthrough: bool = False, write_window: float = 0, gzip_level: int = 6, spool_directory: str | None = None, memory_segments: int = 8, window_bytes: int | None = None, window_seconds: float | None = None):
+    super().__init__(target_duration, part_target, 'video/mp2t', window_size, False, has_video, has_audio, write_window, gzip_level, spool_directory, memory_segments, window_bytes, window_seconds)
+    # Pass-through (push original TS packets of PES when parser kept them, instead of repacketize)
+    self.passthrough = passthrough
+    self.passthrough_cc: dict[int, int] = dict()
     # PAT/PMT
     self.last_pat: Section | None = None
     self.last_pmt: Section | None = None
     self.pmt_pid: int | None = None
     self.pat_cc = 0
     self.pmt_cc = 0
+    self.pat_packets: PacketizedSection | None = None
+    self.pmt_packets: PacketizedSection | None = None
     # Video Codec Specific
     self.h264_idr_detected = False
     self.h265_idr_detected = False
@@ -59,27 +64,22 @@ class MpegtsVariantHandler(VariantHandler):
     if self.last_pat is None or self.last_pmt is None or self.pmt_pid is None: return False
     if not super().update(new_segment, timestamp, program_date_time): return False
 
-    packets = packetize_section(self.last_pat, False, False, 0x00, 0, self.pat_cc)
-    self.pat_cc = (self.pat_cc + len(packets)) & 0x0F
-    for p in packets: self.m3u8.push(p)
-    packets = packetize_section(self.last_pmt, False, False, self.pmt_pid, 0, self.pmt_cc)
-    self.pmt_cc = (self.pmt_cc + len(packets)) & 0x0F
-    for p in packets: self.m3u8.push(p)
+    if self.pat_packets is None or self.pat_packets.section is not self.last_pat:
+      self.pat_packets = PacketizedSection(self.last_pat, False, False, 0x00, 0)
+    buffer, self.pat_cc = self.pat_packets.packetize(self.pat_cc)
+    self.m3u8.push(buffer)
+    if self.pmt_packets is None or self.pmt_packets.section is not self.last_pmt or self.pmt_packets.pid != self.pmt_pid:
+      self.pmt_packets = PacketizedSection(self.last_pmt, False, False, self.pmt_pid, 0)
+    buffer, self.pmt_cc = self.pmt_packets.packetize(self.pmt_cc)
+    self.m3u8.push(buffer)
     return True
 
   def h265(self, pid: int, h265: H265PES):
     if (timestamp := self.timestamp(h265.dts() or h265.pts())) is None: return
     if (program_date_time := self.program_date_time(h265.dts() or h265.pts())) is None: return
 
-    hasIDR = False
-    sps = None
-    for ebsp in h265:
-      nal_unit_type = (ebsp[0] >> 1) & 0x3f
-
-      if nal_unit_type == 0x21: # SPS
-        sps = ebsp
-      elif nal_unit_type == 19 or nal_unit_type == 20 or nal_unit_type == 21: # IDR_W_RADL, IDR_W_LP, CRA_NUT
-        hasIDR = True
+    hasIDR = h265.has_idr()
+    _, sps, _ = h265.parameter_sets()
 
     if sps and not self.video_codec.done():
       self.video_codec.set_result(hevc_codec_parameter_string(sps))
@@ -89,23 +89,18 @@ class MpegtsVariantHandler(VariantHandler):
 
     self.update(hasIDR, timestamp, program_date_time)
 
-    packets = packetize_pes(h265, False, False, pid, 0, self.h265_cc)
-    self.h265_cc = (self.h265_cc + len(packets)) & 0x0F
-    for p in packets: self.m3u8.push(p)
+    if self.passthrough and h265.packets is not None:
+      self.__passthrough(pid, h265.packets)
+    else:
+      buffer, self.h265_cc = packetize_pes_buffer(h265, False, False, pid, 0, self.h265_cc)
+      self.m3u8.push(buffer)
 
   def h264(self, pid: int, h264: H264PES):
     if (timestamp := self.timestamp(h264.dts() or h264.pts())) is None: return
     if (program_date_time := self.program_date_time(h264.dts() or h264.pts())) is None: return
 
-    hasIDR = False
-    sps = None
-    for ebsp in h264:
-      nal_unit_type = ebsp[0] & 0x1f
-
-      if nal_unit_type == 0x07: # SPS
-        sps = ebsp
-      elif nal_unit_type == 0x05:
-        hasIDR = True
+    hasIDR = h264.has_idr()
+    sps, _ = h264.parameter_sets()
 
     if sps and not self.video_codec.done():
       self.video_codec.set_result(avc_codec_parameter_string(sps))
@@ -114,9 +109,11 @@ class MpegtsVariantHandler(VariantHandler):
 
     self.update(hasIDR, timestamp, program_date_time)
 
-    packets = packetize_pes(h264, False, False, pid, 0, self.h264_cc)
-    self.h264_cc = (self.h264_cc + len(packets)) & 0x0F
-    for p in packets: self.m3u8.push(p)
+    if self.passthrough and h264.packets is not None:
+      self.__passthrough(pid, h264.packets)
+    else:
+      buffer, self.h264_cc = packetize_pes_buffer(h264, False, False, pid, 0, self.h264_cc)
+      self.m3u8.push(buffer)
 
   def aac(self, pid: int, aac: PES):
     if (timestamp := self.timestamp(aac.pts())) is None: return
@@ -125,9 +122,11 @@ class MpegtsVariantHandler(VariantHandler):
     if not self.has_video:
       self.update(None, timestamp, program_date_time)
 
-    packets = packetize_pes(aac, False, False, pid, 0, self.aac_cc)
-    self.aac_cc = (self.aac_cc + len(packets)) & 0x0F
-    for p in packets: self.m3u8.push(p)
+    if self.passthrough and aac.packets is not None:
+      self.__passthrough(pid, aac.packets)
+    else:
+      buffer, self.aac_cc = packetize_pes_buffer(aac, False, False, pid, 0, self.aac_cc)
+      self.m3u8.push(buffer)
 
     begin, ADTS_AAC = 0, aac.PES_packet_data()
     length = len(ADTS_AAC)
@@ -146,5 +145,18 @@ class MpegtsVariantHandler(VariantHandler):
       program_date_time += timedelta(seconds=duration/ts.HZ)
       begin += frameLength
 
+  def __passthrough(self, pid: int, packets: list[bytes | bytearray | memoryview]):
+    cc = self.passthrough_cc.get(pid)
+    for packet in packets:
+      has_payload = (packet[3] & 0x10) != 0
+      if cc is None: cc = (packet[3] + (0 if has_payload else 1)) & 0x0F
+      expected = cc if has_payload else (cc - 1) & 0x0F
+      if (packet[3] & 0x0F) != expected: # rewrite continuity_counter only when it would be discontinuous
+        packet = bytearray(packet)
+        packet[3] = (packet[3] & 0xF0) | expected
+      self.m3u8.push(packet)
+      if has_payload: cc = (cc + 1) & 0x0F
+    if cc is not None: self.passthrough_cc[pid] = cc
+
   def packet(self, packet: bytes | bytearray | memoryview):
     self.m3u8.push(packet)
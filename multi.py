@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from typing import cast, Callable, Any
+from typing import cast
 
 import asyncio
 from aiohttp import web
@@ -10,17 +10,18 @@ import sys
 import os
 
 from biim.mpeg2ts import ts
-from biim.mpeg2ts.pat import PATSection
 from biim.mpeg2ts.pmt import PMTSection
 from biim.mpeg2ts.scte import SpliceInfoSection
 from biim.mpeg2ts.pes import PES
 from biim.mpeg2ts.h264 import H264PES
 from biim.mpeg2ts.h265 import H265PES
 from biim.mpeg2ts.parser import SectionParser, PESParser
+from biim.mpeg2ts.demuxer import MpegtsDemuxer
 
+from biim.hls.m3u8 import enforce_memory_budget
 from biim.variant.fmp4 import Fmp4VariantHandler
 
-from biim.util.reader import BufferingAsyncReader
+from biim.util.reader import BufferingAsyncReader, PacketAlignedAsyncReader
 
 async def setup(port: int, prefix: str = '', all_handlers: list[tuple[int, Fmp4VariantHandler]] = [], all_video_handlers: list[tuple[int, Fmp4VariantHandler]] = [], all_audio_handler: list[tuple[int, Fmp4VariantHandler]] = []):
   # setup aiohttp
@@ -51,6 +52,7 @@ async def setup(port: int, prefix: str = '', all_handlers: list[tuple[int, Fmp4V
           web.get(f'{prefix}/{pid}/playlist.m3u8', handler.playlist),
           web.get(f'{prefix}/{pid}/segment', handler.segment),
           web.get(f'{prefix}/{pid}/part', handler.partial),
+          web.get(f'{prefix}/{pid}/seek', handler.seek),
           web.get(f'{prefix}/{pid}/init', handler.initialization),
         ] for pid, handler in all_handlers
       ],
@@ -67,121 +69,83 @@ async def main():
   parser.add_argument('-i', '--input', type=argparse.FileType('rb'), nargs='?', default=sys.stdin.buffer)
   parser.add_argument('-s', '--SID', type=int, nargs='?')
   parser.add_argument('-w', '--window_size', type=int, nargs='?')
+  parser.add_argument('--window_bytes', type=int, nargs='?') # live window (and outdated segments) by total bytes
+  parser.add_argument('--window_seconds', type=float, nargs='?') # live window (and outdated segments) by duration
   parser.add_argument('-t', '--target_duration', type=int, nargs='?', default=1)
   parser.add_argument('-p', '--part_duration', type=float, nargs='?', default=0.1)
+  parser.add_argument('--chunk_duration', type=float, nargs='?') # max duration of coalesced fragment, flushed at part boundary when omitted
+  parser.add_argument('--predict_video_duration', action=argparse.BooleanOptionalAction, default=False) # emit video without waiting next access unit
+  parser.add_argument('--write_window', type=float, nargs='?', default=0) # seconds to wait for more chunks before writing response, 0 writes what is available at once
+  parser.add_argument('--gzip_level', type=int, nargs='?', default=6) # compression level of playlist for clients accepting gzip, 0 disables
+  parser.add_argument('--spool_directory', type=str, nargs='?') # spill completed segments to disk under this directory
+  parser.add_argument('--memory_segments', type=int, nargs='?', default=8) # completed segments kept in memory when spilling
+  parser.add_argument('--memory_budget', type=int, nargs='?') # buffered bytes across all variants, oldest segments are evicted first (released to spool when given)
   parser.add_argument('--port', type=int, nargs='?', default=8080)
 
   args = parser.parse_args()
+  if args.memory_budget is not None and args.spool_directory is None and args.window_size is None and args.window_bytes is None and args.window_seconds is None:
+    parser.error('--memory_budget needs --spool_directory for EVENT playlist (no window), its segments are never dropped')
   loop = asyncio.get_running_loop()
 
-  PMT_VERSION = None
-  PMT_PID: int | None = None
-  PCR_PID: int | None = None
-
-  PAT_Parser: SectionParser[PATSection] = SectionParser(PATSection)
-  PMT_Parser: SectionParser[PMTSection] = SectionParser(PMTSection)
-
-  cb: dict[int, tuple[PESParser | SectionParser, Callable[[Any], Any]]] = dict()
-
   ALL_HANDLER: list[tuple[int, Fmp4VariantHandler]] = []
   ALL_VIDEO_HANDLER: list[tuple[int, Fmp4VariantHandler]] = []
   ALL_AUDIO_HANDLER: list[tuple[int, Fmp4VariantHandler]] = []
+  HANDLERS: dict[int, tuple[Fmp4VariantHandler, bool]] = dict() # elementary_PID -> (handler, is_video)
+  SETUP_PENDING = False
   def ID3_CALLBACK(ID3: PES):
     for _, handler in ALL_VIDEO_HANDLER: handler.id3(ID3)
   def SCTE35_CALLBACK(SCTE35: SpliceInfoSection):
     if SCTE35.CRC32() != 0: return
     for _, handler in ALL_HANDLER: handler.scte35(SCTE35)
+  def PCR_CALLBACK(pcr: int):
+    for _, handler in ALL_HANDLER: handler.pcr(pcr)
+
+  # handlers are created while demuxer rebuilding dispatch table, then swapped on PMT callback
+  # streams unchanged by PMT update keep their parser in demuxer, and so their handler
+  def VARIANT(elementary_PID: int, is_video: bool) -> Fmp4VariantHandler:
+    handler = Fmp4VariantHandler(target_duration=args.target_duration, part_target=args.part_duration, window_size=args.window_size, has_video=is_video, has_audio=not is_video, max_chunk_duration=args.chunk_duration, predict_video_duration=args.predict_video_duration, write_window=args.write_window, gzip_level=args.gzip_level, spool_directory=args.spool_directory, memory_segments=args.memory_segments, window_bytes=args.window_bytes, window_seconds=args.window_seconds)
+    HANDLERS[elementary_PID] = (handler, is_video)
+    return handler
+  def PMT_CALLBACK(PMT_PID: int, PMT: PMTSection):
+    nonlocal ALL_HANDLER, ALL_VIDEO_HANDLER, ALL_AUDIO_HANDLER, SETUP_PENDING
+    for elementary_PID, (handler, _) in list(HANDLERS.items()):
+      entry = demuxer.table.get(elementary_PID)
+      if entry is None or getattr(entry[1], '__self__', None) is not handler: del HANDLERS[elementary_PID] # removed or replaced
+    ALL_HANDLER, ALL_VIDEO_HANDLER, ALL_AUDIO_HANDLER = [], [], []
+    for _, elementary_PID, _ in PMT:
+      if elementary_PID not in HANDLERS: continue
+      handler, is_video = HANDLERS[elementary_PID]
+      ALL_HANDLER.append((elementary_PID, handler))
+      (ALL_VIDEO_HANDLER if is_video else ALL_AUDIO_HANDLER).append((elementary_PID, handler))
+
+    for _, handler in ALL_VIDEO_HANDLER:
+      handler.set_renditions([f'../{pid}/playlist.m3u8' for pid, r in ALL_VIDEO_HANDLER if r != handler])
+    for _, handler in ALL_AUDIO_HANDLER:
+      handler.set_renditions([f'../{pid}/playlist.m3u8' for pid, r in ALL_AUDIO_HANDLER if r != handler])
+    SETUP_PENDING = True
+
+  demuxer = MpegtsDemuxer(args.SID, PMT=PMT_CALLBACK, PCR=PCR_CALLBACK)
+  demuxer.register(0x1b, lambda PID: (PESParser[H264PES](H264PES), VARIANT(PID, True).h264))
+  demuxer.register(0x24, lambda PID: (PESParser[H265PES](H265PES), VARIANT(PID, True).h265))
+  demuxer.register(0x0F, lambda PID: (PESParser[PES](PES), VARIANT(PID, False).aac))
+  demuxer.register(0x15, lambda PID: (PESParser[PES](PES), ID3_CALLBACK))
+  demuxer.register(0x86, lambda PID: (SectionParser[SpliceInfoSection](SpliceInfoSection), SCTE35_CALLBACK))
 
   # setup reader
   if args.input is not sys.stdin.buffer or os.name == 'nt':
-    reader = BufferingAsyncReader(args.input, ts.PACKET_SIZE * 16)
+    reader = BufferingAsyncReader(args.input, ts.PACKET_SIZE * 348)
   else:
     reader = asyncio.StreamReader()
     protocol = asyncio.StreamReaderProtocol(reader)
     await loop.connect_read_pipe(lambda: protocol, args.input)
 
-  while True:
-    isEOF = False
-    while True:
-      sync_byte = await reader.read(1)
-      if sync_byte == ts.SYNC_BYTE:
-        break
-      elif sync_byte == b'':
-        isEOF = True
-        break
-    if isEOF:
-      break
-
-    packet = None
-    try:
-      packet = ts.SYNC_BYTE + await reader.readexactly(ts.PACKET_SIZE - 1)
-    except asyncio.IncompleteReadError:
-      break
-
-    PID = ts.pid(packet)
-
-    if PID == 0x00:
-      PAT_Parser.push(packet)
-      for PAT in PAT_Parser:
-        if PAT.CRC32() != 0: continue
-
-        for program_number, program_map_PID in PAT:
-          if program_number == 0: continue
-
-          if program_number == args.SID:
-            PMT_PID = program_map_PID
-          elif not PMT_PID and not args.SID:
-            PMT_PID = program_map_PID
-
-    elif PID == PMT_PID:
-      PMT_Parser.push(packet)
-      for PMT in PMT_Parser:
-        if PMT.CRC32() != 0: continue
-        if PMT.version_number() == PMT_VERSION: continue
-        PMT_VERSION = PMT.version_number()
-
-        cb = dict()
-        ALL_HANDLER = []
-        ALL_VIDEO_HANDLER = []
-        ALL_AUDIO_HANDLER = []
-
-        PCR_PID = PMT.PCR_PID
-        for stream_type, elementary_PID, _ in PMT:
-          if stream_type == 0x1b:
-            handler = Fmp4VariantHandler(target_duration=args.target_duration, part_target=args.part_duration, window_size=args.window_size, has_video=True, has_audio=False)
-            ALL_HANDLER.append((elementary_PID, handler))
-            ALL_VIDEO_HANDLER.append((elementary_PID, handler))
-            cb[elementary_PID] = (PESParser[H264PES](H264PES), handler.h264)
-          elif stream_type == 0x24:
-            handler = Fmp4VariantHandler(target_duration=args.target_duration, part_target=args.part_duration, window_size=args.window_size, has_video=True, has_audio=False)
-            ALL_HANDLER.append((elementary_PID, handler))
-            ALL_VIDEO_HANDLER.append((elementary_PID, handler))
-            cb[elementary_PID] = (PESParser[H265PES](H265PES), handler.h265)
-          elif stream_type == 0x0F:
-            handler = Fmp4VariantHandler(target_duration=args.target_duration, part_target=args.part_duration, window_size=args.window_size, has_video=False, has_audio=True)
-            ALL_HANDLER.append((elementary_PID, handler))
-            ALL_AUDIO_HANDLER.append((elementary_PID, handler))
-            cb[elementary_PID] = (PESParser[PES](PES), handler.aac)
-          elif stream_type == 0x15:
-            cb[elementary_PID] = (PESParser[PES](PES), ID3_CALLBACK)
-          elif stream_type == 0x86:
-            cb[elementary_PID] = (SectionParser[SpliceInfoSection](SpliceInfoSection), SCTE35_CALLBACK)
-
-        for _, handler in ALL_VIDEO_HANDLER:
-          handler.set_renditions([f'../{pid}/playlist.m3u8' for pid, r in ALL_VIDEO_HANDLER if r != handler])
-        for _, handler in ALL_AUDIO_HANDLER:
-          handler.set_renditions([f'../{pid}/playlist.m3u8' for pid, r in ALL_AUDIO_HANDLER if r != handler])
-        await setup(args.port, '', ALL_HANDLER, ALL_VIDEO_HANDLER, ALL_AUDIO_HANDLER)
-
-    elif PID in cb:
-      cb[PID][0].push(packet)
-      for data in cb[PID][0]: cb[PID][1](data)
-
-    else:
-      pass
-
-    if PID == PCR_PID and ts.has_pcr(packet):
-      for _, handler in ALL_HANDLER: handler.pcr(cast(int, ts.pcr(packet)))
+  async for chunk in PacketAlignedAsyncReader(reader).chunks():
+    demuxer.push_chunk(chunk)
+    if args.memory_budget is not None: enforce_memory_budget([handler.m3u8 for _, handler in ALL_HANDLER], args.memory_budget)
+
+    if not SETUP_PENDING: continue
+    SETUP_PENDING = False
+    await setup(args.port, '', ALL_HANDLER, ALL_VIDEO_HANDLER, ALL_AUDIO_HANDLER)
 
 if __name__ == '__main__':
   asyncio.run(main())
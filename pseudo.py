@@ -11,13 +11,16 @@ from aiohttp_sse import sse_response
 import json
 import math
 from itertools import accumulate
+from functools import partial
 
 from biim.mpeg2ts import ts
-from biim.mpeg2ts.packetize import packetize_section, packetize_pes
+from biim.mpeg2ts.packetize import packetize_pes_buffer, PacketizedSection
 from biim.mpeg2ts.parser import SectionParser, PESParser
 from biim.mpeg2ts.pat import PATSection
 from biim.mpeg2ts.pmt import PMTSection
 from biim.mpeg2ts.pes import PES
+from biim.mpeg2ts.demuxer import MpegtsDemuxer
+from biim.util.reader import PacketAlignedAsyncReader
 
 import argparse
 import os
@@ -184,115 +187,71 @@ async def main():
     encoder = await asyncio.subprocess.create_subprocess_shell(" ".join(encoder_command), stdin=file, stdout=asyncio.subprocess.PIPE)
     reader = cast(asyncio.StreamReader, encoder.stdout)
 
-    PAT_Parser: SectionParser[PATSection] = SectionParser(PATSection)
-    PMT_Parser: SectionParser[PMTSection] = SectionParser(PMTSection)
-    Video_Praser: PESParser[PES] = PESParser(PES)
-    Audio_Praser: PESParser[PES] = PESParser(PES)
-    LATEST_PAT: PATSection | None = None
-    LATEST_PMT: PMTSection | None = None
+    LATEST_PAT: PacketizedSection | None = None
+    LATEST_PMT: PacketizedSection | None = None
     PAT_CC: int = 0
-    PMT_PID: int | None = None
     PMT_CC: int = 0
-    VIDEO_PID: int | None = None
     VIDEO_CC: int = 0
-    AUDIO_PID: int | None = None
     AUDIO_CC: int = 0
     candidate = bytearray()
 
-    while process_queue.empty():
-      if seq >= len(segments): break
-
-      isEOF = False
-      while True:
-        try:
-          sync_byte = await reader.readexactly(1)
-          if sync_byte == ts.SYNC_BYTE:
-            break
-          elif sync_byte == b'':
-            isEOF = True
-            break
-        except asyncio.IncompleteReadError:
-          isEOF = True
-          break
-      if isEOF:
-        break
-
-      packet = None
-      try:
-        packet = ts.SYNC_BYTE + await reader.readexactly(ts.PACKET_SIZE - 1)
-      except asyncio.IncompleteReadError:
-        break
-
-      PID = ts.pid(packet)
-      if PID == 0x00:
-        PAT_Parser.push(packet)
-        for PAT in PAT_Parser:
-          if PAT.CRC32() != 0: continue
-          LATEST_PAT = PAT
-
-          for program_number, program_map_PID in PAT:
-            if program_number == 0: continue
-            PMT_PID = program_map_PID
-
-          for packet in packetize_section(PAT, False, False, 0, 0, PAT_CC):
-            candidate += packet
-            PAT_CC = (PAT_CC + 1) & 0x0F
-
-      elif PID == PMT_PID:
-        PMT_Parser.push(packet)
-        for PMT in PMT_Parser:
-          if PMT.CRC32() != 0: continue
-          LATEST_PMT = PMT
-
-          for stream_type, elementary_PID, _ in PMT:
-            if stream_type == 0x1b: # H.264
-              VIDEO_PID = elementary_PID
-            elif stream_type == 0x24: # H.265
-              VIDEO_PID = elementary_PID
-            elif stream_type == 0x0F: # AAC
-              AUDIO_PID = elementary_PID
-
-          for packet in packetize_section(PMT, False, False, cast(int, PMT_PID), 0, PMT_CC):
-            candidate += packet
-            PMT_CC = (PMT_CC + 1) & 0x0F
-
-      elif PID == VIDEO_PID:
-        Video_Praser.push(packet)
-        for VIDEO in Video_Praser:
-          timestamp = cast(int, VIDEO.dts() or VIDEO.pts()) / ts.HZ
-
-          if timestamp >= offset + segments[seq][1]:
-            virtual_segments[seq].set_result(candidate)
-            processing[seq] = False
-            buffer_index = (buffer_index[0], seq + 1)
-            if not buffer_notify.done(): buffer_notify.set_result(None)
-            offset += segments[seq][1]
-            seq += 1
-            candidate = bytearray()
-            if seq >= len(segments):
-              break
-            processing[seq] = True
-
-            for packet in packetize_section(cast(PATSection, LATEST_PAT), False, False, 0, 0, PAT_CC):
-              candidate += packet
-              PAT_CC = (PAT_CC + 1) & 0x0F
-            for packet in packetize_section(cast(PMTSection, LATEST_PMT), False, False, cast(int, PMT_PID), 0, PMT_CC):
-              candidate += packet
-              PMT_CC = (PMT_CC + 1) & 0x0F
-
-          for packet in packetize_pes(VIDEO, False, False, cast(int, VIDEO_PID), 0, VIDEO_CC):
-            candidate += packet
-            VIDEO_CC = (VIDEO_CC + 1) & 0x0F
-
-      elif PID == AUDIO_PID:
-        Audio_Praser.push(packet)
-        for AUDIO in Audio_Praser:
-          for packet in packetize_pes(AUDIO, False, False, cast(int, AUDIO_PID), 0, AUDIO_CC):
-            candidate += packet
-            AUDIO_CC = (AUDIO_CC + 1) & 0x0F
-
-      else:
-        candidate += packet
+    def PAT_CALLBACK(PAT: PATSection):
+      nonlocal LATEST_PAT, PAT_CC
+      if seq >= len(segments): return
+      LATEST_PAT = PacketizedSection(PAT, False, False, 0, 0)
+      packets, PAT_CC = LATEST_PAT.packetize(PAT_CC)
+      candidate.extend(packets)
+
+    def PMT_CALLBACK(PID: int, PMT: PMTSection):
+      nonlocal LATEST_PMT, PMT_CC
+      if seq >= len(segments): return
+      LATEST_PMT = PacketizedSection(PMT, False, False, PID, 0)
+      packets, PMT_CC = LATEST_PMT.packetize(PMT_CC)
+      candidate.extend(packets)
+
+    def VIDEO_CALLBACK(PID: int, VIDEO: PES):
+      nonlocal seq, offset, buffer_index, candidate, PAT_CC, PMT_CC, VIDEO_CC
+      if seq >= len(segments): return
+      timestamp = cast(int, VIDEO.dts() or VIDEO.pts()) / ts.HZ
+
+      if timestamp >= offset + segments[seq][1]:
+        virtual_segments[seq].set_result(candidate)
+        processing[seq] = False
+        buffer_index = (buffer_index[0], seq + 1)
+        if not buffer_notify.done(): buffer_notify.set_result(None)
+        offset += segments[seq][1]
+        seq += 1
+        candidate = bytearray()
+        if seq >= len(segments): return
+        processing[seq] = True
+
+        packets, PAT_CC = cast(PacketizedSection, LATEST_PAT).packetize(PAT_CC)
+        candidate += packets
+        packets, PMT_CC = cast(PacketizedSection, LATEST_PMT).packetize(PMT_CC)
+        candidate += packets
+
+      packets, VIDEO_CC = packetize_pes_buffer(VIDEO, False, False, PID, 0, VIDEO_CC)
+      candidate += packets
+
+    def AUDIO_CALLBACK(PID: int, AUDIO: PES):
+      nonlocal AUDIO_CC
+      if seq >= len(segments): return
+      packets, AUDIO_CC = packetize_pes_buffer(AUDIO, False, False, PID, 0, AUDIO_CC)
+      candidate.extend(packets)
+
+    def OTHER_CALLBACK(packet: bytes | bytearray | memoryview):
+      if seq >= len(segments): return
+      candidate.extend(packet)
+
+    demuxer = MpegtsDemuxer(PAT=PAT_CALLBACK, PMT=PMT_CALLBACK, repeat=True) # every PAT/PMT is copied into the output
+    demuxer.register(0x1b, lambda PID: (PESParser[PES](PES), partial(VIDEO_CALLBACK, PID)), first_only=True) # H.264
+    demuxer.register(0x24, lambda PID: (PESParser[PES](PES), partial(VIDEO_CALLBACK, PID)), first_only=True) # H.265
+    demuxer.register(0x0F, lambda PID: (PESParser[PES](PES), partial(AUDIO_CALLBACK, PID)), first_only=True) # AAC
+    demuxer.register(None, lambda PID: (None, OTHER_CALLBACK))
+
+    async for chunk in PacketAlignedAsyncReader(reader).chunks():
+      if not process_queue.empty() or seq >= len(segments): break
+      demuxer.push_chunk(chunk)
 
 if __name__ == '__main__':
   asyncio.run(main())
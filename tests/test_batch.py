@@ -0,0 +1,33 @@
+import random
+
+import biim.mpeg2ts.batch as batch
+from biim.mpeg2ts import ts
+from biim.mpeg2ts.batch import PacketBatch
+
+def packets(rng: random.Random, count: int) -> bytes:
+  # random headers, adaptation fields up to the whole packet, some with PCR
+  result = bytearray()
+  for _ in range(count):
+    packet = bytearray(rng.randbytes(ts.PACKET_SIZE))
+    packet[0] = ts.SYNC_BYTE[0]
+    packet[1] = (packet[1] & 0x5F) | (0x40 if rng.random() < 0.3 else 0x00)
+    packet[1] = (packet[1] & 0xE0) | rng.choice([0x00, 0x01, 0x1F])
+    packet[3] = (packet[3] & 0x0F) | rng.choice([0x10, 0x20, 0x30])
+    if packet[3] & 0x20:
+      packet[4] = rng.choice([0, 1, 7, 100, 183])
+      packet[5] = rng.choice([0x00, 0x10, 0x50])
+    result += packet
+  return bytes(result)
+
+def decoded(packetBatch: PacketBatch) -> tuple:
+  return (packetBatch.pid, packetBatch.payload_unit_start_indicator, packetBatch.continuity_counter, packetBatch.has_adaptation_field, packetBatch.payload_offset, packetBatch.pcr, packetBatch.groups)
+
+def test_batch_matches_per_packet(monkeypatch):
+  data = packets(random.Random(0), 2000)
+  rows = [data[begin:begin + ts.PACKET_SIZE] for begin in range(0, len(data), ts.PACKET_SIZE)]
+  vectorized = decoded(PacketBatch(data))
+  monkeypatch.setattr(batch, 'np', None)
+  fallback = decoded(PacketBatch(data))
+  assert vectorized == fallback
+  assert fallback[0] == [ts.pid(packet) for packet in rows]
+  assert fallback[5] == [ts.pcr(packet) for packet in rows]
@@ -0,0 +1,167 @@
+import random
+from collections import deque
+from typing import Any, Callable
+
+from biim.util.bitstream import BitStream, ebsp2rbsp
+
+from tests.test_nal import PARAMETER_SETS, SPS
+
+def legacy_ebsp2rbsp(data: bytes | bytearray | memoryview) -> bytes:
+  # per-byte loop formerly copied in variant/codec.py, mp4/avc.py and mp4/hevc.py
+  rbsp = bytearray(data[:2])
+  length = len(data)
+  for index in range(2, length):
+    if index < length - 1 and data[index - 2] == 0x00 and data[index - 1] == 0x00 and data[index + 0] == 0x03 and data[index + 1] in (0x00, 0x01, 0x02, 0x03):
+      continue
+    rbsp.append(data[index])
+  return bytes(rbsp)
+
+def test_ebsp2rbsp_parameter_sets():
+  for nal in PARAMETER_SETS:
+    assert ebsp2rbsp(nal) == legacy_ebsp2rbsp(nal)
+  assert ebsp2rbsp(SPS).count(b'\x00\x00\x03') == 0
+
+def test_ebsp2rbsp_fuzz():
+  # biased toward 00/03 so escapes, adjacent escapes and trailing 00 00 03 are frequent
+  rng = random.Random(0)
+  for _ in range(20000):
+    data = bytes(rng.choice([0x00, 0x00, 0x00, 0x03, 0x03, 0x01, 0x02, 0x04, 0xFF]) for _ in range(rng.randrange(0, 40)))
+    expected = legacy_ebsp2rbsp(data)
+    assert ebsp2rbsp(data) == expected, data.hex()
+    assert ebsp2rbsp(bytearray(data)) == expected, data.hex()
+    assert ebsp2rbsp(memoryview(data)) == expected, data.hex()
+
+class LegacyBitStream:
+  # deque-of-bits implementation formerly in biim.util.bitstream
+
+  def __init__(self, data):
+    self.bits: deque[int] = deque()
+    self.data: deque[int] = deque(data)
+
+  def __bool__(self) -> bool:
+    return bool(self.bits or self.data)
+
+  def __len__(self) -> int:
+    return len(self.data) * 8 + len(self.bits)
+
+  def __fill_bits(self) -> None:
+    if not self.data:
+      return
+    byte = self.data.popleft()
+    for index in range(8):
+      bit_index = (8 - 1) - index
+      self.bits.append(1 if (byte & (1 << bit_index)) != 0 else 0)
+
+  def __peekBit(self) -> int:
+    if not self.bits:
+      self.__fill_bits()
+    return self.bits[0]
+
+  def __count_trailing_zeros(self) -> int:
+    result = 0
+    while self.__peekBit() == 0:
+      self.readBits(1)
+      result += 1
+    return result
+
+  def readBits(self, size: int) -> int:
+    result = 0
+    remain_bits_len = min(len(self.bits), size)
+    for _ in range(remain_bits_len):
+      result *= 2
+      result += self.bits.popleft()
+      size -= 1
+
+    while size >= 8 and self.data:
+      byte = self.data.popleft()
+      result *= 256
+      result += byte
+      size -= 8
+    if size == 0:
+      return result
+
+    self.__fill_bits()
+    remain_bits_len = min(len(self.bits), size)
+    for _ in range(remain_bits_len):
+      result *= 2
+      result += self.bits.popleft()
+      size -= 1
+    return result
+
+  def readBool(self) -> bool:
+    return self.readBits(1) == 1
+
+  def readByte(self, size: int = 1) -> int:
+    return self.readBits(size * 8)
+
+  def readBitStreamFromBytes(self, size: int) -> 'LegacyBitStream':
+    return LegacyBitStream(bytes([
+      self.readByte(1) for _ in range(size)
+    ]))
+
+  def readUEG(self) -> int:
+    count = self.__count_trailing_zeros()
+    return self.readBits(count + 1) - 1
+
+  def readSEG(self) -> int:
+    ueg = self.readUEG()
+    if ueg % 2 == 1:
+      return (ueg + 1) >> 1
+    else:
+      return -1 * (ueg >> 1)
+
+  def retainByte(self, byte: int) -> None:
+    for i in range(8):
+      self.bits.appendleft(1 if byte & (1 << i) != 0 else 0)
+
+def outcome(read: Callable[[], Any]) -> tuple[Any, ...]:
+  # reading past the end raises IndexError in both implementations
+  try:
+    return ('ok', read())
+  except IndexError:
+    return ('error',)
+
+def test_bitstream_parameter_sets():
+  for nal in PARAMETER_SETS:
+    legacy, current = LegacyBitStream(ebsp2rbsp(nal)), BitStream(ebsp2rbsp(nal))
+    assert legacy.readByte(2) == current.readByte(2)
+    while len(legacy) > 0:
+      assert outcome(legacy.readUEG) == outcome(current.readUEG)
+      assert len(legacy) == len(current)
+
+def test_bitstream_fuzz():
+  # random mix of every method, compared step by step until the stream is exhausted
+  rng = random.Random(2)
+  for _ in range(5000):
+    data = bytes(rng.choice([0x00, 0x00, 0x01, 0x80, 0x0F, 0xFF, rng.randrange(256)]) for _ in range(rng.randrange(0, 24)))
+    legacy, current = LegacyBitStream(data), BitStream(memoryview(data))
+    for _ in range(30):
+      operation = rng.randrange(7)
+      if operation == 0:
+        size = rng.randrange(0, 40)
+        expected, actual = outcome(lambda: legacy.readBits(size)), outcome(lambda: current.readBits(size))
+      elif operation == 1:
+        expected, actual = outcome(legacy.readBool), outcome(current.readBool)
+      elif operation == 2:
+        size = rng.randrange(1, 4)
+        expected, actual = outcome(lambda: legacy.readByte(size)), outcome(lambda: current.readByte(size))
+      elif operation == 3:
+        expected, actual = outcome(legacy.readUEG), outcome(current.readUEG)
+      elif operation == 4:
+        expected, actual = outcome(legacy.readSEG), outcome(current.readSEG)
+      elif operation == 5:
+        size = rng.randrange(0, 4)
+        if len(legacy) < size * 8: continue
+        legacy_sub, current_sub = legacy.readBitStreamFromBytes(size), current.readBitStreamFromBytes(size)
+        expected, actual = (len(legacy_sub), legacy_sub.readBits(len(legacy_sub))), (len(current_sub), current_sub.readBits(len(current_sub)))
+      else:
+        # put back just read byte (rewind) or arbitrary byte (rebuild)
+        if len(legacy) >= 8 and rng.randrange(2):
+          expected, actual = legacy.readByte(), current.readByte()
+        else:
+          expected = actual = rng.randrange(256)
+        legacy.retainByte(expected)
+        current.retainByte(expected)
+      assert expected == actual, (data.hex(), operation)
+      assert len(legacy) == len(current) and bool(legacy) == bool(current), (data.hex(), operation)
+      if expected == ('error',): break
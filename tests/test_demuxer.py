@@ -0,0 +1,125 @@
+from typing import Any
+
+import pytest
+
+import biim.mpeg2ts.demuxer as demuxer
+from biim.mpeg2ts import ts
+from biim.mpeg2ts.demuxer import MpegtsDemuxer
+from biim.mpeg2ts.parser import PESParser
+from biim.mpeg2ts.pes import PES
+
+PMT_PID, VIDEO_PID, AUDIO_PID, SECOND_AUDIO_PID, DATA_PID, ID3_PID = 0x1000, 0x100, 0x110, 0x111, 0x130, 0x120
+
+def crc32(data: bytes) -> int:
+  crc = 0xFFFFFFFF
+  for byte in data:
+    for index in range(7, -1, -1):
+      bit = ((byte >> index) & 1) ^ (crc >> 31)
+      crc = (crc << 1) & 0xFFFFFFFF
+      if bit: crc ^= 0x04C11DB7
+  return crc
+
+def section(table_id: int, extension: int, version: int, body: bytes, section_number: int = 0, last_section_number: int = 0) -> bytes:
+  length = 5 + len(body) + 4
+  data = bytes([table_id, 0xB0 | (length >> 8), length & 0xFF, extension >> 8, extension & 0xFF, 0xC1 | (version << 1), section_number, last_section_number]) + body
+  return data + crc32(data).to_bytes(4, byteorder='big')
+
+def pmt(version: int, streams: list[tuple[int, int]]) -> bytes:
+  body = bytes([0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00])
+  for stream_type, PID in streams: body += bytes([stream_type, 0xE0 | (PID >> 8), PID & 0xFF, 0xF0, 0x00])
+  return section(0x02, 1, version, body)
+
+def pes(stream_id: int, pts: int, data: bytes, bounded: bool) -> bytes:
+  header = bytes([0x80, 0x80, 0x05, 0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, ((pts >> 14) & 0xFE) | 1, (pts >> 7) & 0xFF, ((pts << 1) & 0xFE) | 1])
+  length = len(header) + len(data) if bounded else 0
+  return bytes([0x00, 0x00, 0x01, stream_id, length >> 8, length & 0xFF]) + header + data
+
+counters: dict[int, int] = dict()
+def packetize(PID: int, payload: bytes, is_section: bool = False) -> list[bytes]:
+  # sections are padded with stuffing bytes, PES with adaptation field
+  if is_section: payload = b'\x00' + payload + b'\xFF' * (-(len(payload) + 1) % (ts.PACKET_SIZE - ts.HEADER_SIZE))
+  result = []
+  for begin in range(0, len(payload), ts.PACKET_SIZE - ts.HEADER_SIZE):
+    chunk = payload[begin:begin + ts.PACKET_SIZE - ts.HEADER_SIZE]
+    counter = counters.get(PID, 0)
+    counters[PID] = (counter + 1) & 0x0F
+    stuffing = ts.PACKET_SIZE - ts.HEADER_SIZE - len(chunk)
+    adaptation = b'' if stuffing == 0 else bytes([stuffing - 1]) if stuffing == 1 else bytes([stuffing - 1, 0x00]) + b'\xFF' * (stuffing - 2)
+    header = bytes([ts.SYNC_BYTE[0], (0x40 if begin == 0 else 0) | (PID >> 8), PID & 0xFF, (0x30 if adaptation else 0x10) | counter])
+    result.append(header + adaptation + chunk)
+  return result
+
+def pcr(PID: int, base: int) -> bytes:
+  field = bytes([183, 0x10, (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF, (base >> 1) & 0xFF, ((base & 1) << 7) | 0x7E, 0x00])
+  return bytes([ts.SYNC_BYTE[0], PID >> 8, PID & 0xFF, 0x20]) + field + b'\xFF' * (ts.PACKET_SIZE - ts.HEADER_SIZE - len(field))
+
+VIDEO = [(90000 + 3003 * index, bytes([index + 1]) * size) for index, size in enumerate([500, 900, 100])]
+AUDIO = (90000, b'\x02' * 300)
+
+def stream() -> list[bytes]:
+  counters.clear()
+  PAT = section(0x00, 1, 0, bytes([0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF]))
+  PMT = pmt(0, [(0x1b, VIDEO_PID), (0x0F, AUDIO_PID), (0x0F, SECOND_AUDIO_PID), (0x06, DATA_PID)])
+  UPDATED_PMT = pmt(1, [(0x1b, VIDEO_PID), (0x0F, AUDIO_PID), (0x0F, SECOND_AUDIO_PID), (0x06, DATA_PID), (0x15, ID3_PID)])
+  NULL = bytes([ts.SYNC_BYTE[0], 0x1F, 0xFF, 0x10]) + b'\xFF' * (ts.PACKET_SIZE - ts.HEADER_SIZE)
+
+  packets = packetize(0, PAT, True) + packetize(PMT_PID, PMT, True) + packetize(0, PAT, True) + packetize(PMT_PID, PMT, True)
+  packets += [pcr(VIDEO_PID, 1000)]
+  packets += packetize(VIDEO_PID, pes(0xE0, *VIDEO[0], False))
+  packets += packetize(AUDIO_PID, pes(0xC0, *AUDIO, True)) + packetize(SECOND_AUDIO_PID, pes(0xC0, *AUDIO, True))
+  packets += packetize(DATA_PID, b'\x03' * 10) * 2 + [NULL] * 2
+  # PMT update while second video PES is being assembled
+  second = packetize(VIDEO_PID, pes(0xE0, *VIDEO[1], False))
+  packets += second[:3] + packetize(PMT_PID, UPDATED_PMT, True) + second[3:]
+  packets += [pcr(VIDEO_PID, 2000)]
+  packets += packetize(VIDEO_PID, pes(0xE0, *VIDEO[2], False))
+  return packets
+
+@pytest.mark.parametrize('mode', ['packet', 'chunk', 'chunk_fallback'])
+@pytest.mark.parametrize('repeat', [False, True])
+def test_demuxer_dispatch(monkeypatch, mode: str, repeat: bool):
+  calls: dict[str, list[Any]] = { name: [] for name in ['PAT', 'PMT', 'PCR', 'video', 'audio', 'other', 'factory'] }
+  def factory(name: str, parser: bool):
+    def create(PID: int):
+      calls['factory'].append((name, PID))
+      if parser: return (PESParser[PES](PES), lambda data: calls[name].append((PID, data.pts(), bytes(data.PES_packet_data()))))
+      return (None, lambda packet: calls[name].append((PID, bytes(packet))))
+    return create
+
+  instance = MpegtsDemuxer(PAT=lambda PAT: calls['PAT'].append(PAT.version_number()), PMT=lambda PID, PMT: calls['PMT'].append((PID, PMT.version_number())), PCR=calls['PCR'].append, profile=True, repeat=repeat)
+  instance.register(0x1b, factory('video', True))
+  instance.register(0x0F, factory('audio', True), first_only=True)
+  instance.register(None, factory('other', False))
+
+  packets = stream()
+  if mode == 'packet':
+    for packet in packets: instance.push(packet)
+  else:
+    monkeypatch.setattr(demuxer, 'VECTORIZED', mode == 'chunk')
+    data = b''.join(packets)
+    for begin in range(0, len(data), ts.PACKET_SIZE * 7): instance.push_chunk(data[begin:begin + ts.PACKET_SIZE * 7])
+
+  assert calls['PAT'] == ([0, 0] if repeat else [0])
+  assert calls['PMT'] == ([(PMT_PID, 0), (PMT_PID, 0), (PMT_PID, 1)] if repeat else [(PMT_PID, 0), (PMT_PID, 1)])
+  # unchanged streams keep their parser across PMT update, only the added PID is created
+  assert calls['factory'] == [('video', VIDEO_PID), ('audio', AUDIO_PID), ('other', SECOND_AUDIO_PID), ('other', DATA_PID), ('other', ID3_PID)]
+  # last unbounded PES is held until next payload unit start
+  assert calls['video'] == [(VIDEO_PID, pts, data) for pts, data in VIDEO[:2]]
+  # first_only: second AAC falls back to raw packet callback
+  assert calls['audio'] == [(AUDIO_PID, *AUDIO)]
+  assert [PID for PID, _ in calls['other']] == [SECOND_AUDIO_PID] * 2 + [DATA_PID] * 2
+  assert calls['PCR'] == [ts.pcr(packet) for packet in packets if ts.pid(packet) == VIDEO_PID and ts.has_pcr(packet)]
+
+  expected: dict[int, int] = dict()
+  for packet in packets: expected[ts.pid(packet)] = expected.get(ts.pid(packet), 0) + 1
+  assert { PID: count for PID, (count, _) in instance.statistics().items() } == expected
+
+def test_demuxer_program_selection():
+  PAT = section(0x00, 1, 0, bytes([0x00, 0x00, 0xE0, 0x10, 0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF, 0x00, 0x02, 0xE0 | (0x1001 >> 8), 0x1001 & 0xFF]))
+  counters.clear()
+  instance = MpegtsDemuxer(SID=2)
+  for packet in packetize(0, PAT, True): instance.push(packet)
+  assert instance.PMT_PID == 0x1001
+  instance = MpegtsDemuxer()
+  for packet in packetize(0, PAT, True): instance.push(packet)
+  assert instance.PMT_PID == PMT_PID
@@ -0,0 +1,129 @@
+import random
+from typing import cast
+
+from biim.mp4.box import box, fragment, mdat, mfhd, moof, moof_into, traf
+from biim.mp4.fragment import FragmentBuilder
+
+def boxes(data: bytes, begin: int = 0, end: int | None = None) -> list[tuple[str, int, int]]:
+  # (type, begin, end) of each box in data[begin:end]
+  end = len(data) if end is None else end
+  result: list[tuple[str, int, int]] = []
+  while begin < end:
+    size = int.from_bytes(data[begin:begin + 4], byteorder='big')
+    result.append((data[begin + 4:begin + 8].decode('ascii'), begin, begin + size))
+    begin += size
+  return result
+
+def samples(data: bytes) -> dict[int, list[tuple[int, int, int, int, bytes]]]:
+  # trackId -> (decodeTime, duration, flags, compositionTimeOffset, data) of each sample in moof + mdat sequence
+  result: dict[int, list[tuple[int, int, int, int, bytes]]] = dict()
+  for name, begin, end in boxes(data):
+    if name != 'moof': continue
+    for name, traf_begin, traf_end in boxes(data, begin + 8, end):
+      if name != 'traf': continue
+      children = { name: (box_begin, box_end) for name, box_begin, box_end in boxes(data, traf_begin + 8, traf_end) }
+      tfhd, tfdt, trun = children['tfhd'][0], children['tfdt'][0], children['trun'][0]
+      assert int.from_bytes(data[tfhd + 9:tfhd + 12], byteorder='big') == 0x020008 # default-base-is-moof
+      trackId = int.from_bytes(data[tfhd + 12:tfhd + 16], byteorder='big')
+      decodeTime = int.from_bytes(data[tfdt + 12:tfdt + 20], byteorder='big')
+      count = int.from_bytes(data[trun + 12:trun + 16], byteorder='big')
+      offset = begin + int.from_bytes(data[trun + 16:trun + 20], byteorder='big')
+      for index in range(count):
+        entry = trun + 20 + index * 16
+        duration, size, flags, compositionTimeOffset = (int.from_bytes(data[entry + field:entry + field + 4], byteorder='big') for field in range(0, 16, 4))
+        result.setdefault(trackId, []).append((decodeTime, duration, flags, compositionTimeOffset, data[offset:offset + size]))
+        decodeTime += duration
+        offset += size
+  return result
+
+def legacy_moof(sequence_number: int, fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]]) -> bytes:
+  # built twice to know its own size, formerly biim.mp4.box.moof
+  moofSize = len(
+    box('moof', [
+      mfhd(sequence_number),
+      b''.join([traf(trackId, duration, baseMediaDecodeTime, offset, samples) for trackId, duration, baseMediaDecodeTime, offset, samples in fragments])
+    ])
+  )
+  return box('moof', [
+    mfhd(sequence_number),
+    b''.join([traf(trackId, duration, baseMediaDecodeTime, moofSize + 8 + offset, samples) for trackId, duration, baseMediaDecodeTime, offset, samples in fragments])
+  ])
+
+def legacy_fragment(trackId: int, decodeTime: int, duration: int, data: bytes, isKeyframe: bool, compositionTimeOffset: int) -> bytes:
+  # moof + mdat per sample, formerly emitted by Fmp4VariantHandler
+  return legacy_moof(0, [(trackId, duration, decodeTime, 0, [(len(data), duration, isKeyframe, compositionTimeOffset)])]) + mdat(data)
+
+def collect(outputs: list[bytes]):
+  return lambda output: outputs.append(b''.join(output))
+
+def test_fragment_single_sample():
+  outputs: list[bytes] = []
+  builder = FragmentBuilder(collect(outputs))
+  builder.add(1, 900000, 3003, b'\x00' * 100, True, 6006)
+  assert builder and builder.duration() == 3003
+  builder.flush()
+  assert not builder
+  # same as former moof + mdat except sequence_number
+  expected = bytearray(legacy_fragment(1, 900000, 3003, b'\x00' * 100, True, 6006))
+  expected[20:24] = (1).to_bytes(4, byteorder='big')
+  assert outputs == [bytes(expected)]
+
+def test_fragment_coalesce():
+  # interleaved video (track 1) and audio (track 2) samples, flushed at random points
+  rng = random.Random(0)
+  for _ in range(50):
+    legacy, outputs = b'', cast(list[bytes], [])
+    builder = FragmentBuilder(collect(outputs))
+    times = { 1: rng.randrange(1 << 32), 2: rng.randrange(1 << 32) }
+    for _ in range(rng.randrange(1, 80)):
+      trackId = rng.choice([1, 2])
+      duration = 3003 if trackId == 1 else 1920
+      if rng.random() < 0.05: times[trackId] += rng.choice([-1, 1]) * duration * rng.randrange(1, 10) # jump
+      data = rng.randbytes(rng.randrange(0, 2000))
+      isKeyframe, compositionTimeOffset = trackId == 1 and rng.random() < 0.1, rng.choice([0, 3003, 6006]) if trackId == 1 else 0
+      builder.add(trackId, times[trackId], duration, data, isKeyframe, compositionTimeOffset)
+      legacy += legacy_fragment(trackId, times[trackId], duration, data, isKeyframe, compositionTimeOffset)
+      times[trackId] += duration
+      if rng.random() < 0.1: builder.flush()
+    builder.flush()
+
+    coalesced = b''.join(outputs)
+    assert samples(coalesced) == samples(legacy)
+    assert len(outputs) <= legacy.count(b'moof')
+    assert [int.from_bytes(output[20:24], byteorder='big') for output in outputs] == list(range(1, len(outputs) + 1))
+
+def test_fragment_jitter():
+  outputs: list[bytes] = []
+  builder = FragmentBuilder(collect(outputs))
+  # rounded ADTS durations, absorbed into previous sample duration
+  for decodeTime in [0, 1919, 3840, 5761, 7680]: builder.add(2, decodeTime, 1920, b'a')
+  assert builder.duration() == 7680 + 1920
+  # jump of one frame or more starts new fragment
+  builder.add(2, 7680 + 1920 * 2, 1920, b'b')
+  builder.flush()
+  assert len(outputs) == 2
+  assert [(decodeTime, duration) for decodeTime, duration, *_ in samples(b''.join(outputs))[2]] == [(0, 1919), (1919, 1921), (3840, 1921), (5761, 1919), (7680, 1920), (11520, 1920)]
+
+def test_moof():
+  # tfhd flags 0x020008 (default-base-is-moof, default-sample-duration-present) in both
+  rng = random.Random(1)
+  for _ in range(2000):
+    fragments: list[tuple[int, int, int, int, list[tuple[int, int, bool, int]]]] = []
+    data: list[bytes] = []
+    offset = 0
+    for trackId in range(1, rng.randrange(1, 4) + 1):
+      run = [(rng.randrange(0, 64), rng.randrange(1 << 16), rng.random() < 0.5, rng.randrange(1 << 16)) for _ in range(rng.randrange(1, 20))]
+      fragments.append((trackId, run[0][1], rng.randrange(1 << 64), offset, run))
+      data.extend(rng.randbytes(size) for size, *_ in run)
+      offset += sum(size for size, *_ in run)
+    sequence_number = rng.randrange(1 << 32)
+
+    expected = legacy_moof(sequence_number, fragments)
+    assert moof(sequence_number, fragments) == expected
+    buffer = bytearray(b'\xAA' * (len(expected) + 20))
+    assert moof_into(buffer, 10, sequence_number, fragments) == len(expected)
+    assert buffer[10:10 + len(expected)] == expected and buffer[:10] == buffer[-10:] == b'\xAA' * 10
+
+    scatter = fragment(sequence_number, fragments, list(data))
+    assert all(chunk is sample for chunk, sample in zip(scatter[1:], data, strict=True)) # sample data is passed through, not copied
+    assert b''.join(scatter) == expected + mdat(b''.join(data))
@@ -0,0 +1,63 @@
+import asyncio
+import gzip
+from typing import cast
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from biim.variant import handler as variant
+from biim.variant.handler import accepts_gzip
+from biim.variant.fmp4 import Fmp4VariantHandler
+
+def request(path: str, encoding: str | None = 'gzip, deflate') -> web.Request:
+  return make_mocked_request('GET', path, headers={} if encoding is None else {'Accept-Encoding': encoding})
+
+def test_accepts_gzip():
+  for encoding, expected in [
+    (None, False), ('', False), ('identity', False), ('deflate, br', False),
+    ('gzip', True), ('GZIP', True), ('deflate, gzip;q=0.5', True), ('*', True),
+    ('gzip;q=0', False), ('gzip; q=0.000', False), ('gzip;q=invalid', False), ('*;q=0', False),
+    ('gzip;q=0, *', False), ('*;q=0, gzip', True), ('*, gzip;q=0', False), # explicit gzip overrides *
+  ]:
+    assert accepts_gzip(request('/', encoding)) == expected, encoding
+
+def test_playlist_gzip():
+  async def run():
+    handler = Fmp4VariantHandler(target_duration=1, part_target=0.1)
+    pts = 0
+    handler.m3u8.continuousSegment(pts, True)
+    handler.m3u8.continuousSegment(pts := pts + 9000, True) # published
+
+    # smaller than GZIP_MIN_SIZE
+    response = cast(web.Response, await handler.playlist(request('/playlist.m3u8')))
+    assert len(handler.m3u8.manifest()) < variant.GZIP_MIN_SIZE
+    assert 'Content-Encoding' not in response.headers and response.headers['Vary'] == 'Accept-Encoding'
+    assert response.body == handler.m3u8.manifest()
+
+    while len(handler.m3u8.manifest()) < variant.GZIP_MIN_SIZE:
+      handler.m3u8.continuousSegment(pts := pts + 9000, True)
+    versions: list[bytes] = []
+    for _ in range(variant.MAX_GZIP_MANIFESTS + 2):
+      handler.m3u8.continuousPartial(pts := pts + 9000)
+      versions.append(handler.m3u8.manifest())
+      for encoding in ['gzip', 'gzip;q=0', None]:
+        response = cast(web.Response, await handler.playlist(request('/playlist.m3u8', encoding)))
+        body = cast(bytes, response.body)
+        if encoding == 'gzip':
+          assert response.headers['Content-Encoding'] == 'gzip' and gzip.decompress(body) == versions[-1]
+        else:
+          assert 'Content-Encoding' not in response.headers and body == versions[-1]
+      # every waiter of same version shares one compressed body
+      first = cast(web.Response, await handler.playlist(request('/playlist.m3u8'))).body
+      assert cast(web.Response, await handler.playlist(request('/playlist.m3u8'))).body is first
+
+    # only latest versions are kept
+    assert list(handler.gzip_manifests) == versions[-variant.MAX_GZIP_MANIFESTS:]
+    assert handler.gzip_hits == 2 * len(versions)
+    assert handler.gzip_input_bytes == sum(map(len, versions)) and 0 < handler.gzip_ratio() < 1
+
+    # disabled
+    handler.gzip_level = 0
+    response = cast(web.Response, await handler.playlist(request('/playlist.m3u8')))
+    assert 'Content-Encoding' not in response.headers and 'Vary' not in response.headers
+  asyncio.run(run())
@@ -0,0 +1,282 @@
+import asyncio
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import cast
+
+from biim.hls.m3u8 import M3U8, MIN_WINDOW_SEGMENTS, enforce_memory_budget
+
+def playlist(**kwargs) -> tuple[M3U8, list[str]]:
+  released: list[str] = []
+  return M3U8(target_duration=1, part_target=0.1, has_init=True, init_released=released.append, **kwargs), released
+
+def test_init_references():
+  async def run():
+    m3u8, released = playlist(window_size=2)
+    for index in range(8):
+      m3u8.changeInit(f'init?v={index}')
+      m3u8.continuousSegment(index * 90000)
+      # segments and outdated refer to last 4 inits, older ones (and initial one, never used) are released in order
+      assert set(m3u8.init_references) == { segment.init for segment in [*m3u8.segments, *m3u8.outdated] }
+      assert released == ['init'] + [f'init?v={version}' for version in range(max(0, index - 3))]
+
+    # replaced before any segment used it
+    m3u8.changeInit('init?v=8')
+    m3u8.changeInit('init?v=9')
+    assert released[-1] == 'init?v=8'
+    # current init is kept even after no segment refers it
+    m3u8.continuousSegment(8 * 90000)
+    m3u8.continuousSegment(9 * 90000)
+    m3u8.continuousSegment(10 * 90000)
+    m3u8.continuousSegment(11 * 90000)
+    assert 'init?v=9' not in released and 'init?v=7' in released
+  asyncio.run(run())
+
+def test_init_references_event():
+  async def run():
+    # EVENT playlist never drops segments, so every init they refer stays
+    m3u8, released = playlist()
+    m3u8.continuousSegment(0)
+    for index in range(1, 33):
+      if index % 2 == 0: m3u8.changeInit(f'init?v={index}')
+      m3u8.continuousSegment(index * 90000)
+    assert released == [] and len(m3u8.init_references) == 17
+  asyncio.run(run())
+
+def legacy_manifest(self: M3U8, skip: bool = False) -> str:
+  # whole playlist rendered on every call, formerly M3U8.manifest
+  def estimated_tartget_duration() -> int:
+    target_duration = self.target_duration
+    for segment in self.segments:
+      if not segment.isCompleted(): continue
+      target_duration = max(target_duration, math.ceil(cast(timedelta, segment.extinf()).total_seconds()))
+    return target_duration
+
+  m3u8 = ''
+  m3u8 += f'#EXTM3U\n'
+  m3u8 += f'#EXT-X-VERSION:{9 if self.window_size is None else 6}\n'
+  m3u8 += f'#EXT-X-TARGETDURATION:{estimated_tartget_duration()}\n'
+  m3u8 += f'#EXT-X-PART-INF:PART-TARGET={self.part_target:.06f}\n'
+  if self.window_size is None:
+    m3u8 += f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={(self.part_target * 3.001):.06f},CAN-SKIP-UNTIL={estimated_tartget_duration() * 6}\n'
+    m3u8 += f'#EXT-X-PLAYLIST-TYPE:EVENT\n'
+  else:
+    m3u8 += f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={(self.part_target * 3.001):.06f}\n'
+  m3u8 += f'#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}\n'
+  if self.discontinuity_sequence > 0:
+    m3u8 += f'#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}\n'
+
+  if self.has_init:
+    m3u8 += f'\n'
+    m3u8 += f'#EXT-X-MAP:URI="{self.segments[0].init if self.segments else self.init}"\n'
+
+  skip_end_index = 0
+  if skip:
+    elapsed = 0
+    for seg_index, segment in enumerate(reversed(self.segments)):
+      seg_index = (len(self.segments) - 1) - seg_index
+      if not segment.isCompleted(): continue
+      elapsed += cast(timedelta, segment.extinf()).total_seconds()
+      if elapsed >= estimated_tartget_duration() * 6:
+        skip_end_index = seg_index
+        break
+  if skip_end_index > 0:
+    m3u8 += f'\n'
+    m3u8 += f'#EXT-X-SKIP:SKIPPED-SEGMENTS={skip_end_index}\n'
+
+  for daterange in self.dateranges.values():
+    m3u8 += f'\n'
+    m3u8 += f'{daterange}'
+
+  for seg_index, segment in enumerate(self.segments):
+    if seg_index < skip_end_index: continue # SKIP
+    msn = self.media_sequence + seg_index
+    m3u8 += f'\n'
+    if self.has_init and seg_index > 0 and segment.init != self.segments[seg_index - 1].init:
+      m3u8 += f'#EXT-X-DISCONTINUITY\n'
+      m3u8 += f'#EXT-X-MAP:URI="{segment.init}"\n'
+    m3u8 += f'#EXT-X-PROGRAM-DATE-TIME:{segment.program_date_time.isoformat()}\n'
+    if seg_index >= len(self.segments) - 4:
+      for part_index, partial in enumerate(segment):
+        hasIFrame = ',INDEPENDENT=YES' if partial.hasIFrame else ''
+        if not partial.isCompleted():
+          m3u8 += f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part?msn={msn}&part={part_index}"{hasIFrame}\n'
+        else:
+          m3u8 += f'#EXT-X-PART:DURATION={cast(timedelta, partial.extinf()).total_seconds():.06f},URI="part?msn={msn}&part={part_index}"{hasIFrame}\n'
+
+    if segment.isCompleted():
+      m3u8 += f'#EXTINF:{cast(timedelta, segment.extinf()).total_seconds():.06f}\n'
+      m3u8 += f'segment?msn={msn}\n'
+
+  if not self.renditions: return m3u8
+  if (redintion_report := self.report()) is None: return m3u8
+  m3u8 += f'\n'
+  for path in self.renditions:
+    m3u8 += f'#EXT-X-RENDITION-REPORT:URI="{path}",{redintion_report}\n'
+
+  return m3u8
+
+def test_manifest_cache():
+  # after every change cached manifest is same as whole rendering, and same object is shared until next change
+  async def run():
+    rng = random.Random(0)
+    begin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for window_size in [None, 3]:
+      for has_init in [False, True]:
+        m3u8 = M3U8(target_duration=1, part_target=0.1, window_size=window_size, has_init=has_init)
+        pts = segment_begin = 0
+        m3u8.continuousSegment(pts, True, begin)
+        for step in range(400):
+          before = { skip: m3u8.manifest(skip) for skip in [False, True] }
+          version = m3u8.version
+          for skip in [False, True]: assert m3u8.manifest(skip) is before[skip] # cached
+
+          pts += rng.randrange(1500, 3000)
+          operation = rng.random()
+          if operation < 0.1 or pts - segment_begin > 60000: # segments are shorter than target_duration, so running max is same as rescan
+            if rng.random() < 0.3: m3u8.changeInit(f'init?v={step}')
+            m3u8.continuousSegment(pts, True, begin + timedelta(seconds=pts / 90000))
+            segment_begin = pts
+          elif operation < 0.8:
+            m3u8.continuousPartial(pts, rng.random() < 0.2)
+          elif operation < 0.9:
+            m3u8.open(f'ad-{step}', begin + timedelta(seconds=pts / 90000), CLASS='"ad"')
+          elif operation < 0.95 and m3u8.dateranges:
+            m3u8.close(rng.choice(list(m3u8.dateranges)), begin + timedelta(seconds=pts / 90000))
+          else:
+            m3u8.set_renditions([f'../{index}/playlist.m3u8' for index in range(rng.randrange(3))])
+
+          assert m3u8.version > version
+          for skip in [False, True]:
+            manifest = m3u8.manifest(skip)
+            assert manifest is not before[skip]
+            assert manifest.decode() == legacy_manifest(m3u8, skip)
+  asyncio.run(run())
+
+def legacy_report(self: M3U8) -> str | None:
+  # rescan of partials, formerly M3U8.report
+  segment_index = len(self.segments) - 1
+  while segment_index >= 0:
+    part_index = len(self.segments[segment_index].partials) - 1
+    while part_index >= 0:
+      if self.segments[segment_index].partials[part_index].isCompleted():
+        return f'LAST-MSN={self.media_sequence + segment_index},LAST-PART={part_index}'
+      part_index -= 1
+    segment_index -= 1
+  return None
+
+def test_timeline():
+  # bisect over timeline is same as linear scan of completed segments in playlist
+  async def run():
+    rng = random.Random(1)
+    begin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for window_size in [None, 3, 8]:
+      m3u8 = M3U8(target_duration=1, part_target=0.1, window_size=window_size)
+      pts = 0
+      assert m3u8.report() is None and m3u8.seek(timedelta()) is None
+      m3u8.continuousSegment(pts, True, begin)
+      for _ in range(600):
+        pts += rng.randrange(1530, 12000, 90) # whole milliseconds, so program date time and extinf add up exactly
+        if rng.random() < 0.2: m3u8.continuousSegment(pts, True, begin + timedelta(seconds=pts / 90000))
+        else: m3u8.continuousPartial(pts)
+        assert m3u8.report() == legacy_report(m3u8)
+
+        completed = [(m3u8.media_sequence + index, segment) for index, segment in enumerate(m3u8.segments) if segment.isCompleted()]
+        if not completed: continue
+        start = completed[0][1].program_date_time
+        end = completed[-1][1].program_date_time + cast(timedelta, completed[-1][1].extinf())
+        for _ in range(5):
+          # boundaries, inside and outside of playlist
+          point = rng.choice([*(segment.program_date_time for _, segment in completed), start + (end - start) * rng.uniform(-0.1, 1.1), end])
+          expected = next((msn for msn, segment in completed if segment.program_date_time <= point < segment.program_date_time + cast(timedelta, segment.extinf())), None)
+          assert m3u8.seek_program_date_time(point) == expected
+          assert m3u8.seek_program_date_time(point.replace(tzinfo=None)) == expected # naive is UTC
+          assert m3u8.seek(point - start) == expected
+  asyncio.run(run())
+
+def fill(m3u8: M3U8, rng: random.Random, segments: int, begin: datetime, pts: int = 0) -> int:
+  # whole segments of random size and duration, next segment is opened empty
+  for _ in range(segments):
+    for _ in range(rng.randrange(1, 4)): m3u8.push(rng.randbytes(rng.randrange(1, 2000)))
+    pts += rng.randrange(45000, 90000, 90)
+    m3u8.continuousSegment(pts, True, begin + timedelta(seconds=pts / 90000))
+  return pts
+
+def test_window_bytes_seconds():
+  # window slides by total bytes or duration, keeping live tail, and outdated are kept as much as window
+  async def run():
+    rng = random.Random(2)
+    begin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for window in [{ 'window_bytes': 10000 }, { 'window_seconds': 5.0 }, { 'window_bytes': 1 }]:
+      m3u8 = M3U8(target_duration=1, part_target=0.1, **window)
+      assert not m3u8.event
+      pts = 0
+      m3u8.continuousSegment(pts, True, begin)
+      for _ in range(100):
+        pts = fill(m3u8, rng, 1, begin, pts)
+        assert m3u8.segments_bytes == sum(segment.size for segment in m3u8.segments)
+        assert m3u8.outdated_bytes == sum(segment.size for segment in m3u8.outdated)
+        assert m3u8.buffered() == m3u8.segments_bytes + m3u8.outdated_bytes
+        assert len(m3u8.segments) >= MIN_WINDOW_SEGMENTS or m3u8.media_sequence == 0
+        completed = [segment for segment in m3u8.segments if segment.isCompleted()]
+        outdated_duration = sum((cast(timedelta, segment.extinf()) for segment in m3u8.outdated), timedelta())
+        if 'window_bytes' in window:
+          assert len(m3u8.segments) <= MIN_WINDOW_SEGMENTS or m3u8.segments_bytes <= window['window_bytes']
+          assert m3u8.outdated_bytes <= window['window_bytes'] or len(m3u8.outdated) == 1
+        else:
+          assert len(m3u8.segments) <= MIN_WINDOW_SEGMENTS or sum((cast(timedelta, segment.extinf()) for segment in completed), timedelta()) <= timedelta(seconds=window['window_seconds'])
+          assert outdated_duration <= timedelta(seconds=window['window_seconds']) or len(m3u8.outdated) == 1
+        manifest = m3u8.manifest()
+        assert b'#EXT-X-PLAYLIST-TYPE:EVENT' not in manifest and f'#EXT-X-MEDIA-SEQUENCE:{m3u8.media_sequence}\n'.encode() in manifest
+      assert m3u8.media_sequence > 0 and m3u8.find(m3u8.media_sequence - 1) is (m3u8.outdated[0] if m3u8.outdated else None)
+  asyncio.run(run())
+
+def test_evict():
+  # oldest outdated segment goes first, then oldest of window until live tail, EVENT playlist evicts nothing
+  async def run():
+    rng = random.Random(3)
+    begin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    m3u8 = M3U8(target_duration=1, part_target=0.1, window_size=6)
+    m3u8.continuousSegment(0, True, begin)
+    fill(m3u8, rng, 8, begin)
+    while m3u8.outdated:
+      oldest = m3u8.outdated[-1]
+      assert m3u8.eviction_order() == (False, oldest.program_date_time)
+      buffered = m3u8.buffered()
+      assert m3u8.evict() == oldest.size and m3u8.buffered() == buffered - oldest.size
+    while len(m3u8.segments) > MIN_WINDOW_SEGMENTS:
+      oldest, media_sequence = m3u8.segments[0], m3u8.media_sequence
+      assert m3u8.eviction_order() == (True, oldest.program_date_time)
+      assert m3u8.evict() == oldest.size and m3u8.media_sequence == media_sequence + 1 and not m3u8.outdated
+      assert m3u8.manifest().decode() == legacy_manifest(m3u8)
+    assert m3u8.eviction_order() is None and m3u8.evict() == 0
+
+    event = M3U8(target_duration=1, part_target=0.1)
+    event.continuousSegment(0, True, begin)
+    fill(event, rng, 8, begin)
+    assert event.event and event.eviction_order() is None and event.evict() == 0
+  asyncio.run(run())
+
+def test_enforce_memory_budget():
+  # segments are evicted across playlists in order of program date time, until budget or live tails
+  async def run():
+    rng = random.Random(4)
+    begin = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    playlists = [M3U8(target_duration=1, part_target=0.1, window_size=100) for _ in range(3)]
+    for index, m3u8 in enumerate(playlists):
+      m3u8.continuousSegment(0, True, begin + timedelta(seconds=index * 0.3))
+      fill(m3u8, rng, 10, begin + timedelta(seconds=index * 0.3))
+    segments = sorted((segment.program_date_time, segment.size) for m3u8 in playlists for segment in m3u8.segments)
+    total = sum(size for _, size in segments)
+
+    budget = total - sum(size for _, size in segments[:7]) # exactly first 7
+    assert enforce_memory_budget(playlists, budget) == 7
+    assert sum(m3u8.buffered() for m3u8 in playlists) == budget
+    remains = sorted(segment.program_date_time for m3u8 in playlists for segment in m3u8.segments)
+    assert remains == [program_date_time for program_date_time, _ in segments[7:]]
+    assert enforce_memory_budget(playlists, budget) == 0
+
+    # live tail of each playlist is kept
+    assert enforce_memory_budget(playlists, 0) == 3 * (11 - MIN_WINDOW_SEGMENTS) - 7
+    assert all(len(m3u8.segments) == MIN_WINDOW_SEGMENTS for m3u8 in playlists)
+  asyncio.run(run())
@@ -0,0 +1,61 @@
+import random
+import re
+
+from biim.mpeg2ts import nal
+from biim.mpeg2ts.h264 import H264PES
+from biim.mpeg2ts.h265 import H265PES
+
+from tests.test_demuxer import pes
+
+# HEVC VPS/SPS/PPS and H.264 SPS/PPS of test streams
+PARAMETER_SETS = [bytes.fromhex(nal) for nal in [
+  '40010c01ffff01600000030090000003000003005d959409',
+  '42010101600000030090000003000003005da00280802d16595952930bc05a020000030002000003003c10',
+  '4401c073c189',
+  '6742c020da014016ec0440000003004000000f03c60ca8',
+  '68ce3c80',
+]]
+VPS, SPS, PPS, AVC_SPS, AVC_PPS = PARAMETER_SETS
+
+def annexb(nals: list[bytes]) -> bytes:
+  # 4 byte start code for first NAL unit, 3 byte for others
+  return b''.join((b'\x00\x00\x00\x01' if index == 0 else b'\x00\x00\x01') + data for index, data in enumerate(nals))
+
+def split(data: bytes) -> list[bytes]:
+  # NAL units as split by re.split, formerly done in H264PES/H265PES.__init__
+  return [x for x in re.split(re.compile('\0\0\0?\1'.encode('ascii')), data) if len(x) > 0]
+
+def test_h264_index():
+  aud, sei, idr, non_idr = b'\x09\xf0', b'\x06\x05\x10' + bytes(16) + b'\x80', b'\x65\x88\x84' + bytes(range(1, 200)), b'\x41\x9a\x02' + bytes(range(1, 100))
+  key = H264PES(pes(0xE0, 1000, annexb([aud, AVC_SPS, AVC_PPS, sei, idr]), False))
+  assert key.nal_types() == [0x09, 0x07, 0x08, 0x06, 0x05]
+  assert key.has_idr()
+  assert [bytes(parameter_set or b'') for parameter_set in key.parameter_sets()] == [AVC_SPS, AVC_PPS]
+  assert [bytes(x) for x in key] == [aud, AVC_SPS, AVC_PPS, sei, idr]
+
+  delta = H264PES(pes(0xE0, 4003, annexb([aud, non_idr]), False))
+  assert delta.nal_types() == [0x09, 0x01]
+  assert not delta.has_idr()
+  assert delta.parameter_sets() == (None, None)
+
+def test_h265_index():
+  aud, trail = b'\x46\x01\x10', b'\x02\x01\xd0' + bytes(range(1, 200))
+  for nal_unit_type in [19, 20, 21]: # IDR_W_RADL, IDR_N_LP, CRA_NUT
+    irap = bytes([nal_unit_type << 1, 0x01, 0xaf]) + bytes(range(1, 200))
+    key = H265PES(pes(0xE0, 1000, annexb([aud, VPS, SPS, PPS, irap]), False))
+    assert key.nal_types() == [35, 32, 33, 34, nal_unit_type]
+    assert key.has_idr()
+    assert [bytes(parameter_set or b'') for parameter_set in key.parameter_sets()] == [VPS, SPS, PPS]
+
+  delta = H265PES(pes(0xE0, 4003, annexb([aud, trail]), False))
+  assert delta.nal_types() == [35, 1]
+  assert not delta.has_idr()
+  assert delta.parameter_sets() == (None, None, None)
+
+def test_index_fuzz():
+  # trailing zero bytes, 3 and 4 byte start codes and empty NAL units are split as re.split did
+  rng = random.Random(0)
+  for _ in range(5000):
+    data = b''.join(rng.choice([b'\x00\x00\x01', b'\x00\x00\x00\x01']) + bytes(rng.choice([0x00, 0x01, 0x03, 0x65]) for _ in range(rng.randrange(0, 12))) for _ in range(rng.randrange(1, 6)))
+    for view in [data, memoryview(data)]:
+      assert [bytes(view[offset:offset + length]) for offset, length in nal.index(view)] == split(data), data.hex()
@@ -0,0 +1,84 @@
+import random
+
+from biim.mpeg2ts import ts
+from biim.mpeg2ts.packetize import packetize_pes, packetize_pes_buffer, packetize_section, packetize_section_buffer, PacketizedSection
+from biim.mpeg2ts.pes import PES
+from biim.mpeg2ts.section import Section
+
+from tests.test_demuxer import pes
+
+def legacy_packetize_section(section: Section, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> list[bytes]:
+  # per packet list building formerly in biim.mpeg2ts.packetize
+  result: list[bytes] = []
+  begin = 0
+  while (begin < len(section)):
+    next = min(len(section), begin + (ts.PACKET_SIZE - ts.HEADER_SIZE) - (1 if begin == 0 else 0))
+    result.append(bytes(
+      ([
+        ts.SYNC_BYTE[0],
+        ((1 if transport_error_indicator else 0) << 7) | ((1 if begin == 0 else 0) << 6) | ((1 if transport_priority else 0) << 5) | ((pid & 0x1F00) >> 8),
+        (pid & 0x00FF),
+        (transport_scrambling_control << 6) | (1 << 4) | (continuity_counter & 0x0F),
+      ]) +
+      ([0] if begin == 0 else []) +
+      list(section[begin:next]) +
+      ([ts.STUFFING_BYTE[0]] * ((ts.PACKET_SIZE - ts.HEADER_SIZE) - ((next - begin) + (1 if begin == 0 else 0))))
+    ))
+    continuity_counter = (continuity_counter + 1) & 0x0F
+    begin = next
+  return result
+
+def legacy_packetize_pes(pes: PES, transport_error_indicator: bool, transport_priority: bool, pid: int, transport_scrambling_control: int, continuity_counter: int) -> list[bytes]:
+  result: list[bytes] = []
+  begin = 0
+  while (begin < len(pes)):
+    next = min(len(pes), begin + (ts.PACKET_SIZE - ts.HEADER_SIZE))
+    packet = bytearray()
+    packet += bytes([
+      ts.SYNC_BYTE[0],
+      ((1 if transport_error_indicator else 0) << 7) | ((1 if begin == 0 else 0) << 6) | ((1 if transport_priority else 0) << 5) | ((pid & 0x1F00) >> 8),
+      (pid & 0x00FF),
+      (transport_scrambling_control << 6) | (0x30 if (ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin) else 0x10) | (continuity_counter & 0x0F),
+    ])
+    if (((ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin))):
+      packet += bytes([((ts.PACKET_SIZE - ts.HEADER_SIZE) - (next - begin)) - 1])
+    if (((ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin + 1))):
+      packet += b'\x00'
+    if (((ts.PACKET_SIZE - ts.HEADER_SIZE) > (next - begin + 2))):
+      packet += bytes([0xFF] * (((ts.PACKET_SIZE - ts.HEADER_SIZE) - (next - begin)) - 2))
+    packet += bytes(pes[begin:next])
+    result.append(bytes(packet))
+    continuity_counter = (continuity_counter + 1) & 0x0F
+    begin = next
+  return result
+
+def options(rng: random.Random) -> tuple[bool, bool, int, int, int]:
+  return (rng.random() < 0.5, rng.random() < 0.5, rng.randrange(0x2000), rng.randrange(4), rng.randrange(16))
+
+def test_packetize_pes():
+  # every stuffing length of last packet (0, 1, 2 and more bytes) and payload spanning packets
+  rng = random.Random(0)
+  sizes = [size - 14 for size in range(14, 14 + 184 * 3 + 2)] + [rng.randrange(0, 300000) for _ in range(20)]
+  for size in sizes:
+    data = pes(0xE0, rng.randrange(1 << 33), rng.randbytes(size), rng.random() < 0.5 and size < 65000)
+    for payload in [PES(data), PES([memoryview(data)[:10], memoryview(data)[10:]])]:
+      arguments = options(rng)
+      expected = legacy_packetize_pes(payload, *arguments)
+      assert packetize_pes(payload, *arguments) == expected
+      buffer, continuity_counter = packetize_pes_buffer(payload, *arguments)
+      assert buffer == b''.join(expected) and continuity_counter == (arguments[-1] + len(expected)) & 0x0F
+
+def test_packetize_section():
+  rng = random.Random(1)
+  for size in list(range(3, 184 * 3 + 2)) + [4096]:
+    section = Section(rng.randbytes(size))
+    arguments = options(rng)
+    expected = legacy_packetize_section(section, *arguments)
+    assert packetize_section(section, *arguments) == expected
+    buffer, continuity_counter = packetize_section_buffer(section, *arguments)
+    assert buffer == b''.join(expected) and continuity_counter == (arguments[-1] + len(expected)) & 0x0F
+
+    # template emits same packets for every continuity_counter
+    template = PacketizedSection(section, *arguments[:-1])
+    for continuity_counter in range(16):
+      assert template.packetize(continuity_counter) == (bytearray(b''.join(legacy_packetize_section(section, *arguments[:-1], continuity_counter))), (continuity_counter + len(expected)) & 0x0F)
@@ -0,0 +1,69 @@
+from biim.mpeg2ts import ts
+from biim.mpeg2ts.parser import SectionParser, PESParser
+from biim.mpeg2ts.pes import PES
+from biim.mpeg2ts.section import Section
+
+from tests.test_demuxer import crc32, packetize, pes, section
+
+def short_section(table_id: int, body: bytes) -> bytes:
+  length = len(body) + 4
+  data = bytes([table_id, 0x30 | (length >> 8), length & 0xFF]) + body
+  return data + crc32(data).to_bytes(4, byteorder='big')
+
+FIRST = section(0x42, 1, 0, b'\x01' * 20, 0, 1)
+SECOND = section(0x42, 1, 0, b'\x02' * 20, 1, 1)
+OTHER_EXTENSION = section(0x42, 2, 0, b'\x01' * 20, 0, 1)
+UPDATED = section(0x42, 1, 1, b'\x03' * 20, 0, 1)
+SHORT = short_section(0xFC, b'\x04' * 30)
+BROKEN = FIRST[:-1] + bytes([FIRST[-1] ^ 0xFF])
+
+def feed(parser: SectionParser, sections: list[bytes]) -> list[Section]:
+  result = []
+  for data in sections:
+    for packet in packetize(0x100, data, True): parser.push(packet)
+    result.extend(parser)
+  return result
+
+def test_section_repeat():
+  # repeats are identified per (table_id, table_id_extension, section_number), short form by table_id
+  sections = [FIRST, SECOND, OTHER_EXTENSION, FIRST, SECOND, OTHER_EXTENSION, SHORT, SHORT, UPDATED, FIRST]
+  changes: list[bytes] = []
+  parser = SectionParser[Section](Section, on_change=lambda section: changes.append(bytes(section.payload)))
+  result = feed(parser, sections)
+  assert [bytes(section.payload) for section in result] == sections
+  assert result[3] is result[0] and result[4] is result[1] and result[5] is result[2] and result[7] is result[6]
+  assert result[9] is not result[0] # UPDATED replaced FIRST in between
+  assert changes == [FIRST, SECOND, OTHER_EXTENSION, SHORT, UPDATED, FIRST]
+
+def test_section_suppress_repeat():
+  changes: list[bytes] = []
+  parser = SectionParser[Section](Section, repeat=False, on_change=lambda section: changes.append(bytes(section.payload)))
+  result = feed(parser, [FIRST, FIRST, BROKEN, FIRST, SHORT, SHORT, UPDATED, UPDATED])
+  # section with broken CRC is yielded but neither cached nor reported as change
+  assert [bytes(section.payload) for section in result] == [FIRST, BROKEN, SHORT, UPDATED]
+  assert [section.CRC32() == 0 for section in result] == [True, False, True, True]
+  assert changes == [FIRST, SHORT, UPDATED]
+
+def test_pes_reassembly():
+  # bounded PES completes on its last packet, unbounded one on next payload unit start
+  bounded, unbounded = pes(0xC0, 1000, b'\x05' * 1000, True), pes(0xE0, 2000, b'\x06' * 1000, False)
+  packets = packetize(0x101, bounded) + packetize(0x100, unbounded) + packetize(0x100, pes(0xE0, 3000, b'', False))
+  for source in ['bytes', 'reused bytearray']:
+    parser, result = PESParser[PES](PES), []
+    buffer = bytearray(ts.PACKET_SIZE)
+    for packet in packets:
+      if source == 'bytes':
+        parser.push(packet)
+      else: # mutable source is overwritten by next packet, so payload must not be kept as view
+        buffer[:] = packet
+        parser.push(buffer)
+      result.extend((data.pts(), bytes(data.PES_packet_data())) for data in parser)
+    assert result == [(1000, b'\x05' * 1000), (2000, b'\x06' * 1000)]
+
+def test_pes_keep_packets():
+  packets = packetize(0x100, pes(0xE0, 1000, b'\x07' * 500, False)) + packetize(0x100, pes(0xE0, 2000, b'', False))
+  parser = PESParser[PES](PES, keep_packets=True)
+  for index, packet in enumerate(packets):
+    parser.push(packet if index % 2 else bytearray(packet)) # mutable packets are kept as copies
+  result = list(parser)
+  assert len(result) == 1 and [bytes(packet) for packet in result[0].packets or []] == packets[:-1]
@@ -0,0 +1,124 @@
+import asyncio
+import io
+import random
+
+from biim.mpeg2ts import ts
+from biim.util.reader import BufferingAsyncReader, PacketAlignedAsyncReader
+
+class ChunkedReader:
+  # returns at most n bytes like asyncio.StreamReader.read, split at random points
+  def __init__(self, data: bytes, rng: random.Random):
+    self.data = data
+    self.rng = rng
+
+  async def read(self, n: int) -> bytes:
+    size = min(n, self.rng.randrange(1, ts.PACKET_SIZE * 4))
+    result, self.data = self.data[:size], self.data[size:]
+    return result
+
+def packet(rng: random.Random) -> bytes:
+  # payload without sync byte, so only packet heads can be locked onto
+  return ts.SYNC_BYTE + junk(rng, ts.PACKET_SIZE - 1)
+
+def junk(rng: random.Random, size: int) -> bytes:
+  return rng.randbytes(size).replace(ts.SYNC_BYTE, b'\x00')
+
+def collect(data: bytes, rng: random.Random, size: int, strides: int) -> list[bytes]:
+  async def run() -> list[bytes]:
+    return [bytes(packet) async for packet in PacketAlignedAsyncReader(ChunkedReader(data, rng), size, strides)]
+  return asyncio.run(run())
+
+def test_aligned_stream():
+  rng = random.Random(0)
+  packets = [packet(rng) for _ in range(64)]
+  for size in [ts.PACKET_SIZE, ts.PACKET_SIZE * 3 + 7, ts.PACKET_SIZE * 348]:
+    assert collect(b''.join(packets), rng, size, 3) == packets
+  # trailing partial packet is dropped
+  assert collect(b''.join(packets) + packets[0][:100], rng, ts.PACKET_SIZE * 4, 3) == packets
+
+def test_lone_sync_byte_in_junk():
+  rng = random.Random(1)
+  packets = [packet(rng) for _ in range(8)]
+  data = junk(rng, 50) + ts.SYNC_BYTE + junk(rng, 20) + b''.join(packets)
+  assert collect(data, rng, ts.PACKET_SIZE * 2, 3) == packets
+
+def test_resync_fuzz():
+  # runs of packets separated by junk or broken sync bytes, every run must be recovered
+  rng = random.Random(2)
+  for _ in range(300):
+    strides = rng.randrange(1, 5)
+    data, expected = b'', []
+    for run in range(rng.randrange(1, 6)):
+      if run > 0 or rng.random() < 0.5:
+        if rng.random() < 0.5:
+          data += junk(rng, rng.randrange(1, ts.PACKET_SIZE * 3))
+        else:
+          broken = packet(rng)
+          data += junk(rng, 1) + broken[1:]
+      for _ in range(rng.randrange(strides + 1, strides + 8)):
+        expected.append(packet(rng))
+        data += expected[-1]
+    size = rng.choice([ts.PACKET_SIZE, ts.PACKET_SIZE * 5 + rng.randrange(1, ts.PACKET_SIZE), ts.PACKET_SIZE * 348])
+    assert collect(data, rng, size, strides) == expected
+
+def test_ring_wraparound():
+  # capacity is not a multiple of the packet size, so the tail wraps at every offset
+  rng = random.Random(3)
+  for capacity in [ts.PACKET_SIZE * 2 + 1, ts.PACKET_SIZE * 3 + 50, 1000]:
+    data = b''.join(packet(rng) for _ in range(200))
+
+    async def run() -> None:
+      # readexactly may ask for more than high_water and must wake the paused thread
+      reader = BufferingAsyncReader(io.BytesIO(data), rng.randrange(1, 300), capacity, capacity - rng.randrange(0, 300), rng.randrange(0, 200))
+      position = 0
+      while position < len(data):
+        operation = rng.randrange(3) if position % ts.PACKET_SIZE == 0 else rng.randrange(2)
+        if operation == 0:
+          result = bytes(await reader.read(rng.randrange(1, 400)))
+          assert 0 < len(result)
+        elif operation == 1:
+          n = rng.randrange(1, min(capacity, len(data) - position) + 1)
+          result = bytes(await reader.readexactly(n))
+          assert len(result) == n
+        else:
+          count = rng.choice([None, 1, 2])
+          view = await reader.read_packets(count)
+          assert len(view) % ts.PACKET_SIZE == 0 and 0 < len(view) and (count is None or len(view) <= count * ts.PACKET_SIZE)
+          result = bytes(view)
+        assert result == data[position:position + len(result)]
+        position += len(result)
+      assert bytes(await reader.read(1)) == b''
+      assert len(await reader.read_packets()) == 0
+
+    asyncio.run(run())
+
+def test_ring_incomplete_read():
+  async def run() -> None:
+    reader = BufferingAsyncReader(io.BytesIO(b'\x01' * 300), 64, 256)
+    assert bytes(await reader.readexactly(200)) == b'\x01' * 200
+    try:
+      await reader.readexactly(200)
+      assert False
+    except asyncio.IncompleteReadError as e:
+      assert e.partial == b'\x01' * 100
+  asyncio.run(run())
+
+def test_ring_aligned_fuzz():
+  # packet aligned reads out of the ring, chunks are kept by consumers so they must stay intact
+  rng = random.Random(4)
+  for _ in range(100):
+    data, expected = junk(rng, rng.randrange(0, 100)), []
+    for index in range(rng.randrange(1, 4)):
+      if index > 0: data += junk(rng, rng.randrange(1, ts.PACKET_SIZE * 2))
+      for _ in range(rng.randrange(4, 40)):
+        expected.append(packet(rng))
+        data += expected[-1]
+    capacity = rng.randrange(ts.PACKET_SIZE * 2, ts.PACKET_SIZE * 8)
+
+    async def run() -> list[memoryview]:
+      aligned = PacketAlignedAsyncReader(BufferingAsyncReader(io.BytesIO(data), rng.randrange(1, 500), capacity), rng.randrange(1, ts.PACKET_SIZE * 4))
+      return [chunk async for chunk in aligned.chunks()]
+
+    chunks = asyncio.run(run())
+    assert all(len(chunk) % ts.PACKET_SIZE == 0 for chunk in chunks)
+    assert [bytes(chunk[begin:begin + ts.PACKET_SIZE]) for chunk in chunks for begin in range(0, len(chunk), ts.PACKET_SIZE)] == expected
@@ -0,0 +1,85 @@
+import asyncio
+import random
+from typing import AsyncIterator
+
+from biim.hls.segment import Segment
+
+async def drain(stream: AsyncIterator[list[bytes | bytearray | memoryview]]) -> bytes:
+  result = bytearray()
+  async for chunks in stream: result += b''.join(chunks)
+  return bytes(result)
+
+def test_segment_concurrent_readers():
+  # readers join at random points while segment is written, each gets whole bytes of segment and its part
+  async def run():
+    rng = random.Random(0)
+    for _ in range(50):
+      segment = Segment(0, True)
+      readers: list[asyncio.Task[bytes]] = []
+      partial_readers: list[tuple[int, asyncio.Task[bytes]]] = []
+      scratch = bytearray(64) # reused by producer, mutable view is copied on push
+      for part in range(rng.randrange(1, 6)):
+        if part > 0:
+          segment.completePartial(part * 9000)
+          segment.newPartial(part * 9000)
+        for _ in range(rng.randrange(0, 8)):
+          if rng.random() < 0.3: readers.append(asyncio.create_task(drain(segment.stream())))
+          if rng.random() < 0.3: partial_readers.append((part, asyncio.create_task(drain(segment.partials[-1].stream()))))
+          kind = rng.randrange(4)
+          if kind == 0: segment.push(rng.randbytes(rng.randrange(1, 64)))
+          elif kind == 1: segment.push(bytearray(rng.randbytes(rng.randrange(1, 64))))
+          elif kind == 2:
+            scratch[:] = rng.randbytes(64)
+            segment.push(memoryview(scratch)[:rng.randrange(1, 64)])
+          else: segment.push([rng.randbytes(rng.randrange(1, 64)) for _ in range(rng.randrange(1, 4))])
+          await asyncio.sleep(0) # readers consume between pushes
+      readers.append(asyncio.create_task(drain(segment.stream())))
+      segment.complete(rng.randrange(1, 6) * 9000 + 9000)
+      readers.append(asyncio.create_task(drain(segment.stream())))
+
+      expected = b''.join(segment.buffers())
+      assert len(expected) == segment.size == sum(partial.size for partial in segment)
+      assert all(type(chunk) is bytes for chunk in segment.buffers()) # frozen
+      for result in await asyncio.gather(*readers): assert result == expected
+      for part, task in partial_readers: assert await task == b''.join(segment.partials[part].chunks)
+  asyncio.run(run())
+
+def test_segment_reader_cancel():
+  # readers wait on one shared future, cancelling one of them must not affect others
+  async def run():
+    segment = Segment(0, True)
+    first, second = asyncio.create_task(drain(segment.stream())), asyncio.create_task(drain(segment.stream()))
+    segment.push(b'a')
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    segment.push(b'b')
+    segment.completePartial(9000)
+    segment.newPartial(9000)
+    segment.push(bytearray(b'c'))
+    segment.complete(18000)
+    assert await second == b'abc'
+    assert first.cancelled()
+    assert segment.size == 3 and [partial.size for partial in segment] == [2, 1]
+  asyncio.run(run())
+
+def test_segment_write_window():
+  # chunks pushed while reader waits for write window are yielded at once
+  async def run():
+    segment = Segment(0, True)
+    writes: list[list[bytes | bytearray | memoryview]] = []
+    async def read():
+      async for chunks in segment.stream(0.05): writes.append(chunks)
+    reader = asyncio.create_task(read())
+    await asyncio.sleep(0)
+    for data in [b'a', b'b', b'c']:
+      segment.push(data)
+      await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+    segment.completePartial(9000)
+    segment.newPartial(9000)
+    segment.push(b'd')
+    segment.complete(18000)
+    await reader
+    assert writes[0] == [b'a', b'b', b'c'] and b''.join(b''.join(chunks) for chunks in writes) == b'abcd'
+  asyncio.run(run())
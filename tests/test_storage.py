@@ -0,0 +1,148 @@
+import asyncio
+import os
+import random
+from typing import cast
+
+from biim.hls.m3u8 import M3U8, enforce_memory_budget
+from biim.hls.segment import Segment
+from biim.hls.storage import SegmentStorage, PINNED_SEGMENTS
+
+from tests.test_segment import drain
+
+async def settle(storage: SegmentStorage) -> None:
+  # writes and removes are ordered on single worker, done callbacks run on next iterations
+  await asyncio.get_running_loop().run_in_executor(storage.executor, lambda: None)
+  for _ in range(3): await asyncio.sleep(0)
+
+def produce(m3u8: M3U8, rng: random.Random, segments: int, pts: int = 0) -> int:
+  for _ in range(segments):
+    for part in range(3):
+      if part > 0: m3u8.continuousPartial(pts)
+      for _ in range(rng.randrange(1, 4)): m3u8.push(rng.randbytes(rng.randrange(1, 200)))
+      pts += 9000
+    m3u8.continuousSegment(pts)
+  return pts
+
+def test_storage_spill(tmp_path):
+  # completed segments are written, collapsed once neither pinned nor recently used, and removed with eviction
+  async def run():
+    rng = random.Random(0)
+    storage = SegmentStorage(str(tmp_path), memory_segments=2)
+    m3u8 = M3U8(target_duration=1, part_target=0.3, window_size=8, storage=storage)
+    m3u8.continuousSegment(0)
+    pts = produce(m3u8, rng, 7)
+    expected = { m3u8.media_sequence + index: b''.join(segment.buffers()) for index, segment in enumerate(m3u8.segments) }
+    await settle(storage)
+
+    completed = list(m3u8.segments)[:-1]
+    assert storage.errors == 0
+    assert storage.written_bytes == sum(segment.size for segment in completed)
+    assert storage.spilled_segments == len(completed) - PINNED_SEGMENTS
+    for index, segment in enumerate(completed):
+      msn = m3u8.media_sequence + index
+      assert segment.size == len(expected[msn])
+      with open(storage.paths[segment], 'rb') as file: assert file.read() == expected[msn]
+      if index < len(completed) - PINNED_SEGMENTS:
+        # collapsed to path, size and rendered lines
+        assert segment.partials == [] and segment.rendered is not None
+        assert m3u8.spilled(msn) == storage.paths[segment]
+        assert await drain(await m3u8.segment(msn)) == expected[msn] # type: ignore
+        assert (await m3u8.partial(msn, 0)) is None
+        future = m3u8.blocking(msn, 1)
+        assert future is not None and future.done()
+      else:
+        # latest ones keep their parts for playlist tail
+        assert len(segment.partials) == 3 and m3u8.spilled(msn) is None
+
+    # requested spilled segment is served from file, not brought back in memory
+    assert completed[0] not in storage.resident and completed[0].spill is not None
+
+    # evicted from outdated, file is removed
+    first = completed[0]
+    path = storage.paths[first]
+    produce(m3u8, rng, 16, pts)
+    await settle(storage)
+    assert first not in storage.paths and not os.path.exists(path)
+    assert len(storage.paths) == len(m3u8.segments) + len(m3u8.outdated) - 1
+    assert sorted(os.listdir(storage.directory)) == sorted(os.path.basename(path) for path in storage.paths.values())
+    storage.close()
+    assert not os.path.exists(storage.directory)
+  asyncio.run(run())
+
+def test_storage_resident(tmp_path):
+  # recently requested segment is kept in memory until pushed out of LRU by newer ones
+  async def run():
+    rng = random.Random(1)
+    storage = SegmentStorage(str(tmp_path), memory_segments=PINNED_SEGMENTS + 2)
+    m3u8 = M3U8(target_duration=1, part_target=0.3, storage=storage)
+    m3u8.continuousSegment(0)
+    pts = produce(m3u8, rng, 2)
+    await settle(storage)
+    first, second = m3u8.segments[0], m3u8.segments[1]
+    assert await m3u8.segment(m3u8.media_sequence) is not None # requested before unpinned
+    pts = produce(m3u8, rng, PINNED_SEGMENTS + 1, pts)
+    await settle(storage)
+    assert first.spill is None and len(first.partials) == 3
+    assert second.spill is not None and second.partials == []
+    produce(m3u8, rng, 1, pts)
+    await settle(storage)
+    assert first.spill is not None and first.partials == []
+    assert storage.spilled_segments == 2
+    storage.close()
+  asyncio.run(run())
+
+def test_storage_reader_collapse(tmp_path):
+  # reader suspended inside a part continues from file after segment is collapsed
+  async def run():
+    rng = random.Random(2)
+    storage = SegmentStorage(str(tmp_path), memory_segments=0)
+    m3u8 = M3U8(target_duration=1, part_target=0.3, storage=storage)
+    m3u8.continuousSegment(0)
+    m3u8.push(b'a')
+    segment = m3u8.segments[0]
+    reader = segment.stream()
+    assert await reader.__anext__() == [b'a']
+    m3u8.push(b'b')
+    produce(m3u8, rng, PINNED_SEGMENTS + 1, 9000)
+    await settle(storage)
+    assert segment.partials == [] and segment.spill is not None
+    rest = await drain(reader)
+    with open(segment.spill[0], 'rb') as file: assert b'a' + rest == file.read()
+    assert len(rest) + 1 == segment.size
+    storage.close()
+  asyncio.run(run())
+
+def test_storage_memory_budget(tmp_path):
+  # with storage oldest segment in memory is released to disk instead of dropped, spilled ones are skipped
+  async def run():
+    rng = random.Random(3)
+    storage = SegmentStorage(str(tmp_path), memory_segments=100)
+    m3u8 = M3U8(target_duration=1, part_target=0.3, window_size=8, storage=storage)
+    m3u8.continuousSegment(0)
+    pts = produce(m3u8, rng, 12)
+    await settle(storage)
+    stored = [*reversed(m3u8.outdated), *m3u8.segments][:-1] # msn order
+    assert storage.spilled_segments == 0 and m3u8.buffered() == sum(segment.size for segment in stored)
+
+    # all but pinned are released, nothing is dropped
+    assert enforce_memory_budget([m3u8], 0) == len(stored) - PINNED_SEGMENTS
+    assert [segment.spill is not None for segment in stored] == [True] * (len(stored) - PINNED_SEGMENTS) + [False] * PINNED_SEGMENTS
+    assert m3u8.buffered() == sum(segment.size for segment in stored[-PINNED_SEGMENTS:])
+    assert m3u8.eviction_order() is None and m3u8.evict() == 0
+    assert len(m3u8.outdated) == 5 and m3u8.media_sequence == 5
+
+    # spilled outdated ones are skipped, oldest in memory goes first, then window
+    produce(m3u8, rng, 5, pts)
+    await settle(storage)
+    assert m3u8.media_sequence == 10 and all(segment.spill is not None for segment in list(m3u8.outdated)[2:])
+    for msn in [8, 9, 10]:
+      segment = cast(Segment, m3u8.find(msn))
+      assert segment.spill is None and m3u8.eviction_order() == (msn >= m3u8.media_sequence, segment.program_date_time)
+      buffered = m3u8.buffered()
+      assert m3u8.evict() == segment.size and segment.spill is not None and m3u8.buffered() == buffered - segment.size
+    # requested segment is released too
+    segment = cast(Segment, m3u8.find(11))
+    assert await m3u8.segment(11) is not None and segment in storage.resident
+    assert m3u8.evict() == segment.size and segment not in storage.resident
+    storage.close()
+  asyncio.run(run())